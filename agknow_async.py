@@ -0,0 +1,1036 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowAsync
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import absolute_import
+
+from builtins import object
+import asyncio
+import base64
+import json
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+from requests.structures import CaseInsensitiveDict
+
+from . import agknow_http
+from .agknow_http import Cancelled, CircuitOpen, HttpError
+
+# engines of the worker jobs: blocking requests in thread pools or coroutines on the shared event loop
+ENGINE_THREADS = "threads"
+ENGINE_ASYNCIO = "asyncio"
+DEFAULT_ENGINE = ENGINE_THREADS
+
+# defaults of the asynchronous HTTP client
+DEFAULT_ASYNC_CONNECTIONS = 64      # maximum number of open connections per host
+DEFAULT_ASYNC_IN_FLIGHT = 1000      # maximum number of concurrent requests of all jobs
+
+# size of the chunks in which response bodies are read
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class HttpProtocolError(Exception):
+    """
+     Raised if a response of the server cannot be parsed.
+    """
+    pass
+
+
+class ProxyError(ConnectionError):
+    """
+     Raised if the proxy refuses the tunnel (CONNECT) to the host; retried like a connection error.
+    """
+    pass
+
+
+class _StaleConnection(ConnectionError):
+    """
+     The server closed the connection before it sent a response.
+    """
+    pass
+
+
+class AsyncResponse(object):
+    """
+     Response of the AsyncHttpClient; the body has been read completely.
+    """
+    def __init__(self, status_code, reason, headers, content):
+        """
+         Constructor
+
+        :param status_code: HTTP status code (integer)
+        :param reason: reason phrase (string)
+        :param headers: response headers (CaseInsensitiveDict)
+        :param content: body (bytes)
+        """
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        """
+         Returns the body as string (in the charset of the Content-Type, UTF-8 by default).
+        """
+        charset = "utf-8"
+
+        for param in self.headers.get("Content-Type", "").split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "charset" and value:
+                charset = value.strip('"')
+
+        return self.content.decode(charset, errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def close(self):
+        pass
+
+
+class _Connection(object):
+    """
+     Open (keep-alive) connection of the AsyncHttpClient.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class AsyncHttpClient(object):
+    """
+     Minimal asynchronous HTTP/1.1 client on asyncio streams (no additional dependencies) with keep-alive connection
+     pools per host. Thousands of requests may be in flight on the single thread of the event loop; they are
+     bounded by max_in_flight and by max_connections per host.
+
+     Retries, backoff, rate limit, timeout budgets, circuit breakers and statistics are shared with the
+     (blocking) AgknowHttpSession, so both engines behave the same against the agknow host.
+
+     Proxies are taken from the requests session (AgknowHttpSession.session.proxies) and from the environment
+     (http_proxy, https_proxy, no_proxy; see urllib.request.getproxies()) as with requests: http URLs are sent to
+     the proxy with the absolute URL, https URLs through a CONNECT tunnel. Only http:// proxies are supported.
+
+     Must only be used on one event loop; see EventLoopThread.
+    """
+    def __init__(self, session=None, max_connections=DEFAULT_ASYNC_CONNECTIONS, max_in_flight=DEFAULT_ASYNC_IN_FLIGHT):
+        """
+         Constructor
+
+        :param session: AgknowHttpSession which provides the retry policy, the rate limiter, the circuit breakers,
+                        the timeouts and the statistics; defaults to the shared session
+        :param max_connections: maximum number of open connections per host (integer)
+        :param max_in_flight: maximum number of concurrent requests (integer)
+        """
+        self._session = session
+        self.max_connections = max(int(max_connections), 1)
+        self.max_in_flight = max(int(max_in_flight), 1)
+
+        # {(scheme, host, port, verify, proxy): [idle _Connection]}
+        self._idle = {}
+        # {(scheme, host, port, verify, proxy): asyncio.Semaphore}; created on the event loop
+        self._slots = {}
+        self._in_flight = None
+
+        self._ssl_contexts = {}
+
+        # {(scheme, host): proxy URL or None}
+        self._proxies = {}
+
+    @property
+    def session(self):
+        # the shared session may be replaced by configure_session()
+        return self._session if self._session is not None else agknow_http.get_session()
+
+    async def get(self, url, headers=None, verify=True, cancel_token=None, timeout=None, sink=None):
+        """
+         Performs a HTTP GET request; see AgknowHttpSession.get().
+
+        :param url: URL for the HTTP GET request
+        :param headers: request headers (dict)
+        :param verify: verify the TLS certificate of the host (boolean)
+        :param cancel_token: agknow_http.CancelToken of the job (optional)
+        :param timeout: tuple (connect, read) timeout in seconds; defaults to the timeout of the endpoint
+        :param sink: object with write(bytes) and reset() (e.g. agknow_vsimem.VsimemWriter) which receives the body
+                     of a 200 response chunk by chunk instead of AsyncResponse.content (optional)
+
+        :return: AsyncResponse; the last response if the request is still throttled or failing after all retries
+        """
+        return await self._retry("GET", url, None, headers, verify, cancel_token, timeout, idempotent=True,
+                                 sink=sink)
+
+    async def post(self, url, data, headers=None, verify=True, cancel_token=None, timeout=None):
+        """
+         Performs a HTTP POST request; it is only retried if it has been throttled (429).
+
+        :param url: URL for the HTTP POST request
+        :param data: body (string or bytes)
+        :param headers: request headers (dict)
+        :param verify: verify the TLS certificate of the host (boolean)
+        :param cancel_token: agknow_http.CancelToken of the job (optional)
+        :param timeout: tuple (connect, read) timeout in seconds; defaults to the timeout of the endpoint
+
+        :return: AsyncResponse
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        return await self._retry("POST", url, data, headers, verify, cancel_token, timeout, idempotent=False)
+
+    async def wait_for_host(self, url, cancel_token=None, timeout=None):
+        """
+         Waits (without blocking the event loop) until the host of the given URL may be requested again;
+         see AgknowHttpSession.wait_for_host().
+
+        :return: True if the host may be requested again, False on timeout
+        """
+        session = self.session
+        breaker = session.breaker(url)
+
+        end = time.monotonic() + (timeout if timeout is not None else session.breaker_max_pause)
+
+        while not breaker.wait(0):
+            if time.monotonic() >= end:
+                return False
+
+            await sleep(0.2, cancel_token)
+
+        return True
+
+    async def close(self):
+        """
+         Closes all idle connections.
+        """
+        for connections in self._idle.values():
+            for conn in connections:
+                conn.close()
+
+        self._idle.clear()
+
+    async def _retry(self, method, url, body, headers, verify, cancel_token, timeout, idempotent, sink=None):
+        session = self.session
+
+        connect_timeout, read_timeout, budget = session.timeouts.get(agknow_http.endpoint(url),
+                                                                     session.timeouts["default"])
+        if timeout is not None:
+            connect_timeout, read_timeout = timeout
+
+        breaker = session.breaker(url)
+
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            wait = session.rate_limiter.reserve()
+            while wait > 0:
+                await sleep(wait, cancel_token)
+                wait = session.rate_limiter.reserve()
+
+            if not breaker.allow():
+                raise CircuitOpen(breaker.host, breaker.retry_in())
+
+            resp = None
+            error = None
+            try:
+                if cancel_token is not None:
+                    cancel_token.check()
+
+                resp = await self._request(method, url, body, headers, verify, connect_timeout, read_timeout, sink)
+
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpProtocolError) as e:
+                error = e
+                host_failed = True
+                throttled = False
+                retryable = idempotent
+
+            except BaseException:
+                # cancelled: the request tells nothing about the host
+                breaker.release()
+                raise
+
+            else:
+                host_failed = resp.status_code in agknow_http.HOST_FAILURE_STATUSES
+
+                if not host_failed and resp.status_code != 429:
+                    breaker.success()
+
+                if resp.status_code not in session.retry_policy.statuses:
+                    return resp
+
+                throttled = resp.status_code == 429
+                retryable = idempotent or throttled
+
+            delay = session.retry_policy.delay(attempt, resp)
+
+            if throttled:
+                session.rate_limiter.pause(delay)
+
+            if not retryable or attempt >= session.retry_policy.max_retries or \
+                    time.monotonic() - start + delay > budget:
+                # the breaker counts failed requests, not failed attempts
+                if host_failed:
+                    breaker.failure()
+                else:
+                    breaker.release()
+
+                if error is not None:
+                    raise error
+
+                return resp
+
+            session.stats.request_retried(throttled)
+
+            # the retry is reported to the breaker as a new attempt
+            breaker.release()
+
+            await sleep(delay, cancel_token)
+            attempt += 1
+
+    async def _request(self, method, url, body, headers, verify, connect_timeout, read_timeout, sink=None):
+        parts = urlsplit(url)
+
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("Unsupported URL scheme: {0}".format(parts.scheme))
+
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        proxy = self.proxy_for(parts.scheme, parts.hostname)
+        key = (parts.scheme, parts.hostname, port, bool(verify), proxy)
+
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        lines = []
+
+        if proxy is not None and parts.scheme == "http":
+            # plain HTTP goes to the proxy with the absolute URL; https is tunneled (see _connection())
+            lines.append("{0} http://{1}{2} HTTP/1.1".format(method, parts.netloc, path))
+
+            auth = self._proxy_auth(proxy)
+            if auth is not None:
+                lines.append(auth)
+        else:
+            lines.append("{0} {1} HTTP/1.1".format(method, path))
+
+        lines += ["Host: {0}".format(parts.netloc),
+                  "User-Agent: agknow-qgis",
+                  "Accept-Encoding: identity",
+                  "Connection: keep-alive"]
+
+        for name, value in (headers or {}).items():
+            lines.append("{0}: {1}".format(name, value))
+
+        if body is not None:
+            lines.append("Content-Length: {0}".format(len(body)))
+
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        async with self._in_flight, self._host_slot(key):
+
+            while True:
+                conn = await self._connection(key, connect_timeout)
+
+                try:
+                    self.session.stats.request_sent()
+
+                    conn.writer.write(request)
+                    await asyncio.wait_for(conn.writer.drain(), read_timeout)
+
+                    resp, keep_alive = await self._read_response(conn, method, read_timeout, sink)
+
+                except ConnectionError:
+                    conn.close()
+
+                    # the server closed an idle keep-alive connection: send the request on a new one
+                    if conn.reused:
+                        continue
+                    raise
+
+                except BaseException:
+                    conn.close()
+                    raise
+
+                if keep_alive:
+                    self._release(key, conn)
+                else:
+                    conn.close()
+
+                return resp
+
+    def _host_slot(self, key):
+        slot = self._slots.get(key)
+
+        if slot is None:
+            slot = self._slots[key] = asyncio.Semaphore(self.max_connections)
+
+        return slot
+
+    async def _connection(self, key, connect_timeout):
+        idle = self._idle.get(key)
+
+        while idle:
+            conn = idle.pop()
+
+            if not conn.reader.at_eof() and not conn.writer.is_closing():
+                conn.reused = True
+                return conn
+
+            conn.close()
+
+        scheme, host, port, verify, proxy = key
+
+        ssl_context = self._ssl_context(verify) if scheme == "https" else None
+
+        if proxy is None:
+            connect = asyncio.open_connection(host, port, ssl=ssl_context,
+                                              server_hostname=host if ssl_context else None,
+                                              limit=READ_CHUNK_SIZE * 4)
+        elif scheme == "http":
+            proxy_parts = urlsplit(proxy)
+            connect = asyncio.open_connection(proxy_parts.hostname, proxy_parts.port or 80,
+                                              limit=READ_CHUNK_SIZE * 4)
+        else:
+            connect = self._open_tunnel(proxy, host, port, ssl_context)
+
+        reader, writer = await asyncio.wait_for(connect, connect_timeout)
+
+        self.session.stats.connection_opened()
+
+        return _Connection(reader, writer)
+
+    def proxy_for(self, scheme, host):
+        """
+         Returns the proxy for requests to the given host like requests: the proxies of the session first, then
+         the proxies of the environment unless the host is excluded by no_proxy. Resolved once per host.
+
+        :param scheme: "http" or "https"
+        :param host: host name
+
+        :return: proxy URL (string) or None for a direct connection
+        """
+        key = (scheme, host)
+
+        if key in self._proxies:
+            return self._proxies[key]
+
+        proxies = dict(self.session.session.proxies or {})
+        proxy = proxies.get("{0}://{1}".format(scheme, host)) or proxies.get(scheme) or proxies.get("all")
+
+        if proxy is None and self.session.session.trust_env and not proxy_bypass(host):
+            proxies = getproxies()
+            proxy = proxies.get(scheme) or proxies.get("all")
+
+        if proxy is not None:
+            if "://" not in proxy:
+                proxy = "http://" + proxy
+
+            if urlsplit(proxy).scheme != "http":
+                raise ValueError("Unsupported proxy scheme: {0}".format(urlsplit(proxy).scheme))
+
+        self._proxies[key] = proxy
+
+        return proxy
+
+    def _proxy_auth(self, proxy):
+        parts = urlsplit(proxy)
+
+        if parts.username is None:
+            return None
+
+        credentials = "{0}:{1}".format(unquote(parts.username), unquote(parts.password or ""))
+
+        return "Proxy-Authorization: Basic {0}".format(base64.b64encode(credentials.encode("utf-8")).decode("ascii"))
+
+    async def _open_tunnel(self, proxy, host, port, ssl_context):
+        """
+         Opens a CONNECT tunnel through the given proxy to host:port and starts TLS on it.
+
+        :return: tuple of asyncio.StreamReader and asyncio.StreamWriter
+        """
+        loop = asyncio.get_running_loop()
+
+        proxy_parts = urlsplit(proxy)
+        proxy_host, proxy_port = proxy_parts.hostname, proxy_parts.port or 80
+
+        sock = await self._connect_socket(proxy_host, proxy_port)
+
+        try:
+            lines = ["CONNECT {0}:{1} HTTP/1.1".format(host, port),
+                     "Host: {0}:{1}".format(host, port)]
+
+            auth = self._proxy_auth(proxy)
+            if auth is not None:
+                lines.append(auth)
+
+            await loop.sock_sendall(sock, ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+            # the proxy sends nothing after its response until the TLS handshake has started
+            response = b""
+            while b"\r\n\r\n" not in response:
+                chunk = await loop.sock_recv(sock, 4096)
+
+                if not chunk or len(response) > 64 * 1024:
+                    raise ProxyError("Invalid response of the proxy {0}:{1}".format(proxy_host, proxy_port))
+
+                response += chunk
+
+            status_line = response.split(b"\r\n", 1)[0].decode("latin-1")
+            status = (status_line.split(" ", 2) + [""])[1]
+
+            if status != "200":
+                raise ProxyError("CONNECT to {0}:{1} refused by the proxy {2}:{3}: {4}".format(
+                    host, port, proxy_host, proxy_port, status_line))
+
+            return await asyncio.open_connection(sock=sock, ssl=ssl_context,
+                                                 server_hostname=host if ssl_context else None,
+                                                 limit=READ_CHUNK_SIZE * 4)
+
+        except BaseException:
+            sock.close()
+            raise
+
+    async def _connect_socket(self, host, port):
+        loop = asyncio.get_running_loop()
+
+        error = None
+
+        for family, type_, proto, _, address in await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+            sock = socket.socket(family, type_, proto)
+            sock.setblocking(False)
+
+            try:
+                await loop.sock_connect(sock, address)
+                return sock
+
+            except OSError as e:
+                sock.close()
+                error = e
+
+            except BaseException:
+                sock.close()
+                raise
+
+        raise error if error is not None else OSError("Cannot resolve {0}".format(host))
+
+    def _release(self, key, conn):
+        idle = self._idle.setdefault(key, [])
+
+        if len(idle) < self.max_connections:
+            conn.reused = False
+            idle.append(conn)
+        else:
+            conn.close()
+
+    def _ssl_context(self, verify):
+        context = self._ssl_contexts.get(verify)
+
+        if context is None:
+            context = ssl.create_default_context()
+
+            if not verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+
+            self._ssl_contexts[verify] = context
+
+        return context
+
+    async def _read_response(self, conn, method, read_timeout, sink=None):
+        reader = conn.reader
+
+        while True:
+            status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+
+            if not status_line:
+                raise _StaleConnection()
+
+            try:
+                version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+                status = int(status)
+            except ValueError:
+                raise HttpProtocolError("Invalid status line: {0!r}".format(status_line[:100]))
+
+            headers = CaseInsensitiveDict()
+
+            while True:
+                line = await asyncio.wait_for(reader.readline(), read_timeout)
+
+                if line in (b"\r\n", b"\n"):
+                    break
+                if not line:
+                    raise asyncio.IncompleteReadError(b"", None)
+
+                name, _, value = line.decode("latin-1").partition(":")
+                value = value.strip()
+
+                if name in headers:
+                    headers[name] = headers[name] + ", " + value
+                else:
+                    headers[name] = value
+
+            # interim responses (100 Continue)
+            if 100 <= status < 200:
+                continue
+
+            break
+
+        keep_alive = version == "HTTP/1.1" and headers.get("Connection", "").lower() != "close"
+
+        chunks = []
+
+        # the body of a successful response goes into the sink; a sink is reset for every attempt
+        if sink is not None and status == 200:
+            sink.reset()
+            write = sink.write
+        else:
+            write = chunks.append
+
+        if method == "HEAD" or status in (204, 304):
+            pass
+
+        elif "chunked" in headers.get("Transfer-Encoding", "").lower():
+            await self._read_chunked(reader, read_timeout, write)
+
+        elif "Content-Length" in headers:
+            try:
+                length = int(headers["Content-Length"])
+            except ValueError:
+                raise HttpProtocolError("Invalid Content-Length: {0}".format(headers["Content-Length"]))
+
+            await self._read_exactly(reader, length, read_timeout, write)
+
+        else:
+            # the body ends with the connection
+            while True:
+                chunk = await asyncio.wait_for(reader.read(READ_CHUNK_SIZE), read_timeout)
+                if not chunk:
+                    break
+                write(chunk)
+
+            keep_alive = False
+
+        return AsyncResponse(status, reason, headers, b"".join(chunks)), keep_alive
+
+    async def _read_exactly(self, reader, length, read_timeout, write):
+        while length > 0:
+            chunk = await asyncio.wait_for(reader.readexactly(min(length, READ_CHUNK_SIZE)), read_timeout)
+            write(chunk)
+            length -= len(chunk)
+
+    async def _read_chunked(self, reader, read_timeout, write):
+        while True:
+            line = await asyncio.wait_for(reader.readline(), read_timeout)
+
+            try:
+                size = int(line.split(b";")[0].strip(), 16)
+            except ValueError:
+                raise HttpProtocolError("Invalid chunk size: {0!r}".format(line[:100]))
+
+            if size == 0:
+                # trailer
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), read_timeout)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                break
+
+            await self._read_exactly(reader, size, read_timeout, write)
+            await asyncio.wait_for(reader.readexactly(2), read_timeout)
+
+
+class AgknowAsyncClient(object):
+    """
+     Asynchronous client of the agknow API: the coroutines correspond to the methods of AgknowUtils (parcel list,
+     detail data, raster list, raster, register) and return the same results. AgknowUtils provides the API version,
+     the parsing, the bbox cache and the metadata cache.
+    """
+    def __init__(self, utils, http=None, ssl_verify=True, cancel_token=None):
+        """
+         Constructor
+
+        :param utils: AgknowUtils
+        :param http: AsyncHttpClient; defaults to the client of the shared event loop
+        :param ssl_verify: verify the TLS certificate of the host (boolean)
+        :param cancel_token: agknow_http.CancelToken of the job (optional)
+        """
+        self.utils = utils
+        self.http = http if http is not None else get_event_loop_thread().http
+        self.ssl_verify = ssl_verify
+        self.cancel_token = cancel_token
+
+    async def http_get(self, base_url, params="", return_raw=False):
+        """
+         Performs a HTTP GET request; see AgknowUtils.sync_http_get().
+        """
+        try:
+            resp = await self.http.get(base_url + params, verify=self.ssl_verify, cancel_token=self.cancel_token)
+
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpProtocolError) as e:
+            # never put the URL parameters into the message: they contain the API key
+            raise HttpError("GET {0} failed: {1}".format(base_url, type(e).__name__))
+
+        if resp.status_code == 200:
+            return resp.content if return_raw else resp.text
+
+        return self.utils.handle_error_response("GET", base_url, resp)
+
+    async def cached_http_get(self, base_url, params="", use_ttl=False):
+        """
+         Performs a HTTP GET request through the metadata cache; see AgknowUtils.cached_http_get().
+        """
+        cache = self.utils.metadata_cache
+
+        if cache is None:
+            return await self.http_get(base_url, params)
+
+        url = base_url + params
+
+        body, headers = cache.lookup(url, use_ttl=use_ttl)
+
+        if body is not None:
+            return body
+
+        try:
+            resp = await self.http.get(url, headers=headers, verify=self.ssl_verify, cancel_token=self.cancel_token)
+
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpProtocolError) as e:
+            raise HttpError("GET {0} failed: {1}".format(base_url, type(e).__name__))
+
+        if resp.status_code == 304:
+            body = cache.not_modified(url, resp.headers)
+
+            if body is not None:
+                return body
+
+            # evicted in the meantime
+            return await self.http_get(base_url, params)
+
+        if resp.status_code == 200:
+            cache.put(url, resp.text, resp.headers)
+
+            return resp.text
+
+        return self.utils.handle_error_response("GET", base_url, resp)
+
+    async def http_post(self, base_url, params="", postdata=""):
+        """
+         Performs a HTTP POST request with JSON data; see AgknowUtils.sync_http_post().
+        """
+        try:
+            resp = await self.http.post(base_url + params, postdata, headers={"Content-type": "application/json"},
+                                        verify=self.ssl_verify, cancel_token=self.cancel_token)
+
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpProtocolError) as e:
+            raise HttpError("POST {0} failed: {1}".format(base_url, type(e).__name__))
+
+        if resp.status_code == 200:
+            return resp.text
+
+        return self.utils.handle_error_response("POST", base_url, resp)
+
+    async def get_parcel_page(self, base_url, api_key, limit, offset):
+        """
+         Gets one page of the parcel list; see AgknowUtils.get_parcel_page().
+        """
+        params = "/parcels/?key={0}&limit={1}&offset={2}".format(api_key, limit, offset)
+
+        return json.loads(await self.cached_http_get(base_url, params))
+
+    async def get_parcel_detail_data(self, base_url, api_key, parcel_id):
+        """
+         Gets the attributes and the geometry (WKT) of a parcel; see AgknowUtils.get_parcel_detail_data().
+        """
+        params = "/parcels/{0}/?key={1}&geoformat=WKT".format(parcel_id, api_key)
+
+        result = json.loads(await self.cached_http_get(base_url, params))
+
+        return self.utils.parse_parcel_detail_data(result, base_url, api_key)
+
+    async def get_raster_list(self, base_url, api_key, parcel_id, product_id, data_source, revalidate=False):
+        """
+         Gets the list of rasters of a parcel; see AgknowUtils.get_raster_list().
+        """
+        params = "/parcels/{0}/{1}/?key={2}&source={3}".format(parcel_id, product_id, api_key, data_source)
+
+        result = json.loads(await self.cached_http_get(base_url, params, use_ttl=not revalidate))
+
+        data = result["content"]
+
+        if not isinstance(data, list):
+            raise HttpError("Raster list of parcel {0} failed: {1}".format(parcel_id, data))
+
+        if len(data) > 0 and "bounds" in data[0]:
+            self.utils.cache_raster_bbox(base_url, parcel_id, product_id, data[0]["bounds"])
+
+        return data
+
+    async def get_raster(self, base_url, api_key, parcel_id, product_id, data_source, raster_id, img_format="png"):
+        """
+         Gets the binary representation of a raster image; see AgknowUtils.get_raster().
+        """
+        params = self.utils.raster_params(api_key, parcel_id, product_id, data_source, raster_id, img_format)
+
+        return await self.http_get(base_url, params, return_raw=True)
+
+    async def stream_raster(self, base_url, api_key, parcel_id, product_id, data_source, raster_id, img_format="png"):
+        """
+         Downloads a raster chunk by chunk into a new /vsimem file; see AgknowUtils.stream_raster().
+
+        :return: memory map string of the raster image; registered with one reference owned by the caller
+        """
+        # GDAL is only needed here, so the HTTP client can be used (and tested) without it
+        from . import agknow_vsimem
+
+        params = self.utils.raster_params(api_key, parcel_id, product_id, data_source, raster_id, img_format)
+
+        writer = agknow_vsimem.VsimemWriter()
+
+        try:
+            try:
+                resp = await self.http.get(base_url + params, verify=self.ssl_verify, cancel_token=self.cancel_token,
+                                           sink=writer)
+
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpProtocolError) as e:
+                raise HttpError("GET {0} failed: {1}".format(base_url, type(e).__name__))
+
+            if resp.status_code != 200:
+                print(resp.status_code)
+                print(resp.text)
+                raise HttpError("GET {0} failed: HTTP {1}".format(base_url, resp.status_code))
+
+        except BaseException:
+            writer.abort()
+            raise
+
+        return writer.close()
+
+    async def get_raster_bbox(self, base_url, api_key, parcel_id, product_id):
+        """
+         Gets the bounding box of the rasters of a parcel and product; see AgknowUtils.get_raster_bbox().
+        """
+        bbox = self.utils.cached_raster_bbox(base_url, parcel_id, product_id)
+
+        if bbox is not None:
+            return bbox
+
+        params = "/parcels/{0}/{1}/?key={2}".format(parcel_id, product_id, api_key)
+
+        result = json.loads(await self.http_get(base_url, params))
+
+        bbox = result["content"][0]["bounds"] # take the bbox from the first raster
+
+        self.utils.cache_raster_bbox(base_url, parcel_id, product_id, bbox)
+
+        return bbox
+
+    async def register_parcel(self, base_url, params, postdata):
+        """
+         Registers a parcel (POST of the parcel data as JSON string); see Worker.register_feature().
+        """
+        return await self.http_post(base_url, params, postdata)
+
+    async def call_when_healthy(self, coro_fn, *args, **kwargs):
+        """
+         Awaits coro_fn with the given arguments and pauses while the circuit breaker of the agknow host is open;
+         see Worker.call_when_healthy(). The keyword argument on_pause (callable with the CircuitOpen error) is
+         called when the request pauses.
+        """
+        on_pause = kwargs.pop("on_pause", None)
+
+        while True:
+            try:
+                return await coro_fn(*args, **kwargs)
+
+            except CircuitOpen as e:
+                if on_pause is not None:
+                    on_pause(e)
+
+                if not await self.http.wait_for_host(args[0], self.cancel_token):
+                    raise
+
+
+async def sleep(seconds, cancel_token=None):
+    """
+     Sleeps for the given number of seconds without blocking the event loop; raises Cancelled as soon as the given
+     token is cancelled.
+    """
+    end = time.monotonic() + seconds
+
+    while True:
+        if cancel_token is not None:
+            cancel_token.check()
+
+        remaining = end - time.monotonic()
+
+        if remaining <= 0:
+            return
+
+        await asyncio.sleep(min(remaining, 0.2))
+
+
+class EventLoopThread(object):
+    """
+     Runs an asyncio event loop in a background (daemon) thread. Coroutines are submitted from any thread and their
+     results are delivered as concurrent.futures.Future, so they fit into the pipelines of the Worker.
+    """
+    def __init__(self, max_connections=DEFAULT_ASYNC_CONNECTIONS, max_in_flight=DEFAULT_ASYNC_IN_FLIGHT):
+        """
+         Constructor
+
+        :param max_connections: maximum number of open connections per host of the HTTP client (integer)
+        :param max_in_flight: maximum number of concurrent requests of the HTTP client (integer)
+        """
+        self.loop = asyncio.new_event_loop()
+        self.http = AsyncHttpClient(max_connections=max_connections, max_in_flight=max_in_flight)
+
+        self._thread = threading.Thread(target=self._run, name="agknow-asyncio", daemon=True)
+        self._thread.start()
+
+    def submit(self, coro, cancel_token=None):
+        """
+         Schedules the given coroutine on the event loop.
+
+         If the given token is cancelled or the event loop is stopped, the coroutine is cancelled as well and the
+         future fails with Cancelled (it is not cancelled itself, so done callbacks see an exception as with the
+         thread pools).
+
+        :param coro: coroutine
+        :param cancel_token: agknow_http.CancelToken of the job (optional)
+
+        :return: concurrent.futures.Future with the result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(self._guard(coro, cancel_token), self.loop)
+
+    def is_running(self):
+        return self._thread.is_alive() and not self.loop.is_closed()
+
+    def stop(self):
+        """
+         Closes the idle connections and stops the event loop; pending coroutines are cancelled and their futures
+         fail with Cancelled.
+        """
+        if not self.is_running():
+            return
+
+        try:
+            asyncio.run_coroutine_threadsafe(self.http.close(), self.loop).result(timeout=5)
+        except Exception:
+            pass
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+    async def _guard(self, coro, cancel_token):
+        task = asyncio.ensure_future(coro)
+
+        if cancel_token is not None:
+            loop = self.loop
+
+            def cancel():
+                try:
+                    loop.call_soon_threadsafe(task.cancel)
+                except RuntimeError: # event loop is already closed
+                    pass
+
+            cancel_token.add_callback(cancel)
+
+        try:
+            return await task
+
+        except asyncio.CancelledError:
+            # cancelled by the token or by stop(): a cancelled future would break the done callbacks of the
+            # pipelines (see chain_future())
+            raise Cancelled()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            self.loop.run_forever()
+
+        finally:
+            tasks = asyncio.all_tasks(self.loop)
+
+            for task in tasks:
+                task.cancel()
+
+            # let the coroutines handle the cancellation, so every future is done before the loop is closed
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+
+_event_loop_thread = None
+_event_loop_lock = threading.Lock()
+_event_loop_settings = {"max_connections": DEFAULT_ASYNC_CONNECTIONS, "max_in_flight": DEFAULT_ASYNC_IN_FLIGHT}
+
+
+def get_event_loop_thread():
+    """
+     Returns the shared EventLoopThread; it is started on first use.
+
+    :return: EventLoopThread
+    """
+    global _event_loop_thread
+
+    with _event_loop_lock:
+        if _event_loop_thread is None or not _event_loop_thread.is_running():
+            _event_loop_thread = EventLoopThread(**_event_loop_settings)
+
+        return _event_loop_thread
+
+
+def configure_event_loop(max_connections=DEFAULT_ASYNC_CONNECTIONS, max_in_flight=DEFAULT_ASYNC_IN_FLIGHT):
+    """
+     Sets the limits of the HTTP client of the shared event loop; a running event loop is restarted on next use.
+    """
+    with _event_loop_lock:
+        _event_loop_settings["max_connections"] = max_connections
+        _event_loop_settings["max_in_flight"] = max_in_flight
+
+    stop_event_loop_thread()
+
+
+def stop_event_loop_thread():
+    """
+     Stops the shared EventLoopThread (e.g. when the plugin is unloaded).
+    """
+    global _event_loop_thread
+
+    with _event_loop_lock:
+        loop_thread = _event_loop_thread
+        _event_loop_thread = None
+
+    if loop_thread is not None:
+        loop_thread.stop()
@@ -0,0 +1,804 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ agknow command line export
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Headless bulk export of the parcels (GeoPackage) and rasters (GeoTIFF) of an API key with AgknowUtils, e.g. for
+ nightly pulls on a server. Runs without the QGIS GUI (but needs the QGIS Python bindings and GDAL).
+
+ The progress is kept in a job manifest (manifest.json in the output directory), so an interrupted or partly
+ failed export is resumed by running the same command again: exported parcels and rasters are skipped, failed
+ rasters are tried again.
+
+ Usage: python -m agknow_qgis.agknow_cli --key <API key> --out /data/agknow --products vitality,visible \
+            --source sentinel2 --from 2019-03-01 --to 2019-09-30 --workers 8
+
+ Exit codes: 0 everything exported, 1 some parcels or rasters failed, 2 invalid arguments, 130 interrupted.
+"""
+from __future__ import print_function
+
+from builtins import object
+import argparse
+import datetime
+import hashlib
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+if __package__:
+    from . import agknow_http
+    from . import agknow_metadata_cache
+    from . import agknow_utils
+    from . import agknow_vsimem
+else:
+    # started as script: the plugin uses relative imports, so it is imported as package
+    _PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(_PLUGIN_DIR))
+    _package = os.path.basename(_PLUGIN_DIR)
+    agknow_http = importlib.import_module(_package + ".agknow_http")
+    agknow_metadata_cache = importlib.import_module(_package + ".agknow_metadata_cache")
+    agknow_utils = importlib.import_module(_package + ".agknow_utils")
+    agknow_vsimem = importlib.import_module(_package + ".agknow_vsimem")
+
+from osgeo import gdal, ogr, osr
+from qgis.PyQt.QtCore import QVariant
+
+# version of the format of the job manifest
+MANIFEST_VERSION = 1
+
+# seconds between two writes of the job manifest while the export runs
+MANIFEST_SAVE_INTERVAL = 5.0
+
+# parameters of the export which have to be the same for resuming an export (the existing files depend on them)
+RESUME_PARAMS = ["host", "api_version", "key_sha1", "source", "format", "epsg"]
+
+# name of the parcel layer in the GeoPackage
+PARCEL_LAYER = "parcels"
+
+# fields of the parcel layer which are not exported (the API key must not end up in files on a server)
+EXCLUDED_FIELDS = ["apikey"]
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_INTERRUPTED = 130
+
+RASTER_DONE = "done"
+RASTER_FAILED = "failed"
+
+_quiet = False
+
+
+def log(msg, error=False):
+    """
+     Prints a progress or error message to stderr (stdout is left to the utils' tracing output).
+
+    :param msg: message (string)
+    :param error: error messages are printed with --quiet as well (boolean)
+    """
+    if _quiet and not error:
+        return
+
+    print("{0} {1}".format(datetime.datetime.now().strftime("%H:%M:%S"), msg), file=sys.stderr)
+    sys.stderr.flush()
+
+
+class ExportManifest(object):
+    """
+     Job manifest of an export: the parameters and the state of every parcel and raster. Thread safe.
+
+     The manifest is written atomically (temporary file and rename), so it is consistent even if the process is
+     killed while saving.
+    """
+    def __init__(self, path, params):
+        """
+         Constructor
+
+        :param path: path of the manifest file
+        :param params: parameters of the export (dict); must not contain the API key
+        """
+        self.path = path
+        self.params = params
+
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+
+        now = datetime.datetime.utcnow().isoformat() + "Z"
+
+        self.data = {"version": MANIFEST_VERSION, "created": now, "updated": now, "params": params,
+                     "parcels": {}, "rasters": {}}
+
+    def load(self, restart=False):
+        """
+         Loads the state of a previous export from the manifest file (if it exists).
+
+        :param restart: ignore the state of a previous export (boolean)
+
+        :return: True if a previous export is resumed
+        """
+        if restart or not os.path.exists(self.path):
+            return False
+
+        with open(self.path, "r") as f:
+            data = json.load(f)
+
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError("Manifest {0} has an unknown version {1}".format(self.path, data.get("version")))
+
+        previous = data.get("params", {})
+        changed = [p for p in RESUME_PARAMS if previous.get(p) != self.params.get(p)]
+
+        if len(changed) > 0:
+            raise ValueError("Manifest {0} belongs to an export with other {1}; use --restart or another "
+                             "output directory".format(self.path, ", ".join(changed)))
+
+        data["params"] = self.params
+        self.data = data
+
+        return True
+
+    def mark_parcels(self, parcels):
+        """
+         Records parcels as exported.
+
+        :param parcels: list of tuples of parcel id and name
+        """
+        with self._lock:
+            for parcel_id, name in parcels:
+                self.data["parcels"][str(parcel_id)] = name
+
+        self.save()
+
+    def forget_parcels(self):
+        """
+         Forgets all exported parcels (e.g. if the GeoPackage has been deleted).
+        """
+        with self._lock:
+            self.data["parcels"] = {}
+
+    def raster_done(self, key):
+        """
+         Checks if the raster with the given key has been exported and its file still exists.
+
+        :param key: raster key (see raster_key())
+
+        :return: boolean
+        """
+        with self._lock:
+            entry = self.data["rasters"].get(key)
+
+        return entry is not None and entry["status"] == RASTER_DONE and os.path.exists(entry["path"])
+
+    def mark_raster(self, key, status, path=None, error=None, date=None):
+        """
+         Records the state of a raster.
+
+        :param key: raster key (see raster_key())
+        :param status: RASTER_DONE or RASTER_FAILED
+        :param path: path of the GeoTIFF
+        :param error: error message of a failed raster
+        :param date: date of the raster
+        """
+        entry = {"status": status, "path": path, "date": date}
+
+        if error is not None:
+            entry["error"] = error
+
+        with self._lock:
+            self.data["rasters"][key] = entry
+
+        self.save()
+
+    def summary(self):
+        """
+         Returns the number of parcels, exported rasters and failed rasters.
+
+        :return: tuple of integers
+        """
+        with self._lock:
+            statuses = [r["status"] for r in self.data["rasters"].values()]
+
+            return len(self.data["parcels"]), statuses.count(RASTER_DONE), statuses.count(RASTER_FAILED)
+
+    def save(self, force=False):
+        """
+         Writes the manifest file; at most every MANIFEST_SAVE_INTERVAL seconds unless force is True.
+
+        :param force: write the file in any case (boolean)
+        """
+        with self._lock:
+            now = time.time()
+
+            if not force and now - self._last_save < MANIFEST_SAVE_INTERVAL:
+                return
+
+            self._last_save = now
+            self.data["updated"] = datetime.datetime.utcnow().isoformat() + "Z"
+
+            tmp_path = self.path + ".tmp"
+
+            with open(tmp_path, "w") as f:
+                json.dump(self.data, f, indent=1, sort_keys=True)
+
+            os.replace(tmp_path, self.path)
+
+
+class ParcelWriter(object):
+    """
+     Writes the parcels into the parcel layer of a GeoPackage (EPSG 4326) with the data model of the plugin's parcel
+     layer (see agknow_utils.parcel_fields()). An existing GeoPackage is appended to.
+
+     Not thread safe; OGR datasets must be used by one thread only.
+    """
+    def __init__(self, path):
+        """
+         Constructor
+
+        :param path: path of the GeoPackage
+        """
+        self.path = path
+
+        self.fields = [(f.name(), f.type()) for f in agknow_utils.parcel_fields()
+                       if f.name() not in EXCLUDED_FIELDS]
+
+        if os.path.exists(path):
+            self.dataset = ogr.Open(path, update=1)
+            self.layer = self.dataset.GetLayerByName(PARCEL_LAYER) if self.dataset is not None else None
+
+            if self.layer is None:
+                raise IOError("{0} is no GeoPackage with a {1} layer".format(path, PARCEL_LAYER))
+
+        else:
+            self.dataset = ogr.GetDriverByName("GPKG").CreateDataSource(path)
+
+            if self.dataset is None:
+                raise IOError("Cannot create the GeoPackage {0}".format(path))
+
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(4326)
+
+            self.layer = self.dataset.CreateLayer(PARCEL_LAYER, srs, ogr.wkbMultiPolygon, options=["FID=fid"])
+
+            for name, field_type in self.fields:
+                self.layer.CreateField(ogr.FieldDefn(name, self.ogr_field_type(field_type)))
+
+    @staticmethod
+    def ogr_field_type(field_type):
+        """
+         Maps the type of a QgsField to the OGR field type.
+
+        :param field_type: QVariant type
+
+        :return: OGR field type
+        """
+        if field_type in (QVariant.Int, QVariant.LongLong):
+            return ogr.OFTInteger64
+
+        if field_type == QVariant.Double:
+            return ogr.OFTReal
+
+        return ogr.OFTString
+
+    def parcel_ids(self):
+        """
+         Returns the ids of the parcels in the GeoPackage.
+
+        :return: set of integers
+        """
+        ids = set()
+
+        self.layer.ResetReading()
+        for feat in self.layer:
+            if feat.GetField("parcel_id") is not None:
+                ids.add(int(feat.GetField("parcel_id")))
+
+        self.layer.ResetReading()
+
+        return ids
+
+    def write(self, parcels):
+        """
+         Writes parcels in one transaction.
+
+        :param parcels: list of tuples of the attribute dictionary and the geometry as WKT
+                        (see AgknowUtils.get_parcel_detail_data())
+        """
+        self.layer.StartTransaction()
+
+        try:
+            for attributes, geom_wkt in parcels:
+                feat = ogr.Feature(self.layer.GetLayerDefn())
+
+                for name, _ in self.fields:
+                    value = attributes.get(name)
+
+                    if value is None:
+                        continue
+
+                    if isinstance(value, (dict, list)):
+                        value = json.dumps(value)
+
+                    feat.SetField(name, value)
+
+                geom = ogr.CreateGeometryFromWkt(geom_wkt)
+                if geom is not None:
+                    feat.SetGeometry(ogr.ForceToMultiPolygon(geom))
+
+                self.layer.CreateFeature(feat)
+
+            self.layer.CommitTransaction()
+
+        except Exception:
+            self.layer.RollbackTransaction()
+            raise
+
+    def close(self):
+        """
+         Flushes and closes the GeoPackage.
+        """
+        self.layer = None
+        self.dataset = None
+
+
+def raster_key(parcel_id, product_id, raster_id):
+    """
+     Returns the key of a raster in the job manifest.
+    """
+    return "{0}/{1}/{2}".format(parcel_id, product_id, raster_id)
+
+
+class Exporter(object):
+    """
+     Bulk export of the parcels and rasters of an API key.
+    """
+    def __init__(self, args, manifest):
+        """
+         Constructor
+
+        :param args: parsed command line arguments
+        :param manifest: ExportManifest
+        """
+        self.args = args
+        self.manifest = manifest
+
+        self.api_version = "/agknow/api/v" + str(args.api_version)
+        self.base_url = args.host.rstrip("/") + self.api_version
+        self.api_key = args.key
+
+        self.utils = agknow_utils.AgknowUtils(self.api_version)
+        self.utils.cancel_token = agknow_http.CancelToken()
+
+        if args.cache_dir:
+            self.utils.metadata_cache = agknow_metadata_cache.MetadataCache(args.cache_dir)
+
+        self.failed_parcels = 0
+
+        # SRS of the exported rasters
+        self.srs = osr.SpatialReference()
+        self.srs.ImportFromEPSG(args.epsg)
+
+    def cancel(self):
+        """
+         Cancels the export; the running requests are aborted.
+        """
+        self.utils.cancel_token.cancel()
+
+    def call_when_healthy(self, fn, *args, **kwargs):
+        """
+         Calls fn with the given arguments. While the circuit breaker of the agknow host is open, the export pauses
+         and calls fn again as soon as the host may be probed (like Worker.call_when_healthy()).
+
+        :param fn: callable which requests the agknow API
+
+        :return: result of fn
+        """
+        while True:
+            try:
+                return fn(*args, **kwargs)
+
+            except agknow_http.CircuitOpen as e:
+                log("agknow host unavailable ({0}) - paused, next try in {1:.0f} s..".format(e, e.retry_in))
+
+                if not self.utils.session.wait_for_host(self.base_url, self.utils.cancel_token):
+                    raise
+
+    def list_parcels(self):
+        """
+         Lists the parcels of the API key (optionally only the ones given with --parcels).
+
+        :return: list of tuples of parcel id and name
+        """
+        parcels = []
+
+        for page in self.utils.iter_parcel_pages(self.base_url, self.api_key, page_size=self.args.page_size,
+                                                  max_workers=self.args.workers):
+            content = page.get("content")
+
+            # error message of the API (e.g. an unauthorized key)
+            if not isinstance(content, list):
+                raise agknow_http.HttpError("Listing of the parcels failed: {0}".format(page))
+
+            for item in content:
+                parcels.append((int(item["parcel_id"]), item.get("name")))
+
+        if self.args.parcels:
+            wanted = set(self.args.parcels)
+            parcels = [p for p in parcels if p[0] in wanted]
+
+        return parcels
+
+    def export_parcels(self, parcels, executor):
+        """
+         Fetches the detail data of the parcels which are not exported yet and writes them to the GeoPackage.
+
+        :param parcels: list of tuples of parcel id and name
+        :param executor: ThreadPoolExecutor for the requests
+        """
+        gpkg_path = os.path.join(self.args.out, "parcels.gpkg")
+
+        if not os.path.exists(gpkg_path):
+            self.manifest.forget_parcels()
+
+        writer = ParcelWriter(gpkg_path)
+
+        try:
+            # the GeoPackage is the reference (the manifest may be older than its last transaction)
+            exported = writer.parcel_ids()
+            todo = [p for p in parcels if p[0] not in exported]
+
+            log("parcels: {0} listed, {1} exported already, {2} to export".format(len(parcels),
+                                                                                    len(parcels) - len(todo),
+                                                                                    len(todo)))
+
+            futures = {executor.submit(self.call_when_healthy, self.utils.get_parcel_detail_data, self.base_url,
+                                       self.api_key, parcel_id): (parcel_id, name) for parcel_id, name in todo}
+
+            batch = []
+            done = 0
+
+            try:
+                for future in as_completed(futures):
+                    parcel_id, name = futures[future]
+
+                    try:
+                        batch.append(future.result())
+
+                    except agknow_http.Cancelled:
+                        raise
+
+                    except Exception as e:
+                        self.failed_parcels += 1
+                        log("parcel {0}: detail data failed: {1}".format(parcel_id, e), error=True)
+                        continue
+
+                    if len(batch) >= agknow_utils.DEFAULT_CHUNK_SIZE:
+                        done += self.write_parcels(writer, batch)
+                        batch = []
+                        log("parcels: {0}/{1}".format(done, len(todo)))
+
+                if len(batch) > 0:
+                    done += self.write_parcels(writer, batch)
+
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        finally:
+            writer.close()
+
+    def write_parcels(self, writer, batch):
+        """
+         Writes a batch of parcels and records them in the manifest.
+
+        :return: number of written parcels
+        """
+        writer.write(batch)
+
+        self.manifest.mark_parcels([(attributes["parcel_id"], attributes.get("name")) for attributes, _ in batch])
+
+        return len(batch)
+
+    def list_rasters(self, parcel_id, product_id):
+        """
+         Lists the rasters of a parcel and product in the date range of the export.
+
+        :return: list of raster information dicts
+        """
+        rasters = self.call_when_healthy(self.utils.get_raster_list, self.base_url, self.api_key, parcel_id,
+                                         product_id, self.args.source)
+
+        return [r for r in rasters
+                if (self.args.date_from is None or r["date"] >= self.args.date_from) and
+                   (self.args.date_to is None or r["date"] <= self.args.date_to)]
+
+    def raster_path(self, parcel_id, product_id, raster):
+        """
+         Returns the path of the GeoTIFF of a raster: <out>/rasters/<parcel id>/<product>/<source>_<date>_<id>.tif
+        """
+        name = "{0}_{1}_{2}.tif".format(raster.get("source") or self.args.source or "all", raster["date"],
+                                        raster["raster_id"])
+
+        return os.path.join(self.args.out, "rasters", str(parcel_id), product_id, name)
+
+    def export_raster(self, parcel_id, product_id, raster):
+        """
+         Downloads a raster and writes it as GeoTIFF. The file is written under a temporary name and renamed
+         afterwards, so an interrupted export leaves no truncated GeoTIFFs.
+
+        :return: path of the GeoTIFF
+        """
+        out_path = self.raster_path(parcel_id, product_id, raster)
+        part_path = out_path[:-len(".tif")] + ".part.tif"
+
+        if not os.path.isdir(os.path.dirname(out_path)):
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+        mmap_name = self.call_when_healthy(self.utils.download_image, self.api_key, self.base_url, parcel_id,
+                                           product_id, raster["raster_id"], raster.get("source", self.args.source),
+                                           self.args.format, self.args.epsg, bounds=raster.get("bounds"))
+
+        try:
+            # download_image() reprojects PNGs only; GeoTIFFs come in the SRS of the API
+            if self.args.format == "tif":
+                mmap_name = self.reproject(mmap_name)
+
+            self.utils.exportGDALraster(mmap_name, part_path)
+
+        finally:
+            agknow_vsimem.get_registry().release(mmap_name)
+
+        os.replace(part_path, out_path)
+
+        return out_path
+
+    def reproject(self, mmap_name):
+        """
+         Transforms a decoded raster to the SRS of the export (--epsg) if it is in another SRS.
+
+        :param mmap_name: memory map string of the GDAL dataset
+
+        :return: memory map string of the (warped) GDAL dataset; a warped VRT takes over the reference of mmap_name
+        """
+        dataset = gdal.Open(mmap_name)
+
+        if dataset is None:
+            raise IOError("GDAL cannot open the raster image")
+
+        srs = osr.SpatialReference(wkt=dataset.GetProjection())
+
+        if srs.IsSame(self.srs):
+            return mmap_name
+
+        return self.utils.transform_raster(dataset, self.args.epsg, vrt=True)
+
+    def export_rasters(self, parcels, executor):
+        """
+         Lists the rasters of all parcels and products and exports the ones which are not exported yet.
+
+        :param parcels: list of tuples of parcel id and name
+        :param executor: ThreadPoolExecutor for the requests
+        """
+        listings = {executor.submit(self.list_rasters, parcel_id, product_id): (parcel_id, product_id)
+                    for parcel_id, _ in parcels for product_id in self.args.products}
+
+        downloads = {}
+        skipped = 0
+
+        try:
+            for future in as_completed(listings):
+                parcel_id, product_id = listings[future]
+
+                try:
+                    rasters = future.result()
+
+                except agknow_http.Cancelled:
+                    raise
+
+                except Exception as e:
+                    self.failed_parcels += 1
+                    log("parcel {0}: raster list of {1} failed: {2}".format(parcel_id, product_id, e), error=True)
+                    continue
+
+                for r in rasters:
+                    key = raster_key(parcel_id, product_id, r["raster_id"])
+
+                    if self.manifest.raster_done(key):
+                        skipped += 1
+                        continue
+
+                    downloads[executor.submit(self.export_raster, parcel_id, product_id, r)] = (key, r)
+
+            log("rasters: {0} exported already, {1} to export".format(skipped, len(downloads)))
+
+            done = 0
+            for future in as_completed(downloads):
+                key, r = downloads[future]
+
+                try:
+                    self.manifest.mark_raster(key, RASTER_DONE, path=future.result(), date=r["date"])
+
+                except agknow_http.Cancelled:
+                    raise
+
+                except Exception as e:
+                    self.manifest.mark_raster(key, RASTER_FAILED, error=str(e), date=r["date"])
+                    log("raster {0}: export failed: {1}".format(key, e), error=True)
+
+                done += 1
+                if done % 100 == 0 or done == len(downloads):
+                    log("rasters: {0}/{1}".format(done, len(downloads)))
+
+        finally:
+            for future in list(listings) + list(downloads):
+                future.cancel()
+
+    def run(self):
+        """
+         Runs the export.
+
+        :return: exit code
+        """
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            try:
+                parcels = self.call_when_healthy(self.list_parcels)
+
+                if not self.args.no_parcels:
+                    self.export_parcels(parcels, executor)
+
+                if not self.args.no_rasters:
+                    self.export_rasters(parcels, executor)
+
+            except KeyboardInterrupt:
+                # abort the running requests, otherwise the executor waits for them on shutdown
+                self.cancel()
+                raise
+
+            finally:
+                self.manifest.save(force=True)
+
+                if self.utils.metadata_cache is not None:
+                    self.utils.metadata_cache.flush()
+
+        n_parcels, n_rasters, n_failed = self.manifest.summary()
+        stats = self.utils.session.connection_stats()
+
+        log("finished: {0} parcels, {1} rasters exported, {2} rasters failed; {3} requests, {4} retries".format(
+            n_parcels, n_rasters, n_failed, stats["requests"], stats["retries"]))
+
+        return EXIT_FAILED if n_failed > 0 or self.failed_parcels > 0 else EXIT_OK
+
+
+def parse_date(value):
+    """
+     Validates a date of the command line (YYYY-MM-DD) for argparse.
+    """
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid date {0!r} (expected YYYY-MM-DD)".format(value))
+
+
+def parse_list(value):
+    """
+     Splits a comma separated list of the command line.
+    """
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def build_parser():
+    """
+     Returns the argparse.ArgumentParser of the command line tool.
+    """
+    parser = argparse.ArgumentParser(description="Bulk export of the parcels (GeoPackage) and rasters (GeoTIFF) "
+                                                 "of an agknow API key")
+    parser.add_argument("--host", default="https://geocledian.com", help="URL of the agknow host")
+    parser.add_argument("--api-version", default="4", choices=["3", "4"])
+    parser.add_argument("--key", default=os.environ.get("AGKNOW_API_KEY"),
+                        help="API key; defaults to the environment variable AGKNOW_API_KEY")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--products", type=parse_list, default=["vitality"],
+                        help="comma separated products (e.g. vitality,visible,variations)")
+    parser.add_argument("--source", default="sentinel2", help="data source (e.g. sentinel2|landsat8); "
+                                                              "empty for all sources")
+    parser.add_argument("--from", dest="date_from", type=parse_date, help="first raster date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=parse_date, help="last raster date (YYYY-MM-DD)")
+    parser.add_argument("--parcels", type=lambda v: [int(p) for p in parse_list(v)],
+                        help="comma separated parcel ids; default are all parcels of the key")
+    parser.add_argument("--format", choices=["tif", "png"], default="tif",
+                        help="image format of the download; the rasters are always written as GeoTIFF")
+    parser.add_argument("--epsg", type=int, default=4326, help="EPSG code of the exported rasters")
+    parser.add_argument("--workers", type=int, default=8, help="number of concurrent requests")
+    parser.add_argument("--page-size", type=int, default=agknow_utils.DEFAULT_PAGE_SIZE)
+    parser.add_argument("--manifest", help="path of the job manifest; default is <out>/manifest.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the progress of a previous export")
+    parser.add_argument("--no-parcels", action="store_true", help="don't export the parcels")
+    parser.add_argument("--no-rasters", action="store_true", help="don't export the rasters")
+    parser.add_argument("--rate-limit", type=float, default=agknow_http.DEFAULT_RATE_LIMIT,
+                        help="requests per second; 0 is unlimited")
+    parser.add_argument("--max-retries", type=int, default=agknow_http.DEFAULT_MAX_RETRIES)
+    parser.add_argument("--cache-dir", help="directory of a persistent cache of the API responses (optional)")
+    parser.add_argument("--quiet", action="store_true", help="print errors only")
+
+    return parser
+
+
+def main(argv=None):
+    global _quiet
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if not args.key:
+        parser.error("an API key is required (--key or AGKNOW_API_KEY)")
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if args.date_from and args.date_to and args.date_from > args.date_to:
+        parser.error("--from is after --to")
+
+    _quiet = args.quiet
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out, exist_ok=True)
+
+    # the manifest must not contain the key itself; a hash is enough to detect a resume with another key
+    params = {"host": args.host.rstrip("/"), "api_version": args.api_version,
+              "key_sha1": hashlib.sha1(args.key.encode("utf-8")).hexdigest()[:12],
+              "source": args.source, "format": args.format, "epsg": args.epsg, "products": args.products,
+              "from": args.date_from, "to": args.date_to, "parcels": args.parcels}
+
+    manifest = ExportManifest(args.manifest or os.path.join(args.out, "manifest.json"), params)
+
+    try:
+        if manifest.load(restart=args.restart):
+            log("resuming the export of {0}".format(manifest.path))
+
+    except ValueError as e:
+        parser.error(str(e))
+
+    # one connection per worker; the limits of the session protect the API like in the plugin
+    agknow_http.configure_session(pool_maxsize=args.workers, max_retries=args.max_retries,
+                                  rate_limit=args.rate_limit)
+
+    exporter = Exporter(args, manifest)
+
+    try:
+        return exporter.run()
+
+    except (KeyboardInterrupt, agknow_http.Cancelled):
+        exporter.cancel()
+        manifest.save(force=True)
+        log("interrupted - run the same command again to resume", error=True)
+
+        return EXIT_INTERRUPTED
+
+    except agknow_http.HttpError as e:
+        manifest.save(force=True)
+        log("export failed: {0}".format(e), error=True)
+
+        return EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
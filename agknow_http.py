@@ -0,0 +1,955 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowHttpSession
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import print_function
+
+from builtins import object
+from email.utils import parsedate_to_datetime
+import datetime
+import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# defaults for the shared connection pool
+DEFAULT_POOL_CONNECTIONS = 4    # number of hosts for which a connection pool is kept
+DEFAULT_POOL_MAXSIZE = 8        # maximum number of open connections per host
+DEFAULT_POOL_BLOCK = True       # wait for a free connection instead of opening more than pool_maxsize per host
+
+# defaults for retries and rate limiting
+DEFAULT_MAX_RETRIES = 4         # retries of a failed or throttled request
+DEFAULT_BACKOFF = 0.5           # base delay of the exponential backoff in seconds
+DEFAULT_MAX_BACKOFF = 30.0      # maximum delay between two attempts in seconds
+DEFAULT_RATE_LIMIT = 0          # requests per second of all threads; 0 is unlimited
+DEFAULT_RATE_BURST = 10         # requests which may be sent at once after an idle period
+
+# status codes of throttled or temporarily failed requests
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# defaults for the circuit breaker per host
+DEFAULT_BREAKER_THRESHOLD = 5       # consecutive failed requests which open the circuit of a host
+DEFAULT_BREAKER_RESET = 15.0        # seconds until an open circuit lets a probe request through
+DEFAULT_BREAKER_MAX_RESET = 120.0   # the reset timeout doubles with every failed probe up to this value
+DEFAULT_BREAKER_MAX_PAUSE = 600.0   # seconds a job waits for an unavailable host before it gives up
+
+# status codes which count as a failure of the host (429 is throttling of the client, not a failure)
+HOST_FAILURE_STATUSES = (500, 502, 503, 504)
+
+# size of the chunks in which streamed response bodies are read
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# timeout budget per endpoint: (connect timeout, read timeout, total time including retries) in seconds
+DEFAULT_TIMEOUTS = {"parcels": (3.05, 15.0, 60.0),     # pages of the parcel list
+                    "detail": (3.05, 10.0, 30.0),      # detail data of a parcel
+                    "rasters": (3.05, 15.0, 45.0),     # raster list of a parcel and product
+                    "image": (3.05, 30.0, 120.0),      # raster image
+                    "default": (3.05, 10.0, 30.0)}
+
+_ENDPOINTS = [("image", re.compile(r"/parcels/\d+/[^/]+/[^/]+/[^/]+\.(png|tif)$")),
+              ("rasters", re.compile(r"/parcels/\d+/[^/]+/?$")),
+              ("detail", re.compile(r"/parcels/\d+/?$")),
+              ("parcels", re.compile(r"/parcels/?$"))]
+
+
+def endpoint(url):
+    """
+     Returns the endpoint of the agknow API the given URL belongs to.
+
+    :param url: request URL (string)
+
+    :return: key of DEFAULT_TIMEOUTS (string)
+    """
+    path = url.split("?")[0]
+
+    for name, pattern in _ENDPOINTS:
+        if pattern.search(path):
+            return name
+
+    return "default"
+
+
+def parse_retry_after(value):
+    """
+     Parses the value of a Retry-After header (seconds or HTTP date).
+
+    :param value: header value (string) or None
+
+    :return: delay in seconds (float) or None
+    """
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+
+    except ValueError:
+        pass
+
+    try:
+        date = parsedate_to_datetime(value)
+
+        return max((date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpError(Exception):
+    """
+     Raised if a request of the agknow API failed (after all retries).
+    """
+    pass
+
+
+class CircuitOpen(HttpError):
+    """
+     Raised without sending a request if the circuit breaker of the host is open.
+    """
+    def __init__(self, host, retry_in):
+        """
+         Constructor
+
+        :param host: host of the request (string)
+        :param retry_in: seconds until the next probe request is allowed (float)
+        """
+        super(CircuitOpen, self).__init__("{0} is unavailable, next try in {1:.0f} s".format(host, retry_in))
+
+        self.host = host
+        self.retry_in = retry_in
+
+
+class Cancelled(Exception):
+    """
+     Raised by the requests and the pipeline stages of a job which has been cancelled with its CancelToken.
+    """
+    pass
+
+
+class CancelToken(object):
+    """
+     Thread safe cancellation flag of a (Worker) job.
+
+     The requests of the job check the token before they are sent; responses which are read while the token is
+     cancelled are closed, so the in-flight requests are aborted as well.
+    """
+    def __init__(self):
+        """
+         Constructor
+        """
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+        # responses which are being read
+        self._responses = set()
+        # called on cancel() (e.g. to cancel the coroutines of the job)
+        self._callbacks = []
+
+    def cancel(self):
+        """
+         Cancels the job and aborts its in-flight requests.
+        """
+        with self._lock:
+            self._event.set()
+
+            responses = list(self._responses)
+            self._responses.clear()
+
+            callbacks = self._callbacks
+            self._callbacks = []
+
+        for resp in responses:
+            try:
+                resp.close()
+            except Exception:
+                pass
+
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback):
+        """
+         Registers a callable without arguments which is called once the job is cancelled; it is called right away
+         if the job has been cancelled already.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback()
+
+    def is_cancelled(self):
+        """
+         Returns True if the job has been cancelled.
+        """
+        return self._event.is_set()
+
+    def check(self):
+        """
+         Raises Cancelled if the job has been cancelled.
+        """
+        if self._event.is_set():
+            raise Cancelled()
+
+    def read(self, resp):
+        """
+         Reads the body of the given (streamed) response; the response is closed if the job is cancelled meanwhile.
+
+        :param resp: requests.Response requested with stream=True
+
+        :return: requests.Response with its content loaded
+        """
+        with self._lock:
+            if self._event.is_set():
+                resp.close()
+                raise Cancelled()
+
+            self._responses.add(resp)
+
+        try:
+            resp.content
+
+        except Exception:
+            if self._event.is_set():
+                raise Cancelled()
+            raise
+
+        finally:
+            with self._lock:
+                self._responses.discard(resp)
+
+        self.check()
+
+        return resp
+
+
+    def iter_content(self, resp, chunk_size=STREAM_CHUNK_SIZE):
+        """
+         Iterates over the body of the given (streamed) response; the response is closed if the job is cancelled
+         meanwhile and Cancelled is raised.
+
+        :param resp: requests.Response requested with stream=True
+        :param chunk_size: size of the chunks in bytes (integer)
+
+        :return: generator of bytes
+        """
+        with self._lock:
+            if self._event.is_set():
+                resp.close()
+                raise Cancelled()
+
+            self._responses.add(resp)
+
+        try:
+            for chunk in resp.iter_content(chunk_size):
+                self.check()
+
+                yield chunk
+
+        except Cancelled:
+            raise
+
+        except Exception:
+            if self._event.is_set():
+                raise Cancelled()
+            raise
+
+        finally:
+            with self._lock:
+                self._responses.discard(resp)
+
+
+class RetryPolicy(object):
+    """
+     Exponential backoff with full jitter for failed or throttled requests; a Retry-After header of the server
+     takes precedence.
+    """
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 statuses=RETRY_STATUSES):
+        """
+         Constructor
+
+        :param max_retries: maximum number of retries of a request (integer)
+        :param backoff: base delay in seconds; doubled with every retry (float)
+        :param max_backoff: maximum delay in seconds (float)
+        :param statuses: status codes which are retried (tuple of integers)
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def delay(self, attempt, resp=None):
+        """
+         Returns the delay before the next attempt.
+
+        :param attempt: number of the failed attempt, starting with 0 (integer)
+        :param resp: response of the failed attempt (requests.Response) or None
+
+        :return: delay in seconds (float)
+        """
+        if resp is not None:
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+
+class RateLimiter(object):
+    """
+     Thread safe token bucket which limits the request rate of all threads of a session. The server may pause
+     all requests for a while (429 with Retry-After).
+    """
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=DEFAULT_RATE_BURST):
+        """
+         Constructor
+
+        :param rate: requests per second (float); 0 is unlimited
+        :param burst: size of the bucket (integer)
+        """
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def acquire(self, cancel_token=None):
+        """
+         Waits until a request may be sent.
+
+        :param cancel_token: CancelToken which ends the waiting (optional)
+        """
+        while True:
+            wait = self.reserve()
+
+            if wait <= 0:
+                return
+
+            sleep(wait, cancel_token)
+
+    def reserve(self):
+        """
+         Takes a token from the bucket if possible; never waits (for asynchronous callers).
+
+        :return: 0 if a request may be sent now, otherwise the seconds to wait before the next try (float)
+        """
+        with self._lock:
+            now = time.monotonic()
+
+            wait = self._paused_until - now
+
+            if wait > 0:
+                return wait
+
+            if self.rate <= 0:
+                return 0
+
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+
+            return (1 - self._tokens) / self.rate
+
+    def pause(self, seconds):
+        """
+         Pauses all requests for the given number of seconds.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker(object):
+    """
+     Thread safe circuit breaker of a host.
+
+     The circuit opens after threshold consecutive failed requests (connection errors, timeouts, 5xx); while it is
+     open, requests fail fast with CircuitOpen. After the reset timeout a single probe request is let through
+     (half open): if it succeeds the circuit closes, otherwise it opens again with a doubled reset timeout.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, host, threshold=DEFAULT_BREAKER_THRESHOLD, reset_timeout=DEFAULT_BREAKER_RESET,
+                 max_reset_timeout=DEFAULT_BREAKER_MAX_RESET):
+        """
+         Constructor
+
+        :param host: host of the circuit (string)
+        :param threshold: consecutive failures which open the circuit (integer); 0 disables the breaker
+        :param reset_timeout: seconds until the first probe request (float)
+        :param max_reset_timeout: maximum seconds between two probe requests (float)
+        """
+        self.host = host
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+
+        self._cond = threading.Condition()
+        self._timeout = reset_timeout
+        self._retry_at = 0.0
+        self._probing = False
+
+    def allow(self):
+        """
+         Checks if a request may be sent; in the half open state only one probe request is allowed at a time.
+         Every allowed request has to be reported with success(), failure() or release().
+
+        :return: True if the request may be sent
+        """
+        with self._cond:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and time.monotonic() >= self._retry_at:
+                self.state = self.HALF_OPEN
+
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+
+            return False
+
+    def success(self):
+        """
+         Reports a successful request (the host responded); closes the circuit.
+        """
+        with self._cond:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._timeout = self.reset_timeout
+            self._probing = False
+            self._cond.notify_all()
+
+    def failure(self):
+        """
+         Reports a failed request; opens the circuit after threshold consecutive failures or a failed probe.
+        """
+        with self._cond:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN:
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+                self._open()
+
+            elif self.state == self.CLOSED and 0 < self.threshold <= self.failures:
+                self._open()
+
+            self._cond.notify_all()
+
+    def release(self):
+        """
+         Reports a request without result (e.g. cancelled or throttled); a probe may be sent by another request.
+        """
+        with self._cond:
+            self._probing = False
+            self._cond.notify_all()
+
+    def retry_in(self):
+        """
+         Returns the seconds until the next probe request is allowed.
+        """
+        with self._cond:
+            if self.state != self.OPEN:
+                return 0.0
+
+            return max(self._retry_at - time.monotonic(), 0.0)
+
+    def wait(self, timeout, cancel_token=None):
+        """
+         Waits until a request may be sent again: the circuit is closed or a probe request is due.
+
+        :param timeout: maximum time to wait in seconds (float)
+        :param cancel_token: CancelToken which ends the waiting (optional)
+
+        :return: True if the host may be requested again, False on timeout
+        """
+        end = time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                if self.state == self.CLOSED or \
+                        (self.state == self.OPEN and time.monotonic() >= self._retry_at) or \
+                        (self.state == self.HALF_OPEN and not self._probing):
+                    return True
+
+                remaining = end - time.monotonic()
+
+                if remaining <= 0:
+                    return False
+
+                self._cond.wait(min(remaining, 0.2))
+
+                if cancel_token is not None:
+                    cancel_token.check()
+
+    def health(self):
+        """
+         Returns the health of the host.
+
+        :return: dict with the keys host, state, failures (consecutive), opened (number of times) and retry_in
+        """
+        with self._cond:
+            retry_in = max(self._retry_at - time.monotonic(), 0.0) if self.state == self.OPEN else 0.0
+
+            return {"host": self.host,
+                    "state": self.state,
+                    "failures": self.failures,
+                    "opened": self.opened,
+                    "retry_in": retry_in}
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened += 1
+        self._retry_at = time.monotonic() + self._timeout
+        self._probing = False
+
+
+def sleep(seconds, cancel_token=None):
+    """
+     Sleeps for the given number of seconds; raises Cancelled as soon as the given token is cancelled.
+    """
+    end = time.monotonic() + seconds
+
+    while True:
+        if cancel_token is not None:
+            cancel_token.check()
+
+        remaining = end - time.monotonic()
+
+        if remaining <= 0:
+            return
+
+        time.sleep(min(remaining, 0.2))
+
+
+class ConnectionStats(object):
+    """
+     Thread safe counter for the requests and the newly opened connections of an AgknowHttpSession.
+     Every request that did not need a new connection reused a kept-alive one.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def request_sent(self):
+        with self._lock:
+            self.requests += 1
+
+    def connection_opened(self):
+        with self._lock:
+            self.opened += 1
+
+    def request_retried(self, throttled=False):
+        with self._lock:
+            self.retries += 1
+
+            if throttled:
+                self.throttled += 1
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.opened = 0
+            self.retries = 0
+            self.throttled = 0
+
+    def as_dict(self):
+        """
+         Returns the current counters as dictionary.
+
+        :return: dict with the keys requests, opened, reused, retries and throttled
+        """
+        with self._lock:
+            return {"requests": self.requests,
+                    "opened": self.opened,
+                    "reused": max(self.requests - self.opened, 0),
+                    "retries": self.retries,
+                    "throttled": self.throttled}
+
+
+def _counting_pool_class(pool_cls, stats):
+    """
+     Derives a urllib3 connection pool class from the given one which reports every opened connection to stats.
+     Connections are counted on connect() so that reconnects of dropped keep-alive connections are also counted.
+
+    :param pool_cls: HTTPConnectionPool or HTTPSConnectionPool
+    :param stats: ConnectionStats
+
+    :return: connection pool class
+    """
+    conn_cls = pool_cls.ConnectionCls
+
+    def connect(self):
+        stats.connection_opened()
+        return conn_cls.connect(self)
+
+    counting_conn_cls = type("Counting" + conn_cls.__name__, (conn_cls,), {"connect": connect})
+
+    return type("Counting" + pool_cls.__name__, (pool_cls,), {"ConnectionCls": counting_conn_cls})
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    """
+     HTTPAdapter which counts the requests and the new connections of its pools.
+    """
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super(_CountingHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self.stats),
+            "https": _counting_pool_class(HTTPSConnectionPool, self.stats)
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.request_sent()
+        return super(_CountingHTTPAdapter, self).send(request, **kwargs)
+
+
+class AgknowHttpSession(object):
+    """
+     Pooled HTTP session with keep-alive connections to the agknow host(s).
+     All HTTP requests of AgknowUtils and the Worker should go through one (shared) instance of this class.
+
+     Requests are rate limited; connection errors, timeouts and throttled (429) or temporarily failed (5xx) GET
+     requests are retried with exponential backoff within the timeout budget of their endpoint. A circuit breaker
+     per host makes the requests fail fast with CircuitOpen while the host is down.
+    """
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 pool_block=DEFAULT_POOL_BLOCK, keep_alive=True, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=DEFAULT_BACKOFF, rate_limit=DEFAULT_RATE_LIMIT, rate_burst=DEFAULT_RATE_BURST,
+                 timeouts=None, breaker_threshold=DEFAULT_BREAKER_THRESHOLD, breaker_reset=DEFAULT_BREAKER_RESET,
+                 breaker_max_pause=DEFAULT_BREAKER_MAX_PAUSE):
+        """
+         Constructor
+
+        :param pool_connections: number of hosts for which a connection pool is kept (integer)
+        :param pool_maxsize: maximum number of connections kept open per host (integer)
+        :param pool_block: if True, requests wait for a free connection instead of exceeding pool_maxsize per host
+        :param keep_alive: keep connections open after a request (boolean); default is True
+        :param max_retries: maximum number of retries of a request (integer)
+        :param backoff: base delay of the exponential backoff in seconds (float)
+        :param rate_limit: requests per second (float); 0 is unlimited
+        :param rate_burst: requests which may be sent at once (integer)
+        :param timeouts: timeout budgets per endpoint; see DEFAULT_TIMEOUTS (dict)
+        :param breaker_threshold: consecutive failures which open the circuit of a host (integer); 0 disables it
+        :param breaker_reset: seconds until an open circuit lets a probe request through (float)
+        :param breaker_max_pause: seconds a job waits for an unavailable host; see wait_for_host() (float)
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+
+        self.retry_policy = RetryPolicy(max_retries=max_retries, backoff=backoff)
+        self.rate_limiter = RateLimiter(rate=rate_limit, burst=rate_burst)
+
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.breaker_max_pause = breaker_max_pause
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+
+        self.stats = ConnectionStats()
+
+        self.session = requests.Session()
+
+        adapter = _CountingHTTPAdapter(self.stats,
+                                       pool_connections=pool_connections,
+                                       pool_maxsize=pool_maxsize,
+                                       pool_block=pool_block)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        if keep_alive:
+            self.session.headers["Connection"] = "keep-alive"
+        else:
+            self.session.headers["Connection"] = "close"
+
+    def get(self, url, cancel_token=None, **kwargs):
+        """
+         Performs a HTTP GET request on the pooled session. Takes the same keyword arguments as requests.get();
+         without timeout the timeout of the endpoint is used.
+
+        :param url: URL for the HTTP GET request
+        :param cancel_token: CancelToken which aborts the request (optional)
+
+        :return: requests.Response; the last response if the request is still throttled or failing after all
+                 retries
+        """
+        return self._retry(self.session.get, url, cancel_token, idempotent=True, **kwargs)
+
+    def post(self, url, cancel_token=None, **kwargs):
+        """
+         Performs a HTTP POST request on the pooled session. Takes the same keyword arguments as requests.post().
+         A POST is only retried if it has been throttled (429), because the server has not processed it then.
+
+        :param url: URL for the HTTP POST request
+        :param cancel_token: CancelToken which aborts the request (optional)
+
+        :return: requests.Response
+        """
+        return self._retry(self.session.post, url, cancel_token, idempotent=False, **kwargs)
+
+    def stream(self, url, cancel_token=None, **kwargs):
+        """
+         Performs a HTTP GET request whose body is not read yet, so it can be streamed (e.g. with
+         CancelToken.iter_content()). Failed or throttled requests are retried until the response headers arrive;
+         a failure while the body is read is up to the caller.
+
+        :param url: URL for the HTTP GET request
+        :param cancel_token: CancelToken which aborts the request (optional)
+
+        :return: requests.Response which has to be closed by the caller
+        """
+        return self._retry(self.session.get, url, cancel_token, idempotent=True, stream=True, **kwargs)
+
+    def head(self, url, cancel_token=None, **kwargs):
+        """
+         Performs a HTTP HEAD request on the pooled session (redirects are followed).
+
+        :param url: URL for the HTTP HEAD request
+        :param cancel_token: CancelToken which aborts the request (optional)
+
+        :return: requests.Response
+        """
+        kwargs.setdefault("allow_redirects", True)
+
+        return self._retry(self.session.head, url, cancel_token, idempotent=True, **kwargs)
+
+    def _retry(self, method, url, cancel_token, idempotent, stream=False, **kwargs):
+        connect_timeout, read_timeout, budget = self.timeouts.get(endpoint(url), self.timeouts["default"])
+
+        kwargs.setdefault("timeout", (connect_timeout, read_timeout))
+
+        start = time.monotonic()
+        attempt = 0
+
+        breaker = self.breaker(url)
+
+        while True:
+            self.rate_limiter.acquire(cancel_token)
+
+            if not breaker.allow():
+                raise CircuitOpen(breaker.host, breaker.retry_in())
+
+            resp = None
+            error = None
+            try:
+                resp = self._request(method, url, cancel_token, stream, **kwargs)
+
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                error = e
+                host_failed = True
+                throttled = False
+                retryable = idempotent
+
+            except BaseException:
+                # cancelled: the request tells nothing about the host
+                breaker.release()
+                raise
+
+            else:
+                host_failed = resp.status_code in HOST_FAILURE_STATUSES
+
+                if not host_failed and resp.status_code != 429:
+                    breaker.success()
+
+                if resp.status_code not in self.retry_policy.statuses:
+                    return resp
+
+                throttled = resp.status_code == 429
+                retryable = idempotent or throttled
+
+            delay = self.retry_policy.delay(attempt, resp)
+
+            if throttled:
+                # the server throttles all requests of this client, not only this one
+                self.rate_limiter.pause(delay)
+
+            if not retryable or attempt >= self.retry_policy.max_retries or \
+                    time.monotonic() - start + delay > budget:
+                # the breaker counts failed requests, not failed attempts
+                if host_failed:
+                    breaker.failure()
+                else:
+                    breaker.release()
+
+                if error is not None:
+                    raise error
+
+                return resp
+
+            self.stats.request_retried(throttled)
+
+            # the retry is reported to the breaker as a new attempt
+            breaker.release()
+
+            if resp is not None:
+                resp.close()
+
+            sleep(delay, cancel_token)
+            attempt += 1
+
+    def _request(self, method, url, cancel_token, stream=False, **kwargs):
+        if cancel_token is None:
+            return method(url, stream=stream, **kwargs)
+
+        cancel_token.check()
+
+        # the body is streamed, so the response can be closed while it is read
+        kwargs["stream"] = True
+
+        try:
+            resp = method(url, **kwargs)
+
+        except Exception:
+            if cancel_token.is_cancelled():
+                raise Cancelled()
+            raise
+
+        if stream:
+            return resp
+
+        return cancel_token.read(resp)
+
+    def breaker(self, url):
+        """
+         Returns the circuit breaker of the host of the given URL.
+
+        :param url: request URL (string)
+
+        :return: CircuitBreaker
+        """
+        host = urlparse(url).netloc
+
+        with self._breakers_lock:
+            breaker = self._breakers.get(host)
+
+            if breaker is None:
+                breaker = CircuitBreaker(host, threshold=self.breaker_threshold, reset_timeout=self.breaker_reset)
+                self._breakers[host] = breaker
+
+            return breaker
+
+    def wait_for_host(self, url, cancel_token=None, timeout=None):
+        """
+         Waits until the host of the given URL may be requested again (its circuit is closed or a probe is due).
+
+        :param url: request URL (string)
+        :param cancel_token: CancelToken which ends the waiting (optional)
+        :param timeout: maximum time to wait in seconds (float); defaults to breaker_max_pause
+
+        :return: True if the host may be requested again, False on timeout
+        """
+        if timeout is None:
+            timeout = self.breaker_max_pause
+
+        return self.breaker(url).wait(timeout, cancel_token)
+
+    def host_health(self):
+        """
+         Returns the health of the hosts which have been requested by this session.
+
+        :return: list of dicts; see CircuitBreaker.health()
+        """
+        with self._breakers_lock:
+            breakers = list(self._breakers.values())
+
+        return [b.health() for b in breakers]
+
+    def connection_stats(self):
+        """
+         Returns the number of requests, newly opened and reused connections of this session.
+
+        :return: dict with the keys requests, opened and reused
+        """
+        return self.stats.as_dict()
+
+    def close(self):
+        """
+         Closes all pooled connections.
+        """
+        self.session.close()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+     Returns the shared AgknowHttpSession; it is created with the default pool settings on first use.
+
+    :return: AgknowHttpSession
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = AgknowHttpSession()
+
+        return _session
+
+
+def configure_session(**kwargs):
+    """
+     Replaces the shared AgknowHttpSession with a new one with the given pool settings.
+     Takes the same keyword arguments as the constructor of AgknowHttpSession.
+
+    :return: AgknowHttpSession
+    """
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+
+        _session = AgknowHttpSession(**kwargs)
+
+        return _session
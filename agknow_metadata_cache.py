@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowMetadataCache
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import print_function
+
+from builtins import object
+import hashlib
+import json
+import os
+import threading
+import time
+
+# default size cap of the metadata cache
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# responses without validators (ETag/Last-Modified) of lookups with use_ttl are used without request for this
+# number of seconds
+DEFAULT_TTL = 3600
+
+# the index is written to disk after this number of changes (and on flush())
+INDEX_SAVE_INTERVAL = 50
+
+
+class MetadataCache(object):
+    """
+     Persistent on-disk HTTP cache for the JSON responses of the agknow API (parcel list, parcel detail data and
+     raster lists).
+
+     Entries are keyed on the SHA-1 digest of the request URL (so the API key is not stored in clear text) and
+     keep the validators of the response. Responses with an ETag or a Last-Modified header are revalidated with
+     a conditional request on every use; responses without validators are requested again, unless the caller
+     allows to use them until their TTL has expired (use_ttl of lookup()).
+     If the size cap is exceeded the least recently used entries are evicted.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        """
+         Constructor
+
+        :param cache_dir: directory of the cache (string); created if it does not exist
+        :param max_bytes: size cap of the cache in bytes (integer)
+        :param ttl: time to live in seconds of the responses without validators (integer)
+        """
+        self.cache_dir = cache_dir
+        self.bodies_dir = os.path.join(cache_dir, "bodies")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # fresh: used without request, revalidated: 304 Not Modified, misses: full response
+        self.fresh = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._changes = 0
+
+        # {entry_id: {"etag": "..", "last_modified": "..", "stored": 1234.5, "size": 123, "atime": 1234.5}}
+        self._entries = {}
+
+        self._load_index()
+
+    def lookup(self, url, use_ttl=False):
+        """
+         Returns the cached body of the given URL if it can be used without a request, otherwise the headers of
+         the conditional request.
+
+        :param url: request URL (string)
+        :param use_ttl: use a response without validators until its TTL has expired (boolean); only for data which
+                        does not change until the caller asks for it again; default is False
+
+        :return: tuple (body or None, dict of request headers)
+        """
+        entry_id = self._entry_id(url)
+
+        with self._lock:
+            entry = self._entries.get(entry_id)
+
+            if entry is None:
+                return None, {}
+
+            headers = {}
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+            # without validators the entry is fresh until its TTL has expired
+            if len(headers) == 0 and use_ttl and time.time() - entry["stored"] < self.ttl:
+                body = self._read_body(entry_id)
+
+                if body is not None:
+                    self.fresh += 1
+                    entry["atime"] = time.time()
+                    self._changed()
+
+                return body, {}
+
+            return None, headers
+
+    def not_modified(self, url, response_headers=None):
+        """
+         Returns the cached body of the given URL after a 304 Not Modified response.
+
+        :param url: request URL (string)
+        :param response_headers: headers of the 304 response (may carry new validators)
+
+        :return: body (string) or None if the entry has been evicted in the meantime
+        """
+        entry_id = self._entry_id(url)
+
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            body = self._read_body(entry_id) if entry is not None else None
+
+            if body is None:
+                self.misses += 1
+                return None
+
+            if response_headers is not None:
+                entry["etag"] = response_headers.get("ETag", entry.get("etag"))
+                entry["last_modified"] = response_headers.get("Last-Modified", entry.get("last_modified"))
+
+            entry["stored"] = entry["atime"] = time.time()
+            self.revalidated += 1
+            self._changed()
+
+            return body
+
+    def put(self, url, body, response_headers):
+        """
+         Stores the body and the validators of a 200 response.
+
+        :param url: request URL (string)
+        :param body: response body (string)
+        :param response_headers: response headers (case insensitive dict)
+        """
+        if body is None:
+            return
+
+        entry_id = self._entry_id(url)
+        data = body.encode("utf-8")
+
+        with self._lock:
+            path = self._body_path(entry_id)
+
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # write to a temporary file first, so a crash never leaves a truncated body
+            tmp_path = "{0}.{1}.tmp".format(path, threading.get_ident())
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            now = time.time()
+            self._entries[entry_id] = {"etag": response_headers.get("ETag"),
+                                       "last_modified": response_headers.get("Last-Modified"),
+                                       "stored": now,
+                                       "size": len(data),
+                                       "atime": now}
+            self.misses += 1
+
+            self._evict()
+            self._changed()
+
+    def remove(self, url):
+        """
+         Removes the entry of the given URL from the cache.
+
+        :param url: request URL (string)
+        """
+        with self._lock:
+            if self._remove_entry(self._entry_id(url)):
+                self._changed()
+
+    def set_max_bytes(self, max_bytes):
+        """
+         Sets the size cap of the cache and evicts entries if necessary.
+
+        :param max_bytes: size cap in bytes (integer)
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+            self._changed()
+
+    def stats(self):
+        """
+         Returns the statistics of the cache.
+
+        :return: dict with the keys fresh, revalidated, misses, entries and size (in bytes)
+        """
+        with self._lock:
+            return {"fresh": self.fresh,
+                    "revalidated": self.revalidated,
+                    "misses": self.misses,
+                    "entries": len(self._entries),
+                    "size": sum(entry["size"] for entry in self._entries.values())}
+
+    def clear(self):
+        """
+         Removes all entries from the cache.
+        """
+        with self._lock:
+            for entry_id in list(self._entries.keys()):
+                self._remove_entry(entry_id)
+
+            self.flush()
+
+    def flush(self):
+        """
+         Writes the index to disk.
+        """
+        with self._lock:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": 1, "entries": self._entries}, f)
+            os.replace(tmp_path, self.index_path)
+
+            self._changes = 0
+
+    def _load_index(self):
+        """
+         Reads the index from disk; a missing or broken index results in an empty cache.
+        """
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+
+            entries = index.get("entries", {})
+
+        except (IOError, OSError, ValueError):
+            entries = {}
+
+        for entry_id, entry in entries.items():
+            if os.path.exists(self._body_path(entry_id)):
+                self._entries[entry_id] = entry
+
+    def _read_body(self, entry_id):
+        try:
+            with open(self._body_path(entry_id), "rb") as f:
+                return f.read().decode("utf-8")
+
+        except (IOError, OSError):
+            # body has been removed from disk in the meantime
+            self._remove_entry(entry_id)
+            return None
+
+    def _entry_id(self, url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _body_path(self, entry_id):
+        return os.path.join(self.bodies_dir, entry_id[:2], entry_id + ".json")
+
+    def _changed(self):
+        self._changes += 1
+
+        if self._changes >= INDEX_SAVE_INTERVAL:
+            self.flush()
+
+    def _evict(self):
+        """
+         Removes the least recently used entries until the size of the cache is below the size cap.
+        """
+        size = sum(entry["size"] for entry in self._entries.values())
+
+        for entry_id, entry in sorted(self._entries.items(), key=lambda item: item[1]["atime"]):
+            if size <= self.max_bytes:
+                break
+
+            self._remove_entry(entry_id)
+            size -= entry["size"]
+
+    def _remove_entry(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+
+        if entry is None:
+            return False
+
+        try:
+            os.remove(self._body_path(entry_id))
+        except (IOError, OSError):
+            pass
+
+        return True
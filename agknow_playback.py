@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowPlayback
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import print_function
+
+from builtins import object
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from osgeo import gdal
+
+from qgis.core import QgsMapSettings, QgsMapRendererParallelJob, QgsProject
+from qgis.gui import QgsMapCanvasItem
+
+from . import agknow_vsimem
+
+# number of frames which are decoded ahead of the current frame
+DEFAULT_PREFETCH_FRAMES = 5
+
+# number of threads decoding frames
+DEFAULT_PREFETCH_WORKERS = 2
+
+# frame rate of the timeslider animation
+DEFAULT_FPS = 10
+
+# memory of the pre-rendered frames
+DEFAULT_FRAME_CACHE_BYTES = 512 * 1024 * 1024
+
+# number of frames which are rendered at the same time
+DEFAULT_RENDER_JOBS = 2
+
+
+def decode_frame(source):
+    """
+     Decodes the given raster into an uncompressed GeoTIFF in memory, so displaying it needs neither PNG/Deflate
+     decoding nor warping anymore.
+
+    :param source: memory map string or path of the raster (e.g. a warped VRT)
+
+    :return: memory map string of the decoded frame; registered in the /vsimem registry with one reference owned
+             by the caller
+    """
+    vsimem = agknow_vsimem.get_registry()
+
+    # keep the source alive while it is read
+    acquired = vsimem.acquire(source)
+
+    try:
+        mmap_name = "/vsimem/frame_{0}.tif".format(uuid4().hex)
+
+        dataset = gdal.Translate(mmap_name, source, format="GTiff")
+
+        if dataset is None:
+            raise RuntimeError("Could not decode frame {0}".format(source))
+
+        # close the dataset to flush it to the memory map
+        dataset = None
+
+        vsimem.register(mmap_name)
+
+        return mmap_name
+
+    finally:
+        if acquired:
+            vsimem.release(source)
+
+
+class FramePrefetcher(object):
+    """
+     Decodes the frames of the timeslider in the background.
+
+     Only a window of frames starting at the current frame is kept; frames which leave the window are released, so
+     the memory stays flat regardless of the number of dates.
+    """
+    def __init__(self, prefetch_frames=DEFAULT_PREFETCH_FRAMES, max_workers=DEFAULT_PREFETCH_WORKERS):
+        """
+         Constructor
+
+        :param prefetch_frames: number of frames which are decoded ahead of the current frame (integer)
+        :param max_workers: number of threads decoding frames (integer)
+        """
+        self.prefetch_frames = prefetch_frames
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+        # raster list of the timeslider; the sources are read when the frame is decoded, because the rasters may
+        # have been moved to disk in the meantime
+        self._rasters = []
+        # {frame index: Future}
+        self._frames = {}
+
+    def set_rasters(self, rasters):
+        """
+         Sets the rasters of the timeslider and drops all decoded frames.
+
+        :param rasters: list of raster dicts with the key "mmap_name"
+        """
+        self.clear()
+
+        with self._lock:
+            self._rasters = list(rasters)
+
+    def request(self, index):
+        """
+         Moves the window to the given frame: submits the frames index .. index + prefetch_frames which are not
+         decoded yet and releases the frames outside of the window.
+
+        :param index: index of the current frame (integer)
+        """
+        with self._lock:
+            window = range(max(index, 0), min(index + self.prefetch_frames + 1, len(self._rasters)))
+
+            for i in list(self._frames.keys()):
+                if i not in window:
+                    self._discard(self._frames.pop(i))
+
+            for i in window:
+                if i not in self._frames:
+                    self._frames[i] = self._executor.submit(decode_frame, self._rasters[i]["mmap_name"])
+
+    def frame(self, index):
+        """
+         Returns the decoded frame of the given index without waiting for it.
+
+        :param index: index of the frame (integer)
+
+        :return: memory map string of the decoded frame or None if it is not ready (yet)
+        """
+        with self._lock:
+            future = self._frames.get(index)
+
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+
+        return future.result()
+
+    def clear(self):
+        """
+         Releases all decoded frames.
+        """
+        with self._lock:
+            for future in self._frames.values():
+                self._discard(future)
+
+            self._frames = {}
+
+    def close(self):
+        """
+         Releases all decoded frames and stops the threads.
+        """
+        self.clear()
+        self._executor.shutdown(wait=False)
+
+    def _discard(self, future):
+        """
+         Releases the frame of the given future (now or as soon as it has been decoded).
+        """
+        def release(f):
+            if f.exception() is None:
+                agknow_vsimem.get_registry().release(f.result())
+
+        if not future.cancel():
+            future.add_done_callback(release)
+
+
+class FrameCache(object):
+    """
+     Pre-renders the frames of the timeslider animation for the current extent of the map canvas.
+
+     Every frame is rendered with a QgsMapRendererParallelJob (the layers are rendered in background threads) into
+     an image. The frames ahead of the current frame are kept as far as the memory budget allows; the cache is
+     invalidated if the extent, the CRS or the style of a rendered layer changes.
+    """
+    def __init__(self, canvas, max_bytes=DEFAULT_FRAME_CACHE_BYTES, max_jobs=DEFAULT_RENDER_JOBS):
+        """
+         Constructor
+
+        :param canvas: map canvas whose map settings are used for rendering (QgsMapCanvas)
+        :param max_bytes: memory budget of the rendered frames in bytes (integer)
+        :param max_jobs: number of frames which are rendered at the same time (integer)
+        """
+        self.canvas = canvas
+        self.max_bytes = max_bytes
+        self.max_jobs = max_jobs
+
+        self.active = False
+
+        self._count = 0
+        self._layers_for = None
+        self._current = 0
+        self._generation = 0
+        self._settings = None
+
+        # {frame index: QImage}
+        self._frames = {}
+        # {QgsMapRendererParallelJob: (frame index, generation)}
+        self._jobs = {}
+        # layers whose style changes invalidate the cache
+        self._watched = []
+
+    def start(self, count, layers_for, index=0):
+        """
+         Starts rendering the frames ahead of the given index.
+
+        :param count: number of frames (integer)
+        :param layers_for: callable which returns the layers to render (list of QgsMapLayer) for a frame index
+        :param index: index of the current frame (integer)
+        """
+        self.stop()
+
+        self._count = count
+        self._layers_for = layers_for
+        self.active = True
+
+        self.canvas.extentsChanged.connect(self.invalidate)
+        self.canvas.destinationCrsChanged.connect(self.invalidate)
+        QgsProject.instance().layersWillBeRemoved.connect(self.invalidate)
+
+        self.seek(index)
+
+    def stop(self):
+        """
+         Cancels the rendering and drops all frames.
+        """
+        if not self.active:
+            return
+
+        self.active = False
+
+        self.canvas.extentsChanged.disconnect(self.invalidate)
+        self.canvas.destinationCrsChanged.disconnect(self.invalidate)
+        QgsProject.instance().layersWillBeRemoved.disconnect(self.invalidate)
+
+        for layer in self._watched:
+            try:
+                layer.styleChanged.disconnect(self.invalidate)
+                layer.rendererChanged.disconnect(self.invalidate)
+            except (RuntimeError, TypeError):
+                # layer has been deleted in the meantime
+                pass
+
+        self._watched = []
+
+        self.invalidate()
+
+    def invalidate(self, *args):
+        """
+         Drops all rendered frames and renders them again for the current map settings.
+        """
+        self._generation += 1
+
+        for job in list(self._jobs.keys()):
+            job.cancelWithoutBlocking()
+
+        self._frames = {}
+        self._settings = None
+
+        if self.active:
+            self._fill()
+
+    def seek(self, index):
+        """
+         Moves the window of the cache to the given frame: drops the frames behind it and renders the frames ahead.
+
+        :param index: index of the current frame (integer)
+        """
+        self._current = index
+
+        window = self._window()
+
+        for i in list(self._frames.keys()):
+            if i not in window:
+                del self._frames[i]
+
+        self._fill()
+
+    def frame(self, index):
+        """
+         Returns the rendered frame of the given index.
+
+        :param index: index of the frame (integer)
+
+        :return: tuple (QImage, QgsRectangle of the image) or None if the frame is not rendered yet
+        """
+        image = self._frames.get(index)
+
+        if image is None or self._settings is None:
+            return None
+
+        return image, self._settings.visibleExtent()
+
+    def is_missing(self, index):
+        """
+         Checks if the frame of the given index can never be rendered, because it has no layers (e.g. the image of
+         its date failed to download or has been removed from the TOC); the animation skips such frames.
+
+        :param index: index of the frame (integer)
+
+        :return: boolean
+        """
+        return self.active and len(self._layers_for(index)) == 0
+
+    def _capacity(self):
+        size = self._settings.outputSize()
+
+        return max(self.max_bytes // max(size.width() * size.height() * 4, 1), 1)
+
+    def _window(self):
+        if self._settings is None:
+            return range(0)
+
+        return range(self._current, min(self._current + self._capacity(), self._count))
+
+    def _fill(self):
+        """
+         Starts render jobs for the missing frames of the window.
+        """
+        if self._settings is None:
+            self._settings = QgsMapSettings(self.canvas.mapSettings())
+
+        rendering = [idx for idx, generation in self._jobs.values() if generation == self._generation]
+
+        for i in self._window():
+            if len(rendering) >= self.max_jobs:
+                break
+
+            if i in self._frames or i in rendering:
+                continue
+
+            layers = self._layers_for(i)
+
+            if len(layers) == 0:
+                continue
+
+            self._watch(layers)
+
+            settings = QgsMapSettings(self._settings)
+            settings.setLayers(layers)
+
+            job = QgsMapRendererParallelJob(settings)
+            job.finished.connect(lambda job=job: self._job_finished(job))
+            self._jobs[job] = (i, self._generation)
+            rendering.append(i)
+
+            job.start()
+
+    def _job_finished(self, job):
+        index, generation = self._jobs.pop(job, (None, None))
+
+        if generation == self._generation and index in self._window():
+            self._frames[index] = job.renderedImage()
+
+        if self.active:
+            self._fill()
+
+    def _watch(self, layers):
+        for layer in layers:
+            if layer not in self._watched:
+                layer.styleChanged.connect(self.invalidate)
+                layer.rendererChanged.connect(self.invalidate)
+                self._watched.append(layer)
+
+
+class FrameOverlay(QgsMapCanvasItem):
+    """
+     Canvas item which shows a pre-rendered frame on top of the map canvas, so switching frames does not
+     re-render the canvas.
+    """
+    def __init__(self, canvas):
+        """
+         Constructor
+
+        :param canvas: map canvas (QgsMapCanvas)
+        """
+        super(FrameOverlay, self).__init__(canvas)
+
+        self.image = None
+        self.hide()
+
+    def set_frame(self, image, extent):
+        """
+         Shows the given frame.
+
+        :param image: rendered frame (QImage)
+        :param extent: extent of the frame in map units (QgsRectangle)
+        """
+        self.image = image
+        self.setRect(extent)
+        self.show()
+        self.update()
+
+    def clear(self):
+        """
+         Hides the overlay.
+        """
+        self.image = None
+        self.hide()
+
+    def paint(self, painter, option=None, widget=None):
+        if self.image is not None:
+            painter.drawImage(self.boundingRect(), self.image)
+
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowPrefetch
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import print_function
+
+from builtins import object
+from collections import OrderedDict
+import threading
+import time
+
+# number of parcels before and after the selected parcel which are prefetched (one-by-one mode)
+DEFAULT_PREFETCH_PARCELS = 2
+
+# "neighbours": next and previous parcels of the parcel list; "extent": parcels within the current map extent
+DEFAULT_PREFETCH_MODE = "neighbours"
+
+# number of concurrent requests of the prefetcher
+DEFAULT_PREFETCH_WORKERS = 2
+
+# bandwidth of the prefetcher in KB/s; 0 is unlimited
+DEFAULT_PREFETCH_MAX_KBPS = 0
+
+# number of parcels whose detail data is kept in memory
+DEFAULT_DETAIL_CACHE_ENTRIES = 1000
+
+
+class DetailCache(object):
+    """
+     Thread safe in-memory LRU cache of the detail data (attributes and geometry) of parcels.
+    """
+    def __init__(self, max_entries=DEFAULT_DETAIL_CACHE_ENTRIES):
+        """
+         Constructor
+
+        :param max_entries: maximum number of cached parcels (integer)
+        """
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+
+        # {(base_url, api_key, parcel_id): (attributes, geom_wkt)}
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(base_url, api_key, parcel_id):
+        """
+         Returns the cache key of the given parcel.
+
+        :return: cache key (tuple)
+        """
+        return base_url, api_key, int(parcel_id)
+
+    def get(self, key):
+        """
+         Returns the cached detail data of the given key.
+
+        :param key: cache key; see make_key()
+
+        :return: tuple of attribute dictionary and geometry as WKT or None if the parcel is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def put(self, key, detail_data):
+        """
+         Stores the detail data of the given key and evicts the least recently used entries.
+
+        :param key: cache key; see make_key()
+        :param detail_data: tuple of attribute dictionary and geometry as WKT
+        """
+        with self._lock:
+            self._entries[key] = detail_data
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def contains(self, key):
+        """
+         Checks if the given key is cached.
+        """
+        with self._lock:
+            return key in self._entries
+
+    def clear(self):
+        """
+         Removes all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class BandwidthLimiter(object):
+    """
+     Limits the average download rate of the threads sharing an instance by delaying them after every downloaded
+     chunk.
+    """
+    def __init__(self, max_bytes_per_second=0):
+        """
+         Constructor
+
+        :param max_bytes_per_second: maximum average download rate (integer); 0 is unlimited
+        """
+        self.max_bytes_per_second = max_bytes_per_second
+
+        self._lock = threading.Lock()
+        # point in time at which the bytes downloaded so far are "paid for"
+        self._next = time.monotonic()
+
+    def consume(self, size, cancel_token=None):
+        """
+         Accounts the given number of downloaded bytes and waits until the rate is below the limit again.
+
+        :param size: number of downloaded bytes (integer)
+        :param cancel_token: agknow_http.CancelToken which ends the waiting (optional)
+        """
+        if self.max_bytes_per_second <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + float(size) / self.max_bytes_per_second
+            delay = self._next - now
+
+        while delay > 0:
+            if cancel_token is not None:
+                cancel_token.check()
+
+            time.sleep(min(delay, 0.2))
+            delay -= 0.2
+
+
+def neighbour_parcels(parcel_ids, index, count):
+    """
+     Returns the parcels around the given position of the parcel list, nearest first (next before previous).
+
+    :param parcel_ids: parcel ids in the order of the parcel list (list)
+    :param index: position of the selected parcel (integer)
+    :param count: number of parcels before and after the selected parcel (integer)
+
+    :return: list of parcel ids
+    """
+    neighbours = []
+
+    for distance in range(1, count + 1):
+        for i in (index + distance, index - distance):
+            if 0 <= i < len(parcel_ids):
+                neighbours.append(parcel_ids[i])
+
+    return neighbours
+
+
+_detail_cache = None
+_detail_cache_lock = threading.Lock()
+
+
+def get_detail_cache():
+    """
+     Returns the detail data cache shared by the dock widget and the prefetcher.
+
+    :return: DetailCache
+    """
+    global _detail_cache
+
+    with _detail_cache_lock:
+        if _detail_cache is None:
+            _detail_cache = DetailCache()
+
+        return _detail_cache
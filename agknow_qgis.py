@@ -33,6 +33,14 @@ from .agknow_qgis_dockwidget import AgknowDockWidget
 from .agknow_qgis_dockwidget_timeslider import AgknowDockWidgetTimeSlider
 
 from .agknow_worker import *
+from . import agknow_http
+from . import agknow_utils
+from . import agknow_raster_cache
+from . import agknow_metadata_cache
+from . import agknow_vsimem
+from . import agknow_playback
+from . import agknow_prefetch
+from . import agknow_async
 
 from qgis.core import QgsProject
 
@@ -190,6 +198,9 @@ class Agknow(object):
             callback=self.run,
             parent=self.iface.mainWindow())
 
+        # release the in-memory rasters of removed image layers
+        QgsProject.instance().layersRemoved.connect(agknow_vsimem.get_registry().release_layers)
+
     #--------------------------------------------------------------------------
 
     def onClosePlugin(self):
@@ -202,6 +213,9 @@ class Agknow(object):
         print("saving settings..")
         self.save_settings()
 
+        if self.main_dockwidget is not None:
+            self.main_dockwidget.flush_caches()
+
         self.clear_plugin_layers()
 
         # custom events
@@ -222,6 +236,9 @@ class Agknow(object):
         self.iface.removeDockWidget(self.main_dockwidget)
         self.iface.removeDockWidget(self.timeslider_dockwidget)
 
+        # the timeslider is not reused: stop the threads of its frame prefetcher
+        self.timeslider_dockwidget.prefetcher.close()
+
         self.main_dockwidget = None
         self.timeslider_dockwidget = None
 
@@ -238,6 +255,9 @@ class Agknow(object):
         print("saving settings..")
         self.save_settings()
 
+        if self.main_dockwidget is not None:
+            self.main_dockwidget.flush_caches()
+
         for action in self.actions:
             self.iface.removePluginMenu(
                 self.tr(u'&agknow for QGIS'),
@@ -246,8 +266,21 @@ class Agknow(object):
         # remove the toolbar
         del self.toolbar
 
+        # stop the running workers before their layers and buffers are gone
+        if self.main_dockwidget is not None:
+            self.main_dockwidget.tasks.cancel()
+
+        # release the decoded frames and stop the threads of the frame prefetcher
+        if self.timeslider_dockwidget is not None:
+            self.timeslider_dockwidget.prefetcher.close()
+
         self.clear_plugin_layers()
 
+        QgsProject.instance().layersRemoved.disconnect(agknow_vsimem.get_registry().release_layers)
+        agknow_vsimem.get_registry().clear()
+
+        agknow_async.stop_event_loop_thread()
+
     def clear_plugin_layers(self):
         """
         Clears parcel & img layer of agknow_qgis
@@ -302,6 +335,8 @@ class Agknow(object):
                  # Create the dockwidget (after translation) and keep reference
                 self.timeslider_dockwidget = AgknowDockWidgetTimeSlider()
 
+                self.read_timeslider_settings()
+
             # connect to provide cleanup on closing of dockwidget
             self.main_dockwidget.closingPlugin.connect(self.onClosePlugin)
             self.timeslider_dockwidget.closingPlugin.connect(self.onClosePlugin)
@@ -382,3 +417,108 @@ class Agknow(object):
 
         self.main_dockwidget.tbHostURL.setText(base_url)
         self.main_dockwidget.tbAPIKey.setText(api_key)
+
+        # number of concurrent requests of the worker jobs
+        self.main_dockwidget.settings["max_workers"] = int(s.value("agknow_qgis/max_workers", DEFAULT_MAX_WORKERS))
+        self.main_dockwidget.settings["process_workers"] = int(s.value("agknow_qgis/process_workers",
+                                                                       DEFAULT_PROCESS_WORKERS))
+
+        # paging of the parcel list and number of features added to the parcel layer at once
+        self.main_dockwidget.settings["page_size"] = int(s.value("agknow_qgis/page_size",
+                                                                 agknow_utils.DEFAULT_PAGE_SIZE))
+        self.main_dockwidget.settings["chunk_size"] = int(s.value("agknow_qgis/chunk_size",
+                                                                  agknow_utils.DEFAULT_CHUNK_SIZE))
+
+        # create the TOC groups of a parcel only when it is selected or gets images (all-at-once mode)
+        self.main_dockwidget.settings["lazy_toc"] = s.value("agknow_qgis/lazy_toc", True, type=bool)
+
+        # no layers for the dates of the images: the timeslider shows them in a single playback layer per group
+        self.main_dockwidget.settings["single_layer"] = s.value("agknow_qgis/timeslider_single_layer", True,
+                                                                type=bool)
+
+        # background prefetching of the parcels around the selected one (one-by-one mode)
+        self.main_dockwidget.settings["prefetch_parcels"] = int(s.value("agknow_qgis/prefetch_parcels",
+                                                                        agknow_prefetch.DEFAULT_PREFETCH_PARCELS))
+        self.main_dockwidget.settings["prefetch_mode"] = s.value("agknow_qgis/prefetch_mode",
+                                                                 agknow_prefetch.DEFAULT_PREFETCH_MODE)
+        self.main_dockwidget.settings["prefetch_workers"] = max(int(s.value("agknow_qgis/prefetch_workers",
+                                                                            agknow_prefetch.DEFAULT_PREFETCH_WORKERS)),
+                                                                1)
+        self.main_dockwidget.settings["prefetch_max_kbps"] = int(s.value("agknow_qgis/prefetch_max_kbps",
+                                                                         agknow_prefetch.DEFAULT_PREFETCH_MAX_KBPS))
+
+        # engine of the worker jobs ("threads" or "asyncio") and the limits of the asynchronous HTTP client
+        engine = s.value("agknow_qgis/engine", agknow_async.DEFAULT_ENGINE)
+        if engine not in (agknow_async.ENGINE_THREADS, agknow_async.ENGINE_ASYNCIO):
+            engine = agknow_async.DEFAULT_ENGINE
+        self.main_dockwidget.settings["engine"] = engine
+
+        # transfer of the raster images ("memory", "stream" or "vsicurl")
+        transfer = s.value("agknow_qgis/raster_transfer", agknow_utils.DEFAULT_RASTER_TRANSFER)
+        if transfer not in (agknow_utils.TRANSFER_MEMORY, agknow_utils.TRANSFER_STREAM, agknow_utils.TRANSFER_VSICURL):
+            transfer = agknow_utils.DEFAULT_RASTER_TRANSFER
+        self.main_dockwidget.settings["raster_transfer"] = transfer
+
+        agknow_async.configure_event_loop(
+            max_connections=int(s.value("agknow_qgis/async_connections", agknow_async.DEFAULT_ASYNC_CONNECTIONS)),
+            max_in_flight=int(s.value("agknow_qgis/async_in_flight", agknow_async.DEFAULT_ASYNC_IN_FLIGHT)))
+
+        # persistent raster cache
+        if s.value("agknow_qgis/raster_cache", True, type=bool):
+            max_mb = int(s.value("agknow_qgis/raster_cache_size_mb",
+                                 agknow_raster_cache.DEFAULT_MAX_BYTES // (1024 * 1024)))
+            self.main_dockwidget.raster_cache.set_max_bytes(max_mb * 1024 * 1024)
+        else:
+            self.main_dockwidget.raster_cache = None
+
+        # persistent cache of the JSON responses, revalidated with conditional requests
+        if s.value("agknow_qgis/metadata_cache", True, type=bool):
+            self.main_dockwidget.metadata_cache.ttl = int(s.value("agknow_qgis/metadata_cache_ttl",
+                                                                  agknow_metadata_cache.DEFAULT_TTL))
+            self.main_dockwidget.metadata_cache.set_max_bytes(int(s.value(
+                "agknow_qgis/metadata_cache_size_mb", agknow_metadata_cache.DEFAULT_MAX_BYTES // (1024 * 1024)))
+                * 1024 * 1024)
+        else:
+            self.main_dockwidget.metadata_cache = None
+
+        self.main_dockwidget.utils.metadata_cache = self.main_dockwidget.metadata_cache
+
+        # budget of the in-memory rasters; above it image layers are moved to disk
+        agknow_vsimem.get_registry().set_budget(
+            int(s.value("agknow_qgis/vsimem_budget_mb", agknow_vsimem.DEFAULT_BUDGET_BYTES // (1024 * 1024)))
+            * 1024 * 1024)
+
+        # connection pool, retries, rate limit and circuit breaker of the shared HTTP session
+        agknow_http.configure_session(
+            pool_connections=int(s.value("agknow_qgis/http_pool_connections", agknow_http.DEFAULT_POOL_CONNECTIONS)),
+            pool_maxsize=int(s.value("agknow_qgis/http_pool_maxsize", agknow_http.DEFAULT_POOL_MAXSIZE)),
+            pool_block=s.value("agknow_qgis/http_pool_block", agknow_http.DEFAULT_POOL_BLOCK, type=bool),
+            keep_alive=s.value("agknow_qgis/http_keep_alive", True, type=bool),
+            max_retries=int(s.value("agknow_qgis/http_max_retries", agknow_http.DEFAULT_MAX_RETRIES)),
+            backoff=float(s.value("agknow_qgis/http_backoff", agknow_http.DEFAULT_BACKOFF)),
+            rate_limit=float(s.value("agknow_qgis/http_rate_limit", agknow_http.DEFAULT_RATE_LIMIT)),
+            rate_burst=int(s.value("agknow_qgis/http_rate_burst", agknow_http.DEFAULT_RATE_BURST)),
+            breaker_threshold=int(s.value("agknow_qgis/http_breaker_threshold",
+                                          agknow_http.DEFAULT_BREAKER_THRESHOLD)),
+            breaker_reset=float(s.value("agknow_qgis/http_breaker_reset", agknow_http.DEFAULT_BREAKER_RESET)),
+            breaker_max_pause=float(s.value("agknow_qgis/http_breaker_max_pause",
+                                            agknow_http.DEFAULT_BREAKER_MAX_PAUSE)))
+
+    def read_timeslider_settings(self):
+        """
+         Reads the settings of the timeslider from global QSettings object
+        """
+        s = QSettings()
+
+        # playback with a single layer per group and number of frames decoded ahead
+        self.timeslider_dockwidget.single_layer = s.value("agknow_qgis/timeslider_single_layer", True, type=bool)
+        self.timeslider_dockwidget.prefetcher.prefetch_frames = int(
+            s.value("agknow_qgis/timeslider_prefetch_frames", agknow_playback.DEFAULT_PREFETCH_FRAMES))
+
+        # animation with pre-rendered frames
+        self.timeslider_dockwidget.animate = s.value("agknow_qgis/timeslider_animation", True, type=bool)
+        self.timeslider_dockwidget.fps = max(float(s.value("agknow_qgis/timeslider_fps", agknow_playback.DEFAULT_FPS)),
+                                             0.1)
+        self.timeslider_dockwidget.frame_cache.max_bytes = int(
+            s.value("agknow_qgis/timeslider_frame_cache_mb",
+                    agknow_playback.DEFAULT_FRAME_CACHE_BYTES // (1024 * 1024))) * 1024 * 1024
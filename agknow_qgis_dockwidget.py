@@ -26,18 +26,25 @@ from __future__ import absolute_import
 from builtins import next
 from builtins import str
 from qgis.PyQt import QtWidgets, uic
-from qgis.PyQt.QtCore import pyqtSignal, pyqtSlot, QVariant, Qt, QThread, QDate
+from qgis.PyQt.QtCore import pyqtSignal, pyqtSlot, QVariant, Qt, QDate
 from qgis.PyQt.QtWidgets import QApplication,QFileDialog
 import qgis.utils
 from qgis._core import QgsDataProvider
 
 from qgis.core import QgsRasterLayer, QgsPoint, QgsVectorLayer, QgsGeometry,  \
     QgsFields, QgsField, QgsFeatureRequest, QgsExpression, QgsProject, Qgis, QgsMessageLog, QgsLayerTreeLayer, \
-     QgsMapLayerProxyModel
+     QgsMapLayerProxyModel, QgsCoordinateTransform
 
 from .agknow_worker import *
 
 from . import agknow_utils
+from . import agknow_raster_cache
+from . import agknow_metadata_cache
+from . import agknow_vsimem
+from . import agknow_toc
+from . import agknow_tasks
+from . import agknow_prefetch
+from . import agknow_async
 
 import json
 import os
@@ -85,6 +92,18 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.plugin_path = os.path.dirname(__file__)
         self.style_path = self.plugin_path + os.sep + "parcels-style-yellow.qml"
 
+        # persistent cache of downloaded rasters; may be disabled (None) in the settings
+        self.raster_cache = agknow_raster_cache.RasterCache(os.path.join(self.plugin_path, "cache", "rasters"))
+
+        # persistent cache of the parcel list, detail data and raster lists; may be disabled (None) in the settings
+        self.metadata_cache = agknow_metadata_cache.MetadataCache(os.path.join(self.plugin_path, "cache", "metadata"))
+
+        # in-memory rasters of the image layers; released when the layers are removed from the project
+        self.vsimem = agknow_vsimem.get_registry()
+
+        # detail data of parcels which have been prefetched
+        self.detail_cache = agknow_prefetch.get_detail_cache()
+
         self.current_project_epsg = self.get_current_project_epsg()
 
         QgsMessageLog.logMessage("Current EPSG: {0}".format(self.current_project_epsg), 'agknow', Qgis.Info)
@@ -104,14 +123,30 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self.parcel_ids = []
 
+        # index of the agknow groups and image layers of the TOC
+        self.toc = agknow_toc.get_index()
+
         self.init_image_lyr()
 
         self.settings = {"parcel_download_mode": "one-by-one",
                          "image_format": "tif",
-                         "connected": False}
+                         "connected": False,
+                         "max_workers": DEFAULT_MAX_WORKERS,
+                         "process_workers": DEFAULT_PROCESS_WORKERS,
+                         "page_size": agknow_utils.DEFAULT_PAGE_SIZE,
+                         "chunk_size": agknow_utils.DEFAULT_CHUNK_SIZE,
+                         "lazy_toc": True,
+                         "single_layer": True,
+                         "prefetch_parcels": agknow_prefetch.DEFAULT_PREFETCH_PARCELS,
+                         "prefetch_mode": agknow_prefetch.DEFAULT_PREFETCH_MODE,
+                         "prefetch_workers": agknow_prefetch.DEFAULT_PREFETCH_WORKERS,
+                         "prefetch_max_kbps": agknow_prefetch.DEFAULT_PREFETCH_MAX_KBPS,
+                         "engine": agknow_async.DEFAULT_ENGINE,
+                         "raster_transfer": agknow_utils.DEFAULT_RASTER_TRANSFER}
 
         self.api_version = "/agknow/api/v" + str(self.cbAPIVersion.currentText())
         self.utils = agknow_utils.AgknowUtils(self.api_version)
+        self.utils.metadata_cache = self.metadata_cache
 
         self.product = "vitality"
         self.data_source = "sentinel2"
@@ -126,6 +161,15 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self.parcel_id_to_set = None
 
+        # tag of the selected parcel's images whose refresh has been requested while they were downloaded
+        self.pending_refresh = None
+
+        # running workers (QgsTasks) with their aggregated progress
+        self.tasks = agknow_tasks.AgknowTaskManager()
+        self.tasks.progress.connect(self.update_progress)
+        self.parcel_pages_received = 0
+        self.parcel_list_valid = False
+
         # {raster_group_id: [raster data in json format]}
         # raster_group_id = "{0}_{1}_{2}_{3}".format(parcel_id, self.product_id, self.data_source, self.img_format)
         self.rasters = {}
@@ -359,18 +403,7 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         node_layer = QgsLayerTreeLayer(parcelLyr)
         root.insertChildNode(0, node_layer)
 
-        fields = QgsFields()
-        fields.append(QgsField("parcel_id", QVariant.Int))
-        fields.append(QgsField("name", QVariant.String))
-        fields.append(QgsField("entity", QVariant.String))
-        fields.append(QgsField("crop", QVariant.String))
-        fields.append(QgsField("startdate", QVariant.String))
-        fields.append(QgsField("enddate", QVariant.String))
-        fields.append(QgsField("planting", QVariant.String))
-        fields.append(QgsField("harvest", QVariant.String))
-        fields.append(QgsField("area", QVariant.Double))
-        fields.append(QgsField("apikey", QVariant.String))
-        fields.append(QgsField("host", QVariant.String))
+        fields = agknow_utils.parcel_fields()
 
         pr = parcelLyr.dataProvider()
         pr.addAttributes(fields)
@@ -396,11 +429,14 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         # add new images group
         images_group = root.addGroup("images")
 
+        self.toc.bind(images_group)
+
     def closeEvent(self, event):
         """
           Handles the close event of the class.
          :param event:
          """
+        self.tasks.cancel()
         self.closingPlugin.emit()
         event.accept()
 
@@ -428,11 +464,17 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         """
          Exports all images in the TOC of the agknow plugin to the selected directory on disk
          and changes datasource from memory map to disk files.
+
+         The export runs as a background task; the data sources are changed when it has finished.
         """
         directory = str(QFileDialog.getExistingDirectory(self, "Select Directory"))
 
         print("Selected directory: {0}".format(directory))
 
+        if len(directory) == 0:
+            return
+
+        exports = []
         for key in self.rasters.keys():
             rasterList = self.rasters[key]
             #print(rasterList)
@@ -442,63 +484,98 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
              'date': '2019-01-20', 'png': '/parcels/132060/vitality/sentinel2/4604179.png',
              'mmap_name': '/vsimem/213570cbc57a4204a9ea809210324c02'}, ...]'''
 
-            new_rasters = []
             for raster in rasterList:
                 # mmap_name may also be a persistent path on disk!
                 mmap_name = raster["mmap_name"]
                 print(mmap_name)
 
-                raster_id = raster["raster_id"]
                 date = raster["date"]
                 img_url = raster["png"]
-                parcel_id = raster["parcel_id"]
-                product_id = raster["product"]
-                data_source = raster["source"]
 
                 out_path = os.path.join(directory, f"agknow-{datetime.date.today()}", os.sep.join(img_url.lstrip('/').split('/')))
 
                 out_path = "{0}_{1}.{2}".format(out_path.strip(".png"), date, self.settings["image_format"])
-                out_path_subdir = os.path.dirname(out_path)
 
-                if not os.path.exists(out_path_subdir):
-                    os.makedirs(out_path_subdir, exist_ok=True)
+                # keep the buffer alive while it is exported, even if its layer is removed in the meantime
+                self.vsimem.acquire(mmap_name)
+
+                exports.append((mmap_name, out_path))
 
-                print("Exporting to {0}..".format(out_path))
-                self.utils.exportGDALraster(mmap_name, out_path)
+        if len(exports) == 0:
+            return
 
-                # change mmap_name in layers datasource
+        self.init_progressBar()
 
-                if mmap_name.startswith("/vsimem"):
-                    # memory clean up
-                    gdal.Unlink(mmap_name)
+        # exports are written one after the other
+        self.startWorker(_runMethod="export_images",
+                         _finishedEvtMethod="export_images_finished",
+                         _errorEvtMethod="export_images_error",
+                         _dependencies=self.tasks.running("export_images"),
+                         exports=exports)
 
-                # find in TOC
-                root = QgsProject.instance().layerTreeRoot()
+    def export_images_finished(self, ret):
+        """
+         Event handler for the finished event of the export_images worker: changes the data sources of the exported
+         layers from memory map to the files on disk.
 
-                product_group = root.findGroup("parcel id: {0}".format(parcel_id)).findGroup(
-                    product_id + " ").findGroup(
-                    data_source)
+        :param ret: list of tuples (memory map string or path, output path, exported)
+        """
+        print("export_images_finished()")
 
-                # get layer of this group
-                for child in product_group.children():
+        self.cleanup_threading()
+
+        exported = 0
+        for mmap_name, out_path, ok in ret:
+            if ok:
+                for raster in [r for rasters in self.rasters.values() for r in rasters if r["mmap_name"] == mmap_name]:
+                    # change mmap_name in layers datasource
+
+                    # find in TOC
                     # layername: vitality|2021-09-25|8315|sentinel2
-                    if child.name() == f"{product_id}|{date}|{raster_id}|{data_source}":
+                    child = self.toc.find_layer(raster["parcel_id"], raster["product"], raster["source"],
+                                                "{0}|{1}|{2}|{3}".format(raster["product"], raster["date"],
+                                                                         raster["raster_id"], raster["source"]))
+
+                    if child is not None:
                         rLry = child.layer()
                         rLry.setDataSource(out_path, child.name(), "gdal", QgsDataProvider.ProviderOptions())
 
-                # update mmap_name with new path
-                raster["mmap_name"] = out_path
-                new_rasters.append(raster)
+                        # memory clean up
+                        self.vsimem.release_layer(rLry.id())
+
+                    # update mmap_name with new path
+                    raster["mmap_name"] = out_path
+
+                # memory clean up of an image without layer (single layer mode)
+                self.vsimem.release_layer(self.raster_owner_id(mmap_name))
+
+                exported += 1
+
+            # reference of the export
+            self.vsimem.release(mmap_name)
+
+        self.iface.messageBar().clearWidgets()
 
-            # change mmap_name in self.rasters dictionary
-            self.rasters[key] = new_rasters
+        QgsMessageLog.logMessage("Exported {0} of {1} images.".format(exported, len(ret)), "agknow", Qgis.Info)
 
+    def export_images_error(self, ret):
+        """
+         Event handler for the error event of the export_images worker.
+
+        :param ret: traceback of the error (string)
+        """
+        print("export_images_error()")
+
+        QgsMessageLog.logMessage("export_images_error(): {0}".format(ret), "agknow", Qgis.Warning)
 
     def disconnect(self):
         """
          Disconnects from agknowledge REST API.
         """
 
+        # stop all running workers
+        self.tasks.cancel()
+
         # clear combobox, lyr, parcel_ids
         self.cbResultsIDName.clear()
         self.settings["connected"] = False
@@ -529,24 +606,39 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.rasters = {}
         self.read_agknow_settings()
 
+        # the datum transformations of the project may have changed since the last connect
+        agknow_utils.clear_transform_cache()
+
+        # the detail data is fetched again after a reconnect
+        self.detail_cache.clear()
+
         api_key = self.tbAPIKey.text()
         host_url = self.tbHostURL.text()
         
         base_url = host_url + self.api_version
 
-        # limited to 1000 at the moment
-        # TODO: paging
-        limit = 2500
-        offset = 0 #6000
-        params = "/parcels/?key={0}&limit={1}&offset={2}".format(api_key, limit, offset)
+        # the parcel list is fetched page by page; every page is added to the GUI as soon as it arrives
+        self.parcel_pages_received = 0
+        self.parcel_list_valid = False
+
         # async with worker
         # set up progress bar
         self.init_progressBar(min_value=0, max_value=0)
-        kwargs = {"base_url": base_url, "params": params, "ssl_verify": True, "api_version": self.api_version}
+        kwargs = {"base_url": base_url, "api_key": api_key, "ssl_verify": True, "api_version": self.api_version,
+                  "page_size": self.settings["page_size"], "max_workers": self.settings["max_workers"],
+                  "chunk_size": self.settings["chunk_size"], "metadata_cache": self.metadata_cache,
+                  "engine": self.settings["engine"]}
+
+        # all-at-once: the worker fetches the detail data of every page as well
+        if self.settings["parcel_download_mode"] == "all-at-once":
+            kwargs["parcelLyr"] = self.parcelLyr
+            kwargs["project_epsg"] = self.get_current_project_epsg()
+
         print(kwargs)
-        self.startWorker(_runMethod="http_get",
-                         _finishedEvtMethod="get_parcel_base_data_finished",
+        self.startWorker(_runMethod="get_parcel_pages",
+                         _finishedEvtMethod="get_parcel_pages_finished",
                          _errorEvtMethod="get_parcel_base_data_error",
+                         _partialEvtMethod="get_parcel_page",
                          **kwargs)
 
     def cbResultsIDName_currentIndexChanged(self):
@@ -563,12 +655,7 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self.update_parcel_data_and_images()
 
-        # find subgroup
-        root = QgsProject.instance().layerTreeRoot()
-        parcel_group = root.findGroup("parcel id: {0}".format(self.get_current_parcel_id()))
-
-        if parcel_group is not None:
-            self.toggle_data_sources(parcel_group)
+        self.toggle_data_sources(self.get_current_parcel_id())
 
 
     def cbPolygonLayer_currentIndexChanged(self):
@@ -623,6 +710,7 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         """
         self.api_version = "/agknow/api/v" + str(self.cbAPIVersion.currentText())
         self.utils = agknow_utils.AgknowUtils(self.api_version)
+        self.utils.metadata_cache = self.metadata_cache
 
 
     def clear_register_data(self):
@@ -654,7 +742,7 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         kwargs = {"base_url": base_url, "params": params, "feature_to_register": register_data,
                   "ssl_verify": True, "api_key": api_key, "geometry_epsg": self.get_layer_epsg(self.get_current_register_layer()),
-                  "api_version": self.api_version}
+                  "api_version": self.api_version, "engine": self.settings["engine"]}
 
         self.startWorker(_runMethod="register_feature",
                          _finishedEvtMethod="register_feature_finished",
@@ -712,12 +800,11 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
     def refresh_data(self):
         """
-         Refresh data for current parcel.
+         Refresh data for current parcel. The refresh is incremental: only the new scenes are downloaded and the
+         removed ones are dropped; the images of the other parcels and products stay as they are.
         """
         parcel_id = self.get_current_parcel_id()
 
-        self.clear_images_toc(parcel_id, self.product, self.data_source)
-        self.rasters = {}
         self.read_agknow_settings()
 
         api_key = self.tbAPIKey.text()
@@ -725,7 +812,7 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         
         base_url = host_url + self.api_version
 
-        self.update_parcel_images(api_key, base_url, [parcel_id])
+        self.update_parcel_images(api_key, base_url, [parcel_id], selected=True, refresh=True)
 
     def rdBtnDataSourceState_toggled(self, btn):
         """
@@ -752,48 +839,28 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             # update images in toc
             self.update_parcel_data_and_images()
 
-            # find subgroup
-            root = QgsProject.instance().layerTreeRoot()
-            parcel_group = root.findGroup("parcel id: {0}".format(self.get_current_parcel_id()))
-
-            if parcel_group is not None:
-                self.toggle_data_sources(parcel_group)
+            self.toggle_data_sources(self.get_current_parcel_id())
 
         # restore cursor
         QApplication.restoreOverrideCursor()
 
-    def toggle_data_sources(self, parcel_group):
+    def toggle_data_sources(self, parcel_id):
         """
-         Toggle all other data_source groups off except the given data_source and parcel group.
+         Toggle all other data_source groups of the given parcel off except the one of the current product and
+         data source.
 
-        :param data_source: "landsat8" or "sentinel2" (string)
-        :param parcel_group: (QgsLayerTreeGroup)
+        :param parcel_id: the parcel's ID (integer)
         """
         print("toggle_data_sources()")
 
-        data_source_list = ["landsat8", "sentinel2"]
-        matrix = {"landsat8": ["visible", "vitality", "variations"],
-                  "sentinel2": ["visible", "vitality", "variations", "reflectances", "ndvi", "ndre1", "ndre2", "ndre3",
-                                    "ndwi", "savi", "evi2", "cire"]}
-
         # turn off other data_source groups
-        for ds in data_source_list:
-            #print("checking {0}..".format(ds))
-            for p in matrix[ds]:
-                #print("checking product {0}..".format(p))
-                pg = parcel_group.findGroup(p + " ")
-
-                if pg is not None:
-                    #print("group {0} found!".format(p))
-                    g = pg.findGroup(ds)
-
-                    if g is not None:
-                        if p == self.product and ds == self.data_source:
-                            #print("group {0} visible".format(ds))
-                            g.setItemVisibilityChecked(Qt.Checked)
-                        else:
-                            #print("group {0} invisible!".format(ds))
-                            g.setItemVisibilityChecked(Qt.Unchecked)
+        for p, ds, g in self.toc.data_source_groups(parcel_id):
+            if p == self.product and ds == self.data_source:
+                #print("group {0} visible".format(ds))
+                g.setItemVisibilityChecked(Qt.Checked)
+            else:
+                #print("group {0} invisible!".format(ds))
+                g.setItemVisibilityChecked(Qt.Unchecked)
 
 
     def read_agknow_settings(self):
@@ -809,6 +876,14 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         if self.rdBtnImgOptTiff.isChecked():
             self.settings["image_format"] = "tif"
 
+    def flush_caches(self):
+        """
+         Writes the indexes of the persistent caches to disk.
+        """
+        for cache in (self.raster_cache, self.metadata_cache):
+            if cache is not None:
+                cache.flush()
+
     def get_current_parcel_id(self):
         """
          Returns the current parcel id.
@@ -852,8 +927,13 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             if parcel_id not in self.parcel_ids:
 
                 # sync download of parcel's detail data, because it is not worth it to start a worker for this
-                # read geom as WKT
-                attributes, geom_wkt = self.utils.get_parcel_detail_data(base_url, api_key, parcel_id)
+                # read geom as WKT; the data may have been prefetched already
+                detail_data = self.detail_cache.get(agknow_prefetch.DetailCache.make_key(base_url, api_key, parcel_id))
+
+                if detail_data is None:
+                    detail_data = self.utils.get_parcel_detail_data(base_url, api_key, parcel_id)
+
+                attributes, geom_wkt = detail_data
 
                 geom = QgsGeometry.fromWkt(geom_wkt)
 
@@ -896,7 +976,7 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             # restore cursor
             QApplication.restoreOverrideCursor()
 
-    def update_parcel_images(self, api_key, base_url, parcel_ids):
+    def update_parcel_images(self, api_key, base_url, parcel_ids, selected=False, refresh=False, finished_task=None):
         """
          Updates the images for the given list of parcel ids if necessary.
 
@@ -904,10 +984,18 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         - checks for raster ids in self.rasters to prevent duplicate download
           {parcel_id + product + data_source : [raster_ids]}
+        - if the images of the selected parcel are requested, the image downloads of the previously selected parcel,
+          product or data source are cancelled
+        - on refresh the raster lists of the server are compared with the loaded rasters by raster_id; only the new
+          rasters are downloaded and the removed ones are dropped (see add_images())
 
         :param api_key: API key for agknow service (string)
         :param base_url: base URL for the agknow service (string)
         :param parcel_ids: list of parcel's ID (list of integers)
+        :param selected: parcel_ids is the selected parcel (boolean); default is False
+        :param refresh: synchronize the loaded rasters with the server (boolean); default is False
+        :param finished_task: WorkerTask whose job has just finished (it is not done yet while its signals are
+                              handled), so it does not count as running download; optional
         """
         print("update_parcel_images()")
         # wait cursor
@@ -915,17 +1003,41 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self.read_agknow_settings()
 
+        tag = None
+        if selected:
+            tag = "{0}_{1}_{2}_{3}".format(parcel_ids[0], self.product, self.data_source,
+                                           self.settings["image_format"])
+
+            # the jobs of the previous selection are obsolete now
+            self.tasks.cancel("get_images", keep_tag=tag)
+
+            # the images of the selection are being downloaded already; a refresh follows the running job
+            if any(t is not finished_task for t in self.tasks.running("get_images", tag=tag)):
+                if refresh:
+                    self.pending_refresh = tag
+                    QgsMessageLog.logMessage("Refresh of {0} queued after the running download".format(tag),
+                                             "agknow", Qgis.Info)
+
+                QApplication.restoreOverrideCursor()
+                return
+
         # image download
         if self.chkBoxDownloadImg.isChecked():
 
-            for parcel_id in parcel_ids:
+            # {raster_group_id: raster ids} of the loaded rasters which are synchronized with the server
+            known_raster_ids = {}
+
+            for parcel_id in list(parcel_ids):
 
                 # unique ID for parcel, product, data_source and img_format
                 raster_group_id = "{0}_{1}_{2}_{3}".format(parcel_id, self.product, self.data_source,
                                                            self.settings["image_format"])
 
+                if refresh and raster_group_id in self.rasters:
+                    known_raster_ids[raster_group_id] = [r["raster_id"] for r in self.rasters[raster_group_id]]
+
                 # in checks for keys in dictionary
-                if raster_group_id not in self.rasters:
+                elif raster_group_id not in self.rasters:
                     print("raster_group_id: {0} not found - downloading from server..".format(raster_group_id))
                     QgsMessageLog.logMessage("raster_group_id: {0} not found - downloading from server..".format(raster_group_id), "agknow",
                                              Qgis.Info)
@@ -956,11 +1068,17 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                           "data_source": self.data_source, "ssl_verify": True, "api_key": api_key,
                           "img_format": self.settings["image_format"],
                           "project_epsg": self.get_current_project_epsg(),
-                          "api_version": self.api_version}
+                          "api_version": self.api_version, "max_workers": self.settings["max_workers"],
+                          "process_workers": self.settings["process_workers"],
+                          "raster_cache": self.raster_cache, "metadata_cache": self.metadata_cache,
+                          "known_raster_ids": known_raster_ids, "engine": self.settings["engine"],
+                          "raster_transfer": self.settings["raster_transfer"]}
 
                 self.startWorker(_runMethod="get_images",
                                  _finishedEvtMethod="get_images_finished",
                                  _errorEvtMethod="get_images_error",
+                                 _partialEvtMethod="get_images_partial",
+                                 _tag=tag,
                                  **kwargs)
             else:
 
@@ -1001,9 +1119,93 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self.update_parcel_data(api_key, base_url, parcel_id)
 
+        # create the groups of the selected parcel (lazy TOC)
+        self.toc.materialize(parcel_id)
+
         self.toggle_parcels_toc(parcel_id)
 
-        self.update_parcel_images(api_key, base_url, [parcel_id])
+        self.update_parcel_images(api_key, base_url, [parcel_id], selected=True)
+
+        # warm the caches for the parcels the user is likely to select next
+        self.prefetch_parcels(api_key, base_url, parcel_id)
+
+    def prefetch_parcels(self, api_key, base_url, parcel_id):
+        """
+         Starts prefetching the detail data and images of the parcels around the given one in the background
+         (one-by-one mode): the next and previous parcels of the parcel list or the parcels within the current
+         map extent. A running prefetch job of the previous selection is cancelled.
+
+        :param api_key: API key for agknow service (string)
+        :param base_url: base URL for the agknow service (string)
+        :param parcel_id: parcel's ID of the selected parcel (integer)
+        """
+        self.tasks.cancel("prefetch_parcels")
+
+        count = int(self.settings["prefetch_parcels"])
+
+        if count <= 0 or self.settings["parcel_download_mode"] != "one-by-one":
+            return
+
+        if self.settings["prefetch_mode"] == "extent":
+            parcel_ids = self.parcels_in_extent()[:2 * count]
+        else:
+            parcel_ids = agknow_prefetch.neighbour_parcels(
+                [int(self.cbResultsIDName.itemText(i).split(" - ")[0]) for i in range(self.cbResultsIDName.count())],
+                self.cbResultsIDName.currentIndex(), count)
+
+        parcel_ids = [p for p in parcel_ids if p != parcel_id]
+
+        if len(parcel_ids) == 0:
+            return
+
+        kwargs = {"base_url": base_url, "product_id": self.product, "parcel_ids": parcel_ids,
+                  "data_source": self.data_source, "ssl_verify": True, "api_key": api_key,
+                  "img_format": self.settings["image_format"], "api_version": self.api_version,
+                  "max_workers": self.settings["prefetch_workers"],
+                  "prefetch_max_kbps": self.settings["prefetch_max_kbps"],
+                  "foreground_idle": self.tasks.foreground_idle, "metadata_cache": self.metadata_cache}
+
+        # without the raster cache only the detail data is prefetched
+        if self.chkBoxDownloadImg.isChecked():
+            kwargs["raster_cache"] = self.raster_cache
+
+        self.startWorker(_runMethod="prefetch_parcels",
+                         _finishedEvtMethod="prefetch_parcels_finished",
+                         _errorEvtMethod="prefetch_parcels_error",
+                         **kwargs)
+
+    def parcels_in_extent(self):
+        """
+         Returns the ids of the parcels of the parcel layer within the current map extent.
+
+        :return: list of parcel ids
+        """
+        xform = QgsCoordinateTransform(QgsProject.instance().crs(), self.parcelLyr.crs(), QgsProject.instance())
+        request = QgsFeatureRequest().setFilterRect(xform.transformBoundingBox(self.canvas.extent()))
+
+        return [feat["parcel_id"] for feat in self.parcelLyr.getFeatures(request)]
+
+    def prefetch_parcels_finished(self, ret):
+        """
+         Event handler for the finished event of the prefetch_parcels worker.
+
+        :param ret: dict with the number of prefetched parcels and newly cached images or None on error
+        """
+        print("prefetch_parcels_finished()")
+
+        self.cleanup_threading()
+
+    def prefetch_parcels_error(self, ret):
+        """
+         Event handler for the error event of the prefetch_parcels worker.
+
+        :param ret: traceback of the error (string)
+        """
+        print("prefetch_parcels_error()")
+
+        self.cleanup_threading()
+
+        QgsMessageLog.logMessage("prefetch_parcels_error(): {0}".format(ret), "agknow", Qgis.Warning)
 
     def toggle_parcels_toc(self, parcel_id):
         """
@@ -1011,19 +1213,35 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
          and collapse them.
         :param parcel_id: the parcel's ID (integer)
         """
-        root = QgsProject.instance().layerTreeRoot()
+        for p, parcel_group in self.toc.parcel_groups().items():
+            if p == str(parcel_id):
+                parcel_group.setItemVisibilityChecked(Qt.Checked)
+                parcel_group.setExpanded(True)
+            else:
+                parcel_group.setItemVisibilityChecked(Qt.Unchecked)
+                parcel_group.setExpanded(False)
 
-        for p in self.parcel_ids:
+    def remove_images_toc(self, rasters):
+        """
+         Removes the layers of the given rasters from the TOC and the project. The in-memory rasters of images
+         without layer (single layer mode) are released right away.
 
-            parcel_group = root.findGroup("parcel id: {0}".format(p))
+        :param rasters: list of raster dicts
+        """
+        layer_ids = []
+        for r in rasters:
+            self.vsimem.release_layer(self.raster_owner_id(r["mmap_name"]))
 
-            if parcel_group is not None:
-                if p == parcel_id:
-                    parcel_group.setItemVisibilityChecked(Qt.Checked)
-                    parcel_group.setExpanded(True)
-                else:
-                    parcel_group.setItemVisibilityChecked(Qt.Unchecked)
-                    parcel_group.setExpanded(False)
+            child = self.toc.find_layer(r["parcel_id"], r["product"], r["source"],
+                                        "{0}|{1}|{2}|{3}".format(r["product"], r["date"], r["raster_id"], r["source"]))
+
+            if child is not None:
+                layer_ids.append(child.layerId())
+                child.parent().removeChildNode(child)
+
+        # the in-memory rasters are released with the layersRemoved signal of the project
+        if len(layer_ids) > 0:
+            QgsProject.instance().removeMapLayers(layer_ids)
 
     def clear_images_toc(self, parcel_id, product_id, data_source):
         """
@@ -1034,30 +1252,43 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         :param product_id: product id: visible, vitality, variations, etc. (string)
         :param data_source: landsat-8 or sentinel-2 (string)
         """
-        root = QgsProject.instance().layerTreeRoot()
-
-        parcel_group = root.findGroup("parcel id: {0}".format(parcel_id))
-
-        if parcel_group is not None:
-            product_group = parcel_group.findGroup(product_id)
-
-            if product_group is not None:
-                data_source_group = product_group.findGroup(data_source)
+        data_source_group = self.toc.data_source_group(parcel_id, product_id, data_source)
 
-                if data_source_group is not None:
-                    # clear all child nodes (= images per date)
-                    data_source_group.removeAllChildren()
+        if data_source_group is not None:
+            # remove the layers from the project first, so their in-memory rasters are released
+            self.remove_group_layers(data_source_group)
+            # clear all child nodes (= images per date)
+            data_source_group.removeAllChildren()
 
     def reset_toc(self):
         """
-         Removes all images from the images group of the TOC.
+         Removes all images from the images group of the TOC and releases the in-memory rasters of the images without
+         layer (single layer mode).
         """
-        root = QgsProject.instance().layerTreeRoot()
-        image_group = root.findGroup("images")
+        for rasters in self.rasters.values():
+            for r in rasters:
+                self.vsimem.release_layer(self.raster_owner_id(r["mmap_name"]))
+
+        image_group = self.toc.images_group
 
         if image_group is not None:
+            self.remove_group_layers(image_group)
             image_group.removeAllChildren()
 
+        self.toc.clear_placeholders()
+
+    def remove_group_layers(self, group):
+        """
+         Removes all layers of the given layer tree group (recursively) from the project. The in-memory rasters
+         of the layers are released with the layersRemoved signal of the project.
+
+        :param group: QgsLayerTreeGroup
+        """
+        layer_ids = [node.layerId() for node in group.findLayers()]
+
+        if len(layer_ids) > 0:
+            QgsProject.instance().removeMapLayers(layer_ids)
+
     def freeze_image_format_to_tiff(self):
         """
          Freezes the radio button to the image format tiff.
@@ -1094,23 +1325,10 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         if self.chkBoxSaveImg.isChecked():
             # save to disk
             # lyr_name = "{0}|{1}|{2}|{3}".format(r["product"], r["date"], r["raster_id"], r["source"])
-            product, date, raster_id, source = lyrName.split('|')
-            print(product, date, raster_id, source)
-
-            out_path = os.path.join(self.plugin_dir, "cache", "parcels", str(parcel_id), source, product, str(raster_id))
-
-            out_path = "{0}_{1}.{2}".format(out_path, date, self.settings["image_format"])
-
-            out_path_subdir = os.path.dirname(out_path)
-
-            if not os.path.exists(out_path_subdir):
-                os.makedirs(out_path_subdir, exist_ok=True)
-
-            print("Exporting to {0}..".format(out_path))
-            self.utils.exportGDALraster(mmap_name, out_path)
+            out_path = self.save_image(mmap_name, lyrName, parcel_id)
 
             # memory clean up
-            gdal.Unlink(mmap_name)
+            self.vsimem.release(mmap_name)
 
             rlyr = QgsRasterLayer(out_path, str(lyrName))
 
@@ -1120,55 +1338,163 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         # add to registry without showing up on TOC
         mapLyr = QgsProject.instance().addMapLayer(rlyr, addToLegend=False)
 
-        # add to product group
-        root = QgsProject.instance().layerTreeRoot()
-
-        product_group = root.findGroup("parcel id: {0}".format(parcel_id)).findGroup(product_id + " ").findGroup(
-            data_source)
+        # add map layer to the product group
+        self.toc.add_layer(parcel_id, product_id, data_source, mapLyr)
 
-        # add map layer to this group
-        product_group.addLayer(mapLyr)
+        # the layer owns the in-memory raster from now on
+        self.vsimem.bind_layer(mapLyr.id(), mmap_name)
 
         return rlyr.source()
 
-    def init_group_layers(self, parcel_id, product_id):
+    def keep_image(self, mmap_name, lyrName, parcel_id, product_id, data_source):
         """
-         Initializes the group layer structure of agknow for the given parcel ID and product.
+         Keeps the given image without adding a layer for it (single layer mode): the timeslider shows the images
+         of a data source group in its playback layer. Honors the in_memory flag of checkbox "chkBoxSaveImg".
 
+        :param mmap_name: GDAL memory map name (string)
+        :param lyrName: name of the layer (string)
         :param parcel_id: parcel's ID (integer)
         :param product_id: product id: visible, vitality, variations, etc. (string)
+        :param data_source: landsat-8 or sentinel-2 (string)
+
+        :return: memory map string or path of the image (string)
         """
-        # create or get parcel_group
-        parcel_group = self.init_base_layers(parcel_id)
+        # group of the playback layer
+        self.toc.data_source_group(parcel_id, product_id, data_source, create=True)
 
-        # add subgroups per product and data source
-        # don't know why, but vitality must not be simple 'vitality' but has to have
-        # an additional character (e.g. whitespace)
-        p_group = parcel_group.findGroup(product_id + u" ")
+        if self.chkBoxSaveImg.isChecked():
+            out_path = self.save_image(mmap_name, lyrName, parcel_id)
 
-        if p_group is None:
-            p_group = parcel_group.addGroup(product_id + u" ")
+            # memory clean up
+            self.vsimem.release(mmap_name)
 
-            if product_id in [u"visible", u"vitality", u"variations"]:
+            return out_path
 
-                ds_group = p_group.findGroup(u"landsat8")
-                if ds_group is None:
-                    p_group.addGroup(u"landsat8")
-                else:
-                    self.clear_images_toc(parcel_id, product_id, u"landsat8")
+        # the image owns the in-memory raster until it is removed, exported or spilled
+        self.vsimem.bind_layer(self.raster_owner_id(mmap_name), mmap_name)
 
-                ds_group = p_group.findGroup(u"sentinel2")
-                if ds_group is None:
-                    p_group.addGroup(u"sentinel2")
-                else:
-                    self.clear_images_toc(parcel_id, product_id, u"sentinel2")
+        return mmap_name
 
-            else:
-                ds_group = p_group.findGroup(u"sentinel2")
-                if ds_group is None:
-                    p_group.addGroup(u"sentinel2")
-                else:
-                    self.clear_images_toc(parcel_id, product_id, u"sentinel2")
+    def raster_owner_id(self, mmap_name):
+        """
+         Returns the id under which an image without layer (single layer mode) owns its in-memory raster in the
+         /vsimem registry.
+
+        :param mmap_name: GDAL memory map name or path of the image (string)
+
+        :return: string
+        """
+        return "raster:" + mmap_name
+
+    def save_image(self, mmap_name, lyrName, parcel_id):
+        """
+         Exports the given in-memory raster to the image cache of the plugin on disk.
+
+        :param mmap_name: GDAL memory map name (string)
+        :param lyrName: name of the layer (string)
+        :param parcel_id: parcel's ID (integer)
+
+        :return: path of the exported raster (string)
+        """
+        # lyr_name = "{0}|{1}|{2}|{3}".format(r["product"], r["date"], r["raster_id"], r["source"])
+        product, date, raster_id, source = lyrName.split('|')
+        print(product, date, raster_id, source)
+
+        out_path = os.path.join(self.plugin_dir, "cache", "parcels", str(parcel_id), source, product, str(raster_id))
+
+        out_path = "{0}_{1}.{2}".format(out_path, date, self.settings["image_format"])
+
+        out_path_subdir = os.path.dirname(out_path)
+
+        if not os.path.exists(out_path_subdir):
+            os.makedirs(out_path_subdir, exist_ok=True)
+
+        print("Exporting to {0}..".format(out_path))
+        self.utils.exportGDALraster(mmap_name, out_path)
+
+        return out_path
+
+    def spill_images(self):
+        """
+         Moves the oldest in-memory image layers (and images without layer) to the image cache on disk until the
+         in-memory rasters are below the budget of the /vsimem registry.
+        """
+        for layer_id, mmap_name in self.vsimem.spill_candidates():
+            lyr = QgsProject.instance().mapLayer(layer_id)
+            image_without_layer = layer_id == self.raster_owner_id(mmap_name)
+
+            # find the raster of this layer
+            raster = None
+            for rasters in self.rasters.values():
+                for r in rasters:
+                    if r.get("mmap_name") == mmap_name:
+                        raster = r
+
+            if lyr is None and not image_without_layer:
+                self.vsimem.release_layer(layer_id)
+                continue
+
+            # e.g. the decoded frame of the playback layer of the timeslider; it cannot be moved to disk
+            if raster is None:
+                continue
+
+            lyr_name = "{0}|{1}|{2}|{3}".format(raster["product"], raster["date"], raster["raster_id"],
+                                                raster["source"])
+
+            try:
+                out_path = self.save_image(mmap_name, lyr_name, raster["parcel_id"])
+
+                if lyr is not None:
+                    lyr.setDataSource(out_path, lyr.name(), "gdal", QgsDataProvider.ProviderOptions())
+
+                raster["mmap_name"] = out_path
+
+                self.vsimem.release_layer(layer_id, spilled=True)
+                # the image itself may still own the in-memory raster (e.g. it was spilled with the playback layer)
+                self.vsimem.release_layer(self.raster_owner_id(mmap_name))
+
+            except Exception as e:
+                QgsMessageLog.logMessage("spill_images(): Error moving image {0} to disk".format(lyr_name),
+                                         "agknow", Qgis.Warning)
+                QgsMessageLog.logMessage("{0}".format(e), "agknow", Qgis.Warning)
+
+    def log_memory_report(self):
+        """
+         Logs the current size of the in-memory rasters.
+        """
+        report = self.vsimem.report()
+
+        QgsMessageLog.logMessage("In-memory rasters: {0} buffers of {1} layers, {2:.1f} MB of {3:.1f} MB budget, "
+                                 "{4} spilled to disk".format(report["buffers"], report["layers"],
+                                                              report["bytes"] / (1024.0 * 1024.0),
+                                                              report["budget"] / (1024.0 * 1024.0),
+                                                              report["spilled"]),
+                                 "agknow", Qgis.Info)
+
+    def init_group_layers(self, parcel_id, product_id, lazy=False):
+        """
+         Initializes the group layer structure of agknow for the given parcel ID and product.
+
+        :param parcel_id: parcel's ID (integer)
+        :param product_id: product id: visible, vitality, variations, etc. (string)
+        :param lazy: only record the groups; they are created when the parcel is selected or gets images (boolean)
+        """
+        if product_id in [u"visible", u"vitality", u"variations"]:
+            data_sources = [u"landsat8", u"sentinel2"]
+        else:
+            data_sources = [u"sentinel2"]
+
+        if lazy:
+            self.toc.add_placeholder(parcel_id, product_id, data_sources)
+            return
+
+        # create or get parcel_group
+        self.init_base_layers(parcel_id)
+
+        # add subgroups per product and data source
+        if self.toc.product_group(parcel_id, product_id) is None:
+            for ds in data_sources:
+                self.toc.data_source_group(parcel_id, product_id, ds, create=True)
 
     def init_base_layers(self, parcel_id):
         """
@@ -1178,19 +1504,9 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         :return parcel_group: group layer of the parcel's ID (QgsLayerTreeGroup)
          
         """
-        # root node
-        root = QgsProject.instance().layerTreeRoot()
-
         # parcels and images are loaded at init of agknow plugin, so they must be present
-        images_group = root.findGroup(u"images")
-
         # add new parcel group to images_group if not present
-        parcel_group = images_group.findGroup("parcel id: {0}".format(parcel_id))
-
-        if parcel_group is None:
-            parcel_group = images_group.addGroup("parcel id: {0}".format(parcel_id))
-
-        return parcel_group
+        return self.toc.parcel_group(parcel_id, create=True)
 
     def set_map_to_center(self, x, y):
         """
@@ -1272,174 +1588,252 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
     # Region asynchronous
     #
-    def startWorker(self, _runMethod, _finishedEvtMethod, _errorEvtMethod=None, **kwargs):
+    def startWorker(self, _runMethod, _finishedEvtMethod, _errorEvtMethod=None, _partialEvtMethod=None,
+                    _priority=None, _dependencies=None, _tag=None, **kwargs):
         """
         Generic worker starter.
-        Pass the processing function for the thread and the method for the \n
-        finished event as strings.
+        Pass the processing function for the task and the method for the \n
+        finished event as strings. The worker runs as a QgsTask in the task manager of QGIS, so several workers
+        may run at the same time.
 
         :param _runMethod: name of method to call in the worker class
         :param _finishedEvtMethod: name of method of the caller class, that will be called when the task is finished.
         :param _errorEvtMethod: optional name of method of the caller class, that will be called when the task has an error.
+        :param _partialEvtMethod: optional name of method of the caller class, that will be called for intermediate results.
+        :param _priority: optional priority of the task (integer); defaults to the priority of the run method
+        :param _dependencies: optional tasks which have to be finished before the task starts (list of WorkerTask)
+        :param _tag: optional tag of the task (e.g. the raster group id of the selected parcel) for cancelling
+                     obsolete tasks
         :param kwargs: Keyword arguments
+
+        :return: task of the worker (WorkerTask)
         """
         worker = Worker(**kwargs)
-        thread = QThread()
-        worker.moveToThread(thread)
-        # getattr() can call functions via string
 
-        worker.progress.connect(self.progress.setValue)
+        # getattr() can call functions via string
         worker.status.connect(self.iface.mainWindow().statusBar().showMessage)
         worker.finished.connect(getattr(self, _finishedEvtMethod))
 
         if _errorEvtMethod is not None:
             worker.error.connect(getattr(self, _errorEvtMethod))
 
-        thread.started.connect(getattr(worker, _runMethod))
-        # self.worker.set_data(**kwargs)
-        thread.start()
+        if _partialEvtMethod is not None:
+            worker.partial.connect(getattr(self, _partialEvtMethod))
 
-        # hold a reference in the class instance so the the objects are not being garbage collected too early
-        self.thread = thread
-        self.worker = worker
+        worker.cancelled.connect(self.worker_cancelled)
 
+        # the task manager holds a reference to the task (and its worker) until it is done
+        return self.tasks.submit("agknow: {0}".format(_runMethod.replace("_", " ")), worker, _runMethod,
+                                 priority=_priority, dependencies=_dependencies, tag=_tag)
 
     def cleanup_threading(self):
         """
-         Cleans up all thread/worker issues after the work is done.
+         Cleans up all thread/worker issues after the work is done; does not wait for any thread.
         """
 
         print("cleanup_threading()")
-        # clean up the worker and thread
-        # clean up the worker and thread uncessary? thread was already garbage collected
-        #self.worker.deleteLater()
-        self.thread.quit()
-        self.thread.wait()
-        self.thread.deleteLater()
-        # self.thread = self.worker = None
 
-    def handle_connect_result(self, result):
+        self.tasks.cleanup()
+
+    def worker_cancelled(self):
         """
-         Handles the further processing of the result object of an asynchronous worker.
-         May start another async worker process.
+         Event handler for the cancelled event of all workers.
+        """
+        print("worker_cancelled()")
+
+        self.cleanup_threading()
+
+        # background jobs do not touch the GUI
+        task = getattr(self.sender(), "task", None)
+        if task is not None and task.background:
+            return
+
+        # a cancelled download is not refreshed afterwards
+        if task is not None and task.tag is not None and task.tag == self.pending_refresh:
+            self.pending_refresh = None
 
-        :param result: result of a call to the agknow API. (dictionary)
+        # restore the GUI if no other job is running (e.g. the job has been cancelled in the task manager of QGIS)
+        if self.tasks.foreground_count() == 0:
+            self.iface.messageBar().clearWidgets()
+            self.deactivate_connecting_state()
+
+    def update_progress(self, value):
+        """
+         Shows the aggregated progress of all running tasks in the progress bar.
+
+        :param value: progress in percent (integer)
+        """
+        try:
+            if getattr(self, "progress", None) is not None:
+                self.progress.setValue(value)
+
+        except RuntimeError:
+            # progress bar has been removed from the message bar
+            self.progress = None
+
+    def handle_connect_result(self, result, first_page=True):
+        """
+         Handles the further processing of a page of the parcel list of the get_parcel_pages worker.
+
+        :param result: result of a call to the agknow API (dictionary); in all-at-once mode with the key "details"
+                       (list of added parcel ids and list of parcel ids and names)
+        :param first_page: result is the first page of the parcel list (boolean)
         """
         print("handle_connect_result() - {0}".format(self.settings["parcel_download_mode"]))
 
+        # disconnect the event listener temporary
+        self.cbResultsIDName.currentIndexChanged.disconnect(self.cbResultsIDName_currentIndexChanged)
+
         if self.settings["parcel_download_mode"] == "one-by-one":
 
             # fill combobox only with the parcel name and id
-            # this will also trigger the cbResultsIDName_currentIndexChanged event
-            # in which the download of the images happen if "download image" is active
-            # and data is not already existent
-            # disconnect the event listener temporary
-            self.cbResultsIDName.currentIndexChanged.disconnect(self.cbResultsIDName_currentIndexChanged)
-
             for item in result["content"]:
                 self.cbResultsIDName.addItem(u"{0} - {1}".format(item["parcel_id"], item["name"]))
 
-            # connect the event listener again
-            self.cbResultsIDName.currentIndexChanged.connect(self.cbResultsIDName_currentIndexChanged)
+        else:  # the worker has already added the details of the parcels of this page to the parcel layer
 
-            self.iface.messageBar().clearWidgets()
-            self.iface.messageBar().pushMessage("Success", "Successfully downloaded base parcel data!",
-                                                level=Qgis.Success, duration=1)
+            parcel_ids, parcel_ids_names = result.get("details", ([], []))
 
-            QgsMessageLog.logMessage("Successfully downloaded base parcel data.", "agknow",
-                                     Qgis.Info)
+            self.parcel_ids.extend(parcel_ids)
+
+            for item in list(parcel_ids_names):
+                self.cbResultsIDName.addItem(item)
+
+            self.parcelLyr.triggerRepaint()
+
+        # connect the event listener again
+        self.cbResultsIDName.currentIndexChanged.connect(self.cbResultsIDName_currentIndexChanged)
+
+        if self.settings["parcel_download_mode"] == "one-by-one":
+
+            if first_page:
+                self.iface.messageBar().clearWidgets()
+                self.iface.messageBar().pushMessage("Success", "Successfully downloaded base parcel data!",
+                                                    level=Qgis.Success, duration=1)
+
+                QgsMessageLog.logMessage("Successfully downloaded base parcel data.", "agknow",
+                                         Qgis.Info)
 
-            self.btnRefresh.setEnabled(True)
+                self.btnRefresh.setEnabled(True)
 
             if self.parcel_id_to_set is not None:
                 # trigger the change event manually now to download the detail data and images per parcel
                 # calls self.cbResultsIDName_currentIndexChanged() through selecting the given parcel_id
+                # (the parcel may also be on one of the next pages)
                 self.set_current_parcel(self.parcel_id_to_set)
-            else:
+
+            elif first_page:
                 # trigger the change event manually now to download the detail data and images per parcel
                 self.cbResultsIDName_currentIndexChanged()
 
-        else:  # download all details of the parcels and populate the combobox afterwards
-
-            api_key = self.tbAPIKey.text()
-            host_url = self.tbHostURL.text()
-            
-
-            base_url = host_url + self.api_version
-            params = "/parcels/?key=" + api_key
-
-            self.init_progressBar()
-
+        elif first_page:
             self.iface.messageBar().pushMessage("Info", "Loading all parcel detail data at once may take a while..",
                                                 level=Qgis.Info, duration=1)
 
             QgsMessageLog.logMessage("Loading all parcel detail data at once may take a while..", "agknow",
                                      Qgis.Info)
 
-            parcel_ids = []
-            for item in result["content"]:
-                parcel_ids.append(item["parcel_id"])
+            self.set_map_to_extent(self.parcelLyr.extent())
+
+    def check_parcel_base_data(self, result):
+        """
+         Checks the first page of the parcel list for an unauthorized API key or an empty parcel list and updates
+         the connection state of the GUI.
+
+        :param result: result of a call to the agknow API (dictionary)
 
-            # async with worker
-            kwargs = {"base_url": base_url, "ssl_verify": False, "parcel_ids": parcel_ids,
-                      "api_key": api_key, "parcelLyr": self.parcelLyr, "project_epsg": self.get_current_project_epsg(),
-                      "api_version": self.api_version}
+        :return: True if there are parcels to process (boolean)
+        """
+        # check for correct api key
+        if result["content"] == "key is not authorized":
+            self.iface.messageBar().clearWidgets()
+            self.iface.messageBar().pushMessage('API key is not authorized!',
+                                                level=Qgis.Critical,
+                                                duration=3)
+            QgsMessageLog.logMessage('API key is not authorized!', "agknow",
+                                     Qgis.Critical)
+            self.deactivate_connecting_state()
+            self.settings["connected"] = False
+            self.show_disconnected_state()
+
+            return False
+        # maybe API KEY is valid, but has no parcels
+        elif len(result["content"]) == 0:
+            self.iface.messageBar().clearWidgets()
+            self.iface.messageBar().pushMessage("Warning", "No parcels found for this API Key!",
+                                                level=Qgis.Warning, duration=2)
+            QgsMessageLog.logMessage("No parcels found for this API Key!", "agknow",
+                                     Qgis.Warning)
+            # no parcels to show - but we may register new ones!
+            self.deactivate_connecting_state()
+            self.settings["connected"] = True
+            self.grBoxLayerSettings.setEnabled(self.settings["connected"])
 
-            self.startWorker(_runMethod="get_parcels_detail_data",
-                             _finishedEvtMethod="get_parcels_detail_data_finished",
-                             _errorEvtMethod="get_parcels_detail_data_error",
-                             **kwargs)
+            return False
+        else:
+            self.settings["connected"] = True
+            self.show_connected_state()
+
+            return True
+
+    @pyqtSlot(object)
+    def get_parcel_page(self, ret):
+        """
+         Event handler for the partial event of the get_parcel_pages worker (one page of the parcel list).
+
+        :param ret: result of a call to the agknow API (dictionary)
+        """
+        print("get_parcel_page()")
+
+        self.parcel_pages_received += 1
+
+        if self.parcel_pages_received == 1:
+            # stop processing of the following pages if the first one is not valid
+            self.parcel_list_valid = self.check_parcel_base_data(ret)
+
+            if self.parcel_list_valid:
+                # process the result
+                self.handle_connect_result(ret, first_page=True)
+
+        elif self.parcel_list_valid and len(ret["content"]) > 0:
+            self.handle_connect_result(ret, first_page=False)
 
     # slot with return type
     @pyqtSlot(object)
-    def get_parcel_base_data_finished(self, ret):
+    def get_parcel_pages_finished(self, ret):
         """
-         Event handler for the finished event of the get_parcel_base_data worker.
+         Event handler for the finished event of the get_parcel_pages worker.
 
-        :param ret: result of a call to the agknow API (JSON string)
+        :param ret: {"count": number of parcels} or None on error
         """
-        print("get_parcel_base_data_finished()")
+        print("get_parcel_pages_finished()")
 
         # important! cleanup first before starting another thread
         self.cleanup_threading()
 
         if ret is not None:
 
-            result = json.loads(ret)
-            print(result)
-            # check for correct api key
-            if result["content"] == "key is not authorized":
-                self.iface.messageBar().clearWidgets()
-                self.iface.messageBar().pushMessage('API key is not authorized!',
-                                                    level=Qgis.Critical,
-                                                    duration=3)
-                QgsMessageLog.logMessage('API key is not authorized!', "agknow",
-                                         Qgis.Critical)
-                self.deactivate_connecting_state()
-                self.settings["connected"] = False
-                self.show_disconnected_state()
-
+            if self.parcel_pages_received == 0 or not self.parcel_list_valid:
                 return
-            # maybe API KEY is valid, but has no parcels
-            elif len(result["content"]) == 0:
-                self.iface.messageBar().clearWidgets()
-                self.iface.messageBar().pushMessage("Warning", "No parcels found for this API Key!",
-                                                    level=Qgis.Warning, duration=2)
-                QgsMessageLog.logMessage("No parcels found for this API Key!", "agknow",
-                                         Qgis.Warning)
-                # no parcels to show - but we may register new ones!
-                self.deactivate_connecting_state()
-                self.settings["connected"] = True
-                self.grBoxLayerSettings.setEnabled(self.settings["connected"])
 
-                return
-            else:
-                self.settings["connected"] = True
-                self.show_connected_state()
+            QgsMessageLog.logMessage("Successfully downloaded {0} parcels.".format(ret["count"]), "agknow",
+                                     Qgis.Info)
 
-                # process the result
-                # maybe sync or async
-                self.handle_connect_result(result)
+            if self.settings["parcel_download_mode"] == "all-at-once":
+
+                self.set_map_to_extent(self.parcelLyr.extent())
+
+                # maybe no detail data could be fetched
+                if len(self.parcel_ids) == 0:
+                    self.deactivate_connecting_state()
+                    self.iface.messageBar().pushMessage("Warning", "No parcels found for this API Key!",
+                                                        level=Qgis.Warning, duration=2)
+                    return
+
+                self.parcels_detail_data_loaded()
+
+            else:
+                self.iface.messageBar().clearWidgets()
 
         else:
             # notify the user that something went wrong
@@ -1448,12 +1842,15 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                                                 level=Qgis.Critical,
                                                 duration=3)
 
-            QgsMessageLog.logMessage("get_parcel_base_data_finished(): return of async was None!", "agknow",
+            QgsMessageLog.logMessage("get_parcel_pages_finished(): return of async was None!", "agknow",
                                      Qgis.Critical)
 
             self.deactivate_connecting_state()
-            self.settings["connected"] = False
-            self.show_disconnected_state()
+
+            # keep the connection if some pages have been loaded already
+            if self.parcel_pages_received == 0:
+                self.settings["connected"] = False
+                self.show_disconnected_state()
 
     def show_connected_state(self):
         """
@@ -1531,205 +1928,209 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.deactivate_connecting_state()
 
 
-    # slot with return type
-    @pyqtSlot(object)
-    def get_parcels_detail_data_finished(self, ret):
+    def parcels_detail_data_loaded(self):
         """
-         Event handler for the finished event of the get_parcels_detail_data worker.
-
-        :param ret: result of a call to the agknow API (JSON string)
+         Continues after the detail data of all parcels has been loaded in all-at-once mode: initializes the group
+         layers and starts the download of the images if necessary.
         """
-        print("get_parcels_detail_data_finished()")
+        # init group layers; in the lazy TOC mode they are created when a parcel is selected or gets images
+        for p in self.parcel_ids:
+            self.init_group_layers(p, self.product, lazy=self.settings["lazy_toc"])
 
-        # important! cleanup first before starting another thread
-        self.cleanup_threading()
+        # toggle parcels in toc except first
+        self.toggle_parcels_toc(self.parcel_ids[0])
 
-        if ret is not None:
+        self.iface.messageBar().pushMessage("Success", "Successfully downloaded parcels detail data!",
+                                            level=Qgis.Success, duration=1)
 
-            self.set_map_to_extent(self.parcelLyr.extent())
+        QgsMessageLog.logMessage("Successfully downloaded parcels detail data.", "agknow", Qgis.Info)
 
-            self.parcel_ids, parcel_ids_names = ret
+        try:
+            if self.chkBoxDownloadImg.isChecked():
+                QgsMessageLog.logMessage("Downloading all parcel images..", "agknow", Qgis.Info)
 
-            # maybe API KEY is valid, but has no parcels
-            if len(self.parcel_ids) == 0:
-                self.deactivate_connecting_state()
-                self.iface.messageBar().pushMessage("Warning", "No parcels found for this API Key!",
-                                                    level=Qgis.Warning, duration=2)
-                return
+                api_key = self.tbAPIKey.text()
+                host_url = self.tbHostURL.text()
+                
+                base_url = host_url + self.api_version
 
-            # IMPORTANT - deactivate the changed event for filling the combobox
-            # because otherwise there are interfering threads (currentIndexChanged Event will also
-            # call update_parcel_images(), but we call it here explicitely
+                # should be 1 thread per Core at least to download the data in parallel
+                # but for the first draw just put all the work into another thread
+                # calls async worker!
+                self.update_parcel_images(api_key, base_url, self.parcel_ids)
 
-            # disconnect the event listener temporary
-            self.cbResultsIDName.currentIndexChanged.disconnect(self.cbResultsIDName_currentIndexChanged)
+            else:
+                if self.parcel_id_to_set is not None:
+                    # trigger the change event manually now to download the detail data and images per parcel
+                    # calls self.cbResultsIDName_currentIndexChanged() through selecting the given parcel_id
+                    self.set_current_parcel(self.parcel_id_to_set)
+                else:
+                    # zoom to first parcel
+                    self.zoom_to_parcel(self.get_current_parcel_id())
 
-            for item in list(parcel_ids_names):
-                self.cbResultsIDName.addItem(item)
+                self.deactivate_connecting_state()
 
-            # connect the event listener again
-            self.cbResultsIDName.currentIndexChanged.connect(self.cbResultsIDName_currentIndexChanged)
+        except Exception as e:
+            self.iface.messageBar().pushMessage('Something went wrong! See the message log for more information.',
+                                                level=Qgis.Critical,
+                                                duration=3)
 
-            # init group layers
-            for p in self.parcel_ids:
-                self.init_group_layers(p, self.product)
+            QgsMessageLog.logMessage("Error downloading all parcel images..", "agknow", Qgis.Warning)
 
-            # toggle parcels in toc except first
-            self.toggle_parcels_toc(self.parcel_ids[0])
+            QgsMessageLog.logMessage("parcels_detail_data_loaded(): {0}".format(e), "agknow",
+                                     Qgis.Warning)
 
-            self.iface.messageBar().pushMessage("Success", "Successfully downloaded parcels detail data!",
-                                                level=Qgis.Success, duration=1)
+            self.deactivate_connecting_state()
 
-            QgsMessageLog.logMessage("Successfully downloaded parcels detail data.", "agknow", Qgis.Info)
+    @pyqtSlot(object)
+    def get_images_partial(self, ret):
+        """
+         Event handler for the partial event of the get_images worker. Adds the rasters of a parcel to the TOC
+         as soon as the worker has processed them.
 
-            try:
-                if self.chkBoxDownloadImg.isChecked():
-                    QgsMessageLog.logMessage("Downloading all parcel images..", "agknow", Qgis.Info)
+        :param ret: dict {raster_group_id, raster list }
+        """
+        print("get_images_partial()")
 
-                    api_key = self.tbAPIKey.text()
-                    host_url = self.tbHostURL.text()
-                    
-                    base_url = host_url + self.api_version
+        if ret is not None:
+            self.add_images(ret)
 
-                    # should be 1 thread per Core at least to download the data in parallel
-                    # but for the first draw just put all the work into another thread
-                    # calls async worker!
-                    self.update_parcel_images(api_key, base_url, self.parcel_ids)
+    @pyqtSlot(object)
+    def get_images_finished(self, ret):
+        """
+         Event handler for the finished event of the get_images worker.
 
-                else:
-                    if self.parcel_id_to_set is not None:
-                        # trigger the change event manually now to download the detail data and images per parcel
-                        # calls self.cbResultsIDName_currentIndexChanged() through selecting the given parcel_id
-                        self.set_current_parcel(self.parcel_id_to_set)
-                    else:
-                        # zoom to first parcel
-                        self.zoom_to_parcel(self.get_current_parcel_id())
+        :param ret: dict {raster_group_id, raster list } of rasters which have not been delivered
+                    with the partial event yet
+        """
+        print("get_images_finished()")
 
-                    self.deactivate_connecting_state()
+        # important! cleanup first before starting another thread
+        self.cleanup_threading()
 
-            except Exception as e:
-                self.iface.messageBar().pushMessage('Something went wrong! See the message log for more information.',
-                                                    level=Qgis.Critical,
-                                                    duration=3)
+        if ret is not None:
 
-                QgsMessageLog.logMessage("Error downloading all parcel images..", "agknow", Qgis.Warning)
+            self.add_images(ret)
 
-                QgsMessageLog.logMessage("get_parcels_detail_data_finished(): {0}".format(e), "agknow",
-                                         Qgis.Warning)
+            if self.parcel_id_to_set is not None:
+                # trigger the change event manually now to download the detail data and images per parcel
+                # calls self.cbResultsIDName_currentIndexChanged() through selecting the given parcel_id
+                self.set_current_parcel(self.parcel_id_to_set)
 
-                self.deactivate_connecting_state()
+            # zoom to first parcel
+            print("get_images_finished() - zooming to parcel..")
+            self.zoom_to_parcel(self.get_current_parcel_id())
 
-        else:
-            # notify the user that something went wrong
-            self.iface.messageBar().pushMessage('Something went wrong! See the message log for more information.',
-                                                level=Qgis.Critical,
-                                                duration=3)
+            self.deactivate_connecting_state()
 
-            QgsMessageLog.logMessage("get_parcels_detail_data_finished(): return of async was None!", "agknow",
+        else:
+            QgsMessageLog.logMessage("get_images_finished(): return of async was None!", "agknow",
                                      Qgis.Critical)
 
-            self.deactivate_connecting_state()
+        self.deactivate_connecting_state()
+        self.btnRefresh.setEnabled(self.settings["connected"])
+        self.grBoxLayerSettings.setEnabled(self.settings["connected"])
 
+        self.start_pending_refresh(getattr(self.sender(), "task", None))
 
-    # slot with return type
-    @pyqtSlot(str)
-    def get_parcels_detail_data_error(self, ret):
+    def start_pending_refresh(self, finished_task=None):
         """
-         Event handler for the error event of the get_parcels_detail_data worker.
+         Starts the refresh of the selected parcel's images which has been requested while they were downloaded
+         (see update_parcel_images()).
 
-        :param ret: traceback of the error (string)
+        :param finished_task: WorkerTask whose job has just finished; it is not done yet while its signals are
+                              handled
         """
-        print("get_parcels_detail_data_error()")
+        tag = self.pending_refresh
 
-        # important! cleanup first before starting another thread
-        self.cleanup_threading()
+        if tag is None:
+            return
 
-        if ret is not None:
+        if any(t is not finished_task for t in self.tasks.running("get_images", tag=tag)):
+            return
 
-            # notify the user that something went wrong
-            self.iface.messageBar().pushMessage('Something went wrong! See the message log for more information.',
-                                                level=Qgis.Critical,
-                                                duration=3)
+        self.pending_refresh = None
 
-            QgsMessageLog.logMessage("get_parcels_detail_data_error(): {0}".format(ret), "agknow",
-                                     Qgis.Warning)
-        else:
-            QgsMessageLog.logMessage("get_parcels_detail_data_error(): return of async was None!", "agknow",
-                                     Qgis.Critical)
+        parcel_id = self.get_current_parcel_id()
 
-        self.deactivate_connecting_state()
+        # the selection has changed in the meantime
+        if tag != "{0}_{1}_{2}_{3}".format(parcel_id, self.product, self.data_source, self.settings["image_format"]):
+            return
 
+        # like refresh_data()
+        base_url = self.tbHostURL.text() + self.api_version
 
-    @pyqtSlot(object)
-    def get_images_finished(self, ret):
-        """
-         Event handler for the finished event of the get_images worker.
+        self.update_parcel_images(self.tbAPIKey.text(), base_url, [parcel_id], selected=True, refresh=True,
+                                  finished_task=finished_task)
 
-        :param ret: dict {raster_group_id, raster list }
+    def add_images(self, ret):
         """
-        print("get_images_finished()")
+         Adds the given rasters of the get_images worker to the TOC and to self.rasters. In single layer mode the
+         rasters get no layers; the timeslider shows them in its playback layer.
 
-        # important! cleanup first before starting another thread
-        self.cleanup_threading()
+         Rasters without "mmap_name" are loaded already (incremental refresh) and are kept; the loaded rasters which
+         are not in the raster list anymore are removed from the TOC.
 
-        if ret is not None:
-
-            for raster_group_id in ret.keys():
+        :param ret: dict {raster_group_id, raster list }
+        """
+        for raster_group_id in ret.keys():
 
-                QgsMessageLog.logMessage("raster_group_id: {0}".format(raster_group_id), "agknow",
-                                         Qgis.Info)
+            QgsMessageLog.logMessage("raster_group_id: {0}".format(raster_group_id), "agknow",
+                                     Qgis.Info)
 
-                rasters = ret[raster_group_id] # dict {raster_group_id: rasters}
+            rasters = ret[raster_group_id] # dict {raster_group_id: rasters}
 
-                QgsMessageLog.logMessage("Successfully downloaded images!", "agknow", Qgis.Info)
+            QgsMessageLog.logMessage("Successfully downloaded images!", "agknow", Qgis.Info)
 
-                self.rasters[raster_group_id] = rasters
+            # {raster_id: raster} of the rasters which are loaded already
+            loaded = {r["raster_id"]: r for r in self.rasters.get(raster_group_id, [])}
 
-                # add all rasters to the GUI
-                new_rasters = []
-                for r in rasters:
-                    try:
-                        # with date and raster ID as layername
-                        lyr_name = "{0}|{1}|{2}|{3}".format(r["product"], r["date"], r["raster_id"], r["source"])
+            raster_ids = set(r["raster_id"] for r in rasters)
+            self.remove_images_toc([r for raster_id, r in loaded.items() if raster_id not in raster_ids])
 
+            # add all rasters to the GUI
+            new_rasters = []
+            for r in rasters:
+                if "mmap_name" not in r:
+                    if r["raster_id"] in loaded:
+                        new_rasters.append(loaded[r["raster_id"]])
+                    continue
+
+                try:
+                    # with date and raster ID as layername
+                    lyr_name = "{0}|{1}|{2}|{3}".format(r["product"], r["date"], r["raster_id"], r["source"])
+
+                    if self.settings["single_layer"]:
+                        file_path = self.keep_image(r["mmap_name"], lyr_name, r["parcel_id"], r["product"],
+                                                    r["source"])
+                    else:
                         file_path = self.add_image_toc(r["mmap_name"], lyr_name, r["parcel_id"],
                                            r["product"], r["source"])
 
-                        # update raster dictionary's path
-                        r["mmap_name"] = file_path
-                        new_rasters.append(r)
+                    # update raster dictionary's path
+                    r["mmap_name"] = file_path
+                    new_rasters.append(r)
 
-                    except Exception as e:
-                        QgsMessageLog.logMessage("get_images_finished(): Error adding image to TOC", "agknow",
-                                                 Qgis.Warning)
-                        QgsMessageLog.logMessage("{0}".format(e), "agknow",
-                                                 Qgis.Warning)
+                except Exception as e:
+                    QgsMessageLog.logMessage("add_images(): Error adding image to TOC", "agknow",
+                                             Qgis.Warning)
+                    QgsMessageLog.logMessage("{0}".format(e), "agknow",
+                                             Qgis.Warning)
 
-                # save updated rasters
-                rasters = new_rasters
-                self.rasters[raster_group_id] = rasters
+                    # the raster has no layer which could release it
+                    self.vsimem.release(r["mmap_name"])
 
-                # notify change on slot
-                self.imagesReloaded.emit(rasters)
+            # save updated rasters
+            rasters = new_rasters
+            self.rasters[raster_group_id] = rasters
 
-            if self.parcel_id_to_set is not None:
-                # trigger the change event manually now to download the detail data and images per parcel
-                # calls self.cbResultsIDName_currentIndexChanged() through selecting the given parcel_id
-                self.set_current_parcel(self.parcel_id_to_set)
+            # notify change on slot
+            self.imagesReloaded.emit(rasters)
 
-            # zoom to first parcel
-            print("get_images_finished() - zooming to parcel..")
-            self.zoom_to_parcel(self.get_current_parcel_id())
-
-            self.deactivate_connecting_state()
-
-        else:
-            QgsMessageLog.logMessage("get_images_finished(): return of async was None!", "agknow",
-                                     Qgis.Critical)
+        if self.vsimem.over_budget():
+            self.spill_images()
 
-        self.deactivate_connecting_state()
-        self.btnRefresh.setEnabled(self.settings["connected"])
-        self.grBoxLayerSettings.setEnabled(self.settings["connected"])
+        self.log_memory_report()
 
     @pyqtSlot(str)
     def get_images_error(self, ret):
@@ -1759,6 +2160,8 @@ class AgknowDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.btnRefresh.setEnabled(self.settings["connected"])
         self.grBoxLayerSettings.setEnabled(self.settings["connected"])
 
+        self.start_pending_refresh(getattr(self.sender(), "task", None))
+
     @pyqtSlot(object)
     def register_feature_finished(self, ret):
         """
@@ -31,7 +31,11 @@ from qgis.PyQt.QtGui import QIcon
 
 import qgis.utils
 
-from qgis.core import QgsProject, QgsMessageLog, Qgis
+from qgis.core import QgsProject, QgsMessageLog, Qgis, QgsRasterLayer, QgsDataProvider
+
+from . import agknow_vsimem
+from . import agknow_toc
+from .agknow_playback import FramePrefetcher, FrameCache, FrameOverlay, DEFAULT_FPS
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'agknow_qgis_dockwidget_timeslider.ui'))
@@ -83,8 +87,27 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
         self.timer = QBasicTimer()
         self.step = 0
 
+        # playback with one layer per data source group whose data source is swapped per frame; the dates have no
+        # layers of their own then (see AgknowDockWidget.add_images()). If False the date layers of the group are
+        # toggled
+        self.single_layer = True
+        self.prefetcher = FramePrefetcher()
+        # {(parcel_id, product_id, data_source): layer id}
+        self.playback_layers = {}
+        # {frame index: (QgsRasterLayer, memory map string or path)} of the animation in single layer mode; the
+        # layers are not added to the project
+        self.animation_layers = {}
+        self.vsimem = agknow_vsimem.get_registry()
+        self.toc = agknow_toc.get_index()
+
         self.iface = qgis.utils.iface
 
+        # animation with pre-rendered frames; if False every step re-renders the map canvas
+        self.animate = True
+        self.fps = DEFAULT_FPS
+        self.frame_cache = FrameCache(self.iface.mapCanvas())
+        self.overlay = None
+
     def set_data_source(self, data_source):
         """
          Setter for the data_source (landsat-8 or sentinel-2).
@@ -115,15 +138,153 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
         """
         print("timerEvent()")
 
-        if self.step == self.sliderTime.maximum():
+        if self.step == self.sliderTime.maximum() or self.sliderTime.value() == self.sliderTime.maximum():
             self.timer.stop()
             self.step = 0  #reset step
+            self.stop_animation()
             return
+
+        elif self.frame_cache.active:
+            idx = self.sliderTime.value() + 1
+
+            frame = self.frame_cache.frame(idx)
+
+            if frame is not None:
+                self.overlay.set_frame(*frame)
+
+            # wait until the frame has been rendered; a date without image is skipped (the previous frame stays)
+            elif not self.frame_cache.is_missing(idx):
+                return
+
+            self.frame_cache.seek(idx)
+
+            # just move the slider; the layers are updated when the animation stops
+            self.sliderTime.blockSignals(True)
+            self.sliderTime.setValue(idx)
+            self.sliderTime.blockSignals(False)
+
+            self.step = self.step + 1
+
         else:
             self.step = self.step + 1
 
             self.sliderTime.setValue(self.sliderTime.value()+1)
 
+    def start_animation(self):
+        """
+         Starts rendering the frames of all dates for the current extent of the map canvas in the background.
+        """
+        if self.overlay is None:
+            self.overlay = FrameOverlay(self.iface.mapCanvas())
+
+        self.frame_cache.start(len(self.rasters), self.frame_layers, self.sliderTime.value())
+
+    def stop_animation(self):
+        """
+         Stops the animation and shows the layers of the current slider position on the map canvas again.
+        """
+        if not self.frame_cache.active:
+            return
+
+        self.frame_cache.stop()
+        self.overlay.clear()
+
+        self.release_animation_layers()
+
+        self.sliderValue_changed()
+
+    def frame_layers(self, idx):
+        """
+         Returns the layers of the map canvas with the date layer of the given index instead of the image layers
+         of its data source group. In single layer mode the date has no layer in the TOC; a layer which is not added
+         to the project is used instead (see animation_layer()).
+
+        :param idx: index of the raster in self.rasters (integer)
+
+        :return: list of QgsMapLayer; empty if the date layer is not in the TOC
+        """
+        raster = self.rasters[idx]
+
+        data_source_group = self.find_data_source_group(raster["parcel_id"], self.product + " ", raster["source"])
+
+        if data_source_group is None:
+            return []
+
+        if self.single_layer:
+            frame_lyr = self.animation_layer(idx, data_source_group)
+
+            if frame_lyr is None:
+                return []
+
+        else:
+            lyr_name = "{0}|{1}|{2}|{3}".format(self.product, raster["date"], raster["raster_id"], raster["source"])
+
+            node = self.toc.find_layer(raster["parcel_id"], self.product, raster["source"], lyr_name)
+
+            if node is None:
+                return []
+
+            frame_lyr = node.layer()
+
+        group_layer_ids = data_source_group.findLayerIds()
+
+        layers = []
+        for lyr in self.iface.mapCanvas().layers():
+            if lyr.id() not in group_layer_ids:
+                layers.append(lyr)
+
+            elif frame_lyr not in layers:
+                layers.append(frame_lyr)
+
+        if frame_lyr not in layers:
+            layers.insert(0, frame_lyr)
+
+        return layers
+
+    def animation_layer(self, idx, data_source_group):
+        """
+         Returns the layer of the raster of the given index for rendering its frame in single layer mode. The layer
+         is not added to the project and gets the style of the playback layer; it keeps its in-memory raster alive
+         until the animation stops.
+
+        :param idx: index of the raster in self.rasters (integer)
+        :param data_source_group: data source group of the raster (QgsLayerTreeGroup)
+
+        :return: QgsRasterLayer or None if the raster cannot be read
+        """
+        if idx in self.animation_layers:
+            return self.animation_layers[idx][0]
+
+        raster = self.rasters[idx]
+        source = raster["mmap_name"]
+
+        lyr = QgsRasterLayer(source, "timeslider: {0}".format(raster["date"]))
+
+        if not lyr.isValid():
+            return None
+
+        playback_lyr = self.get_playback_layer(data_source_group, raster["parcel_id"], self.product + " ",
+                                               raster["source"])
+
+        if playback_lyr is not None:
+            lyr.setRenderer(playback_lyr.renderer().clone())
+
+        # the raster may be moved to disk while the frame is rendered
+        self.vsimem.acquire(source)
+
+        self.animation_layers[idx] = (lyr, source)
+
+        return lyr
+
+    def release_animation_layers(self):
+        """
+         Drops the layers of the animation (see animation_layer()) and releases their in-memory rasters.
+        """
+        for lyr, source in self.animation_layers.values():
+            self.vsimem.release(source)
+
+        self.animation_layers = {}
+
 
     def rdBtnProductState_toggled(self, btn):
         """
@@ -144,15 +305,10 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
 
             if len(self.rasters) > 0:
 
-                # find subgroup
-                root = QgsProject.instance().layerTreeRoot()
-                parcel_group = root.findGroup("parcel id: {0}".format(parcel_id))
-
                 # select active layer for identity e.g.
                 self.set_layer_active_toc(parcel_id)
 
-                if parcel_group is not None:
-                    self.toggle_products(parcel_group)
+                self.toggle_products(parcel_id)
 
 
     def set_layer_active_toc(self, parcel_id):
@@ -211,7 +367,10 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
 
             #print(activeLyrName)
 
-            self.toggle_image_layer(activeLyrName, data_source, parcel_id, product_id)
+            if self.single_layer:
+                self.show_frame(idx, data_source, parcel_id, product_id)
+            else:
+                self.toggle_image_layer(activeLyrName, data_source, parcel_id, product_id)
 
         else:
             QgsMessageLog.logMessage("AgknowDockWidgetTimeSlider - sliderValue_changed() - rasters are not set!",
@@ -245,61 +404,103 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
                     lyr.setItemVisibilityChecked(Qt.Unchecked)
 
 
-    def find_data_source_group(self, parcel_id, product_id, data_source):
+    def show_frame(self, idx, data_source, parcel_id, product_id):
         """
-         Returns the data source group layer of the TOC for the given parcel id, product and data source.
+         Shows the raster of the given index in the playback layer of the data source group by swapping the
+         layer's data source. Takes the frame decoded by the prefetcher if it is ready and moves the prefetch
+         window to the given index.
 
+        :param idx: index of the raster in self.rasters (integer)
+        :param data_source: landsat-8 or sentinel-2 (string)
         :param parcel_id: parcel's ID (integer)
         :param product_id: product id: visible, vitality, variations, etc. (string)
-        :param data_source: landsat-8 or sentinel-2 (string)
+        """
+        data_source_group = self.find_data_source_group(parcel_id, product_id, data_source)
 
-        :return: data_source_group (QgsLayerTreeGroup)
+        if data_source_group is None:
+            return
+
+        raster = self.rasters[idx]
+
+        # decoded frame or the raster itself if the frame is not ready yet
+        source = self.prefetcher.frame(idx) or raster["mmap_name"]
+        self.prefetcher.request(idx)
+
+        lyr_name = "timeslider: {0}".format(raster["date"])
+
+        lyr = self.get_playback_layer(data_source_group, parcel_id, product_id, data_source)
+
+        if lyr is None:
+            lyr = QgsRasterLayer(source, lyr_name)
+
+            # add to registry without showing up on TOC
+            QgsProject.instance().addMapLayer(lyr, addToLegend=False)
+            data_source_group.insertLayer(0, lyr)
+
+            self.playback_layers[(parcel_id, product_id, data_source)] = lyr.id()
+
+            # only the playback layer is drawn
+            for node in data_source_group.findLayers():
+                if node.layerId() != lyr.id():
+                    node.setItemVisibilityChecked(Qt.Unchecked)
+
+            # select active layer for identity e.g.
+            self.iface.setActiveLayer(lyr)
+
+        else:
+            # keep the renderer (and its contrast stretch) of the previous frame
+            renderer = lyr.renderer().clone()
+            lyr.setDataSource(source, lyr_name, "gdal", QgsDataProvider.ProviderOptions())
+            lyr.setRenderer(renderer)
+            lyr.triggerRepaint()
+
+        # the layer keeps the in-memory raster of the current frame alive
+        if self.vsimem.acquire(source):
+            self.vsimem.bind_layer(lyr.id(), source)
+        else:
+            self.vsimem.release_layer(lyr.id())
+
+    def get_playback_layer(self, data_source_group, parcel_id, product_id, data_source):
         """
-        root = QgsProject.instance().layerTreeRoot()
-        parcel_group = root.findGroup("parcel id: {0}".format(parcel_id))
+         Returns the playback layer of the given data source group or None if it does not exist (anymore).
 
-        if parcel_group is not None:
-            #print("parcel group found")
-            product_group = parcel_group.findGroup(product_id)
-            #print(product_group)
+        :return: QgsRasterLayer
+        """
+        layer_id = self.playback_layers.get((parcel_id, product_id, data_source))
 
-            if product_group is not None:
-                #print("product group found")
-                data_source_group = product_group.findGroup(data_source)
+        if layer_id is None or data_source_group.findLayer(layer_id) is None:
+            return None
 
-                return data_source_group
+        return QgsProject.instance().mapLayer(layer_id)
 
+    def find_data_source_group(self, parcel_id, product_id, data_source):
+        """
+         Returns the data source group layer of the TOC for the given parcel id, product and data source.
 
-    def toggle_products(self, parcel_group):
+        :param parcel_id: parcel's ID (integer)
+        :param product_id: product id: visible, vitality, variations, etc. (string)
+        :param data_source: landsat-8 or sentinel-2 (string)
+
+        :return: data_source_group (QgsLayerTreeGroup)
         """
-         Toggle all other product groups off except the given parcel_group.
+        return self.toc.data_source_group(parcel_id, product_id, data_source)
 
-        :param parcel_group: (QgsLayerTreeGroup)
+
+    def toggle_products(self, parcel_id):
         """
-        data_source_list = ["landsat8", "sentinel2"]
-        matrix = {"landsat8": ["visible", "vitality", "variations"],
-                  "sentinel2": ["visible", "vitality", "variations", "reflectances", "ndvi", "ndre1", "ndre2", "ndre3",
-                                "ndwi", "savi", "evi2", "cire"]
-                  }
+         Toggle all other product groups of the given parcel off except the one of the current product and
+         data source.
 
+        :param parcel_id: parcel's ID (integer)
+        """
         # turn off other data_source groups
-        for ds in data_source_list:
-            #print("checking {0}..".format(ds))
-            for p in matrix[ds]:
-                #print("checking product {0}..".format(p))
-                pg = parcel_group.findGroup(p + " ")
-
-                if pg is not None:
-                    #print("group {0} found!".format(p))
-                    g = pg.findGroup(ds)
-
-                    if g is not None:
-                        if p == self.product and ds == self.data_source:
-                            #print("group {0} visible".format(ds))
-                            g.setItemVisibilityChecked(Qt.Checked)
-                        else:
-                            #print("group {0} invisible!".format(ds))
-                            g.setItemVisibilityChecked(Qt.Unchecked)
+        for p, ds, g in self.toc.data_source_groups(parcel_id):
+            if p == self.product and ds == self.data_source:
+                #print("group {0} visible".format(ds))
+                g.setItemVisibilityChecked(Qt.Checked)
+            else:
+                #print("group {0} invisible!".format(ds))
+                g.setItemVisibilityChecked(Qt.Unchecked)
 
     def toggle_products_data_source_compatibility(self):
         """
@@ -338,18 +539,22 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
          Handles the click event of the Button btnTimePlay.
         """
         self.btnTimePlay.setIcon(QIcon(":/plugins/Agknow/font-awesome_4-7-0_pause_32_0_000000_none.png"))
-        interval = 1000 #ms
+        interval = int(1000 / self.fps) #ms
 
         # stop timer if it is already active
         if self.timer.isActive():
             self.btnTimePlay.setIcon(QIcon(":/plugins/Agknow/font-awesome_4-7-0_play_32_0_000000_none.png"))
             self.timer.stop()
+            self.stop_animation()
             # reset timer
             self.step = 0
             self.sliderTime.setValue(0)
 
         # start timer
         else:
+            if self.animate and len(self.rasters) > 0:
+                self.start_animation()
+
             self.timer.start(interval, self)
 
 
@@ -379,6 +584,11 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
             self.sliderTime.setTickInterval = 1
             self.rasters = rasters
 
+            if self.single_layer:
+                # decode the first frames right away
+                self.prefetcher.set_rasters(rasters)
+                self.prefetcher.request(0)
+
             if len(self.rasters) > 0:
                 #print(self.rasters)
                 parcel_id = self.rasters[0]["parcel_id"]
@@ -389,6 +599,10 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
                 # select first image layer active in toc for identity e.g.
                 self.set_layer_active_toc(parcel_id)
 
+                if self.single_layer:
+                    # the dates have no layers of their own: show the current date in the playback layer
+                    self.sliderValue_changed()
+
         else:
             QgsMessageLog.logMessage("AgknowDockWidgetTimeSlider - rasters is None!", "agknow",
                                      Qgis.Warning)
@@ -399,6 +613,11 @@ class AgknowDockWidgetTimeSlider(QtWidgets.QDockWidget, FORM_CLASS):
          Handles the close event of the class.
         :param event:
         """
+        self.prefetcher.clear()
+
+        self.timer.stop()
+        self.stop_animation()
+
         self.closingPlugin.emit()
         event.accept()
 
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowRasterCache
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import print_function
+
+from builtins import object
+import hashlib
+import json
+import os
+import threading
+import time
+
+# default size cap of the raster cache
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# the index is written to disk after this number of changes (and on flush())
+INDEX_SAVE_INTERVAL = 50
+
+
+class RasterCache(object):
+    """
+     Persistent on-disk cache for the raster images of the agknow API.
+
+     Entries are keyed on (host, api version, parcel id, product, source, raster id, format). The image data is
+     stored content addressed (by its SHA-1 digest) below the objects directory, so identical images are stored
+     only once. An index file keeps the entries with their last access time; if the size cap is exceeded the least
+     recently used entries are evicted.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """
+         Constructor
+
+        :param cache_dir: directory of the cache (string); created if it does not exist
+        :param max_bytes: size cap of the cache in bytes (integer)
+        """
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._changes = 0
+
+        # {entry_id: {"key": [..], "digest": "..", "size": 123, "atime": 1234.5}}
+        self._entries = {}
+        # {digest: size}
+        self._objects = {}
+        # {digest: number of entries referencing the object}
+        self._refs = {}
+
+        self._load_index()
+
+    @staticmethod
+    def make_key(host, api_version, parcel_id, product_id, data_source, raster_id, img_format):
+        """
+         Builds the cache key of a raster.
+
+        :return: key (tuple of strings)
+        """
+        return (str(host), str(api_version), str(parcel_id), str(product_id), str(data_source), str(raster_id),
+                str(img_format))
+
+    def get(self, key):
+        """
+         Returns the cached image data for the given key.
+
+        :param key: cache key of make_key()
+
+        :return: image data (bytes) or None if the raster is not cached
+        """
+        entry_id = self._entry_id(key)
+
+        with self._lock:
+            entry = self._entries.get(entry_id)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            path = self._object_path(entry["digest"])
+
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+
+            except (IOError, OSError):
+                # object has been removed from disk in the meantime
+                self._remove_entry(entry_id)
+                self.misses += 1
+                return None
+
+            entry["atime"] = time.time()
+            self.hits += 1
+            self._changed()
+
+            return data
+
+    def open(self, key):
+        """
+         Opens the cached image data for the given key, so it can be streamed (e.g. into /vsimem) without
+         reading it into memory at once.
+
+        :param key: cache key of make_key()
+
+        :return: binary file object which has to be closed by the caller or None if the raster is not cached
+        """
+        entry_id = self._entry_id(key)
+
+        with self._lock:
+            entry = self._entries.get(entry_id)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            try:
+                f = open(self._object_path(entry["digest"]), "rb")
+
+            except (IOError, OSError):
+                # object has been removed from disk in the meantime
+                self._remove_entry(entry_id)
+                self.misses += 1
+                return None
+
+            entry["atime"] = time.time()
+            self.hits += 1
+            self._changed()
+
+            return f
+
+    def put(self, key, data):
+        """
+         Stores the given image data for the given key and evicts the least recently used entries if the
+         size cap is exceeded.
+
+        :param key: cache key of make_key()
+        :param data: image data (bytes)
+        """
+        if data is None:
+            return
+
+        self.put_stream(key, [data])
+
+    def put_stream(self, key, chunks):
+        """
+         Stores the image data of the given chunks for the given key; see put(). The chunks are written to disk as
+         they come, so the image is never held in memory at once.
+
+        :param key: cache key of make_key()
+        :param chunks: iterable of bytes (e.g. agknow_vsimem.iter_file())
+        """
+        entry_id = self._entry_id(key)
+
+        if not os.path.exists(self.objects_dir):
+            os.makedirs(self.objects_dir, exist_ok=True)
+
+        # write to a temporary file first, so a crash never leaves a truncated object
+        tmp_path = os.path.join(self.objects_dir, "{0}.{1}.tmp".format(entry_id, threading.get_ident()))
+
+        sha1 = hashlib.sha1()
+        size = 0
+
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    sha1.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+        except BaseException:
+            self._remove_file(tmp_path)
+            raise
+
+        digest = sha1.hexdigest()
+
+        with self._lock:
+            if digest not in self._objects:
+                path = self._object_path(digest)
+
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                os.replace(tmp_path, path)
+
+                self._objects[digest] = size
+            else:
+                self._remove_file(tmp_path)
+
+            old_entry = self._entries.get(entry_id)
+
+            self._entries[entry_id] = {"key": list(key), "digest": digest, "size": size, "atime": time.time()}
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+
+            if old_entry is not None:
+                self._release_object(old_entry["digest"])
+
+            self._evict()
+            self._changed()
+
+    def contains(self, key):
+        """
+         Checks if the given key is cached without touching the statistics.
+
+        :param key: cache key of make_key()
+
+        :return: boolean
+        """
+        with self._lock:
+            return self._entry_id(key) in self._entries
+
+    def remove(self, key):
+        """
+         Removes the entry of the given key from the cache.
+
+        :param key: cache key of make_key()
+        """
+        with self._lock:
+            if self._remove_entry(self._entry_id(key)):
+                self._changed()
+
+    def set_max_bytes(self, max_bytes):
+        """
+         Sets the size cap of the cache and evicts entries if necessary.
+
+        :param max_bytes: size cap in bytes (integer)
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+            self._changed()
+
+    def size(self):
+        """
+         Returns the size of all cached objects in bytes.
+        """
+        with self._lock:
+            return sum(self._objects.values())
+
+    def stats(self):
+        """
+         Returns the statistics of the cache.
+
+        :return: dict with the keys hits, misses, entries and size (in bytes)
+        """
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "entries": len(self._entries),
+                    "size": sum(self._objects.values())}
+
+    def clear(self):
+        """
+         Removes all entries and objects from the cache.
+        """
+        with self._lock:
+            for digest in list(self._objects.keys()):
+                self._delete_object(digest)
+
+            self._entries = {}
+            self._objects = {}
+            self._refs = {}
+            self.flush()
+
+    def flush(self):
+        """
+         Writes the index to disk.
+        """
+        with self._lock:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": 1, "entries": self._entries}, f)
+            os.replace(tmp_path, self.index_path)
+
+            self._changes = 0
+
+    def _load_index(self):
+        """
+         Reads the index from disk; a missing or broken index results in an empty cache.
+        """
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+
+            entries = index.get("entries", {})
+
+        except (IOError, OSError, ValueError):
+            entries = {}
+
+        for entry_id, entry in entries.items():
+            digest = entry["digest"]
+
+            if os.path.exists(self._object_path(digest)):
+                self._entries[entry_id] = entry
+                self._objects[digest] = entry["size"]
+                self._refs[digest] = self._refs.get(digest, 0) + 1
+
+    def _entry_id(self, key):
+        return hashlib.sha1("|".join(key).encode("utf-8")).hexdigest()
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _changed(self):
+        self._changes += 1
+
+        if self._changes >= INDEX_SAVE_INTERVAL:
+            self.flush()
+
+    def _evict(self):
+        """
+         Removes the least recently used entries until the size of the cache is below the size cap.
+        """
+        size = sum(self._objects.values())
+
+        if size <= self.max_bytes:
+            return
+
+        for entry_id, entry in sorted(self._entries.items(), key=lambda item: item[1]["atime"]):
+            if size <= self.max_bytes:
+                break
+
+            digest = entry["digest"]
+            self._remove_entry(entry_id)
+
+            if digest not in self._objects:
+                size -= entry["size"]
+
+    def _remove_entry(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+
+        if entry is None:
+            return False
+
+        self._release_object(entry["digest"])
+
+        return True
+
+    def _release_object(self, digest):
+        """
+         Deletes the object of the given digest if no entry references it anymore.
+        """
+        self._refs[digest] = self._refs.get(digest, 1) - 1
+
+        if self._refs[digest] > 0:
+            return
+
+        del self._refs[digest]
+        self._delete_object(digest)
+        self._objects.pop(digest, None)
+
+    def _delete_object(self, digest):
+        self._remove_file(self._object_path(digest))
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except (IOError, OSError):
+            pass
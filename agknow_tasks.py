@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowTasks
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import absolute_import
+
+import threading
+
+from qgis.PyQt import QtCore
+
+from qgis.core import QgsApplication, QgsTask, QgsTaskManager, QgsMessageLog, Qgis
+
+# priorities of the worker jobs; higher priorities are started first
+PRIORITY_HIGH = 3
+PRIORITY_NORMAL = 2
+PRIORITY_LOW = 1
+PRIORITY_BACKGROUND = 0
+
+# default priority per run method of the Worker
+DEFAULT_PRIORITIES = {"get_parcel_pages": PRIORITY_HIGH,
+                      "register_feature": PRIORITY_HIGH,
+                      "get_images": PRIORITY_LOW,
+                      "export_images": PRIORITY_BACKGROUND,
+                      "prefetch_parcels": PRIORITY_BACKGROUND}
+
+# run methods of background jobs: they wait for the foreground jobs and are left out of the aggregated progress
+BACKGROUND_METHODS = ["prefetch_parcels"]
+
+
+class WorkerTask(QgsTask):
+    """
+     QgsTask which runs a method of a Worker in the thread pool of the QGIS task manager.
+
+     The worker reports with its own signals (progress, status, partial, finished, error); they are delivered
+     queued to the receivers in the GUI thread. The progress of the worker is also the progress of the task.
+    """
+    def __init__(self, description, worker, run_method, tag=None, flags=QgsTask.CanCancel):
+        """
+         Constructor
+
+        :param description: description of the task shown in the task manager of QGIS (string)
+        :param worker: Worker
+        :param run_method: name of the method of the worker which does the work (string)
+        :param tag: what the task works on (e.g. the raster group id of a parcel); used to cancel obsolete tasks
+        :param flags: QgsTask flags
+        """
+        super(WorkerTask, self).__init__(description, flags)
+
+        self.worker = worker
+        self.run_method = run_method
+        self.tag = tag
+        self.background = run_method in BACKGROUND_METHODS
+        self.exception = None
+
+        # the worker may check task.isCanceled() in its loops
+        self.worker.task = self
+
+        self.worker.progress.connect(self.setProgress)
+
+    def cancel(self):
+        """
+         Cancels the task and tells the worker to stop; its in-flight requests are aborted.
+        """
+        self.worker.cancel()
+
+        super(WorkerTask, self).cancel()
+
+    def run(self):
+        """
+         Runs the method of the worker (in a thread of the task manager).
+
+        :return: True if the task has not been canceled
+        """
+        try:
+            getattr(self.worker, self.run_method)()
+
+        except Exception as e:
+            # the worker methods emit their errors themselves; this is the last resort
+            self.exception = e
+            return False
+
+        return not self.isCanceled()
+
+
+class AgknowTaskManager(QtCore.QObject):
+    """
+     Runs the worker jobs of the plugin as WorkerTasks in the QgsTaskManager of QGIS: several jobs at once, with
+     priorities, dependencies and cancellation, and the aggregated progress of all running jobs.
+    """
+    # aggregated progress of all jobs in percent
+    progress = QtCore.pyqtSignal(int)
+    # number of active jobs
+    countChanged = QtCore.pyqtSignal(int)
+
+    def __init__(self, task_manager=None):
+        """
+         Constructor
+
+        :param task_manager: QgsTaskManager; defaults to the task manager of the QGIS application
+        """
+        QtCore.QObject.__init__(self)
+
+        self.task_manager = task_manager if task_manager is not None else QgsApplication.taskManager()
+
+        # references to the queued and running tasks (and their workers) until they are done
+        self.tasks = []
+
+        # set while no foreground job is queued or running; background jobs wait for it
+        self.foreground_idle = threading.Event()
+        self.foreground_idle.set()
+
+    def submit(self, description, worker, run_method, priority=None, dependencies=None, tag=None):
+        """
+         Queues the given worker job.
+
+        :param description: description of the task (string)
+        :param worker: Worker
+        :param run_method: name of the method of the worker which does the work (string)
+        :param priority: priority of the task (integer); defaults to the priority of the run method
+        :param dependencies: tasks which have to be finished before this task starts (list of WorkerTask)
+        :param tag: what the task works on (optional); see cancel()
+
+        :return: WorkerTask
+        """
+        if priority is None:
+            priority = DEFAULT_PRIORITIES.get(run_method, PRIORITY_NORMAL)
+
+        task = WorkerTask(description, worker, run_method, tag=tag)
+
+        task.progressChanged.connect(self._update_progress)
+        task.taskCompleted.connect(self.cleanup)
+        task.taskTerminated.connect(self.cleanup)
+
+        self.tasks.append(task)
+
+        dependencies = [t for t in (dependencies or []) if t in self.tasks]
+
+        if len(dependencies) > 0:
+            self.task_manager.addTask(QgsTaskManager.TaskDefinition(task, dependencies), priority)
+        else:
+            self.task_manager.addTask(task, priority)
+
+        self.countChanged.emit(len(self.tasks))
+        self._update_foreground()
+
+        return task
+
+    def cancel(self, run_method=None, keep_tag=None):
+        """
+         Cancels the queued and running jobs.
+
+        :param run_method: only cancel the jobs of this run method (string); all jobs if None
+        :param keep_tag: only cancel the tagged jobs whose tag differs from this one (e.g. the jobs of the
+                         previously selected parcel); untagged jobs are kept then
+        """
+        for task in self.running(run_method):
+            if keep_tag is not None and (task.tag is None or task.tag == keep_tag):
+                continue
+
+            task.cancel()
+
+        self._update_foreground()
+
+    def running(self, run_method=None, tag=None):
+        """
+         Returns the queued and running jobs (of the given run method and tag) which have not been cancelled.
+
+        :param run_method: name of the run method (string); all jobs if None
+        :param tag: tag of the jobs; all jobs if None
+
+        :return: list of WorkerTask
+        """
+        return [t for t in self.tasks if not t.isCanceled() and
+                (run_method is None or t.run_method == run_method) and (tag is None or t.tag == tag)]
+
+    def active_count(self, run_method=None):
+        """
+         Returns the number of queued and running jobs (of the given run method).
+        """
+        return len(self.running(run_method))
+
+    def foreground_count(self):
+        """
+         Returns the number of queued and running foreground jobs.
+        """
+        return len([t for t in self.running() if not t.background])
+
+    def cleanup(self):
+        """
+         Drops the references to the jobs which are done; never waits for a thread.
+        """
+        done = [t for t in self.tasks if t.status() in (QgsTask.Complete, QgsTask.Terminated)]
+
+        for task in done:
+            self.tasks.remove(task)
+
+            if task.exception is not None:
+                QgsMessageLog.logMessage("{0} failed: {1}".format(task.description(), task.exception), "agknow",
+                                         Qgis.Critical)
+
+        if len(done) > 0:
+            self.countChanged.emit(len(self.tasks))
+            self._update_progress()
+            self._update_foreground()
+
+    def _update_progress(self, *args):
+        tasks = [t for t in self.tasks if not t.background]
+
+        if len(tasks) == 0:
+            return
+
+        self.progress.emit(int(sum(t.progress() for t in tasks) / len(tasks)))
+
+    def _update_foreground(self):
+        if self.foreground_count() == 0:
+            self.foreground_idle.set()
+        else:
+            self.foreground_idle.clear()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowToc
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import print_function
+
+from builtins import object
+from builtins import str
+
+from qgis.core import QgsLayerTree
+
+# don't know why, but the product groups must not be simple 'vitality' but have to have
+# an additional character (e.g. whitespace)
+PRODUCT_GROUP_SUFFIX = " "
+
+PARCEL_GROUP_PREFIX = "parcel id: "
+
+# custom properties of the indexed groups
+PROP_PARCEL_ID = "agknow/parcel_id"
+PROP_PRODUCT = "agknow/product"
+PROP_DATA_SOURCE = "agknow/data_source"
+
+
+class TocIndex(object):
+    """
+     Index of the agknow groups of the TOC: "images" > "parcel id: <id>" > "<product> " > "<data source>".
+
+     Maps parcel id, product and data source to their QgsLayerTreeGroup and the image layers of a data source group
+     to their QgsLayerTreeLayer by name, so no lookup has to walk the layer tree. Groups and layers are indexed when
+     they are created through the index; removals anywhere below the images group are tracked with its
+     willRemoveChildren signal.
+
+     Parcels may be registered as placeholders instead (lazy TOC): only the products and data sources of their
+     groups are recorded and the groups are created as soon as the parcel group is needed.
+    """
+    def __init__(self):
+        """
+         Constructor
+        """
+        self.images_group = None
+
+        # {parcel_id: {"group": QgsLayerTreeGroup,
+        #              "products": {product: {"group": QgsLayerTreeGroup,
+        #                                     "sources": {data_source: {"group": QgsLayerTreeGroup,
+        #                                                               "layers": {name: QgsLayerTreeLayer}}}}}}}
+        self._parcels = {}
+
+        # {parcel_id: {product: [data_source, ..]}} of the parcels whose groups have not been created yet
+        self._placeholders = {}
+
+    def bind(self, images_group):
+        """
+         Binds the index to the given images group and indexes the groups and layers it already contains.
+
+        :param images_group: the "images" group of the TOC (QgsLayerTreeGroup)
+        """
+        self.unbind()
+
+        self.images_group = images_group
+        self.images_group.willRemoveChildren.connect(self.children_removed)
+
+        for parcel_group in self._child_groups(images_group):
+            name = parcel_group.name()
+
+            if not name.startswith(PARCEL_GROUP_PREFIX):
+                continue
+
+            parcel_id = name[len(PARCEL_GROUP_PREFIX):]
+            parcel = self._add_parcel(parcel_id, parcel_group)
+
+            for product_group in self._child_groups(parcel_group):
+                product_id = product_group.name().strip()
+                product = self._add_product(parcel, parcel_id, product_id, product_group)
+
+                for source_group in self._child_groups(product_group):
+                    source = self._add_source(product, parcel_id, product_id, source_group.name(), source_group)
+
+                    for node in source_group.children():
+                        if QgsLayerTree.isLayer(node):
+                            source["layers"][node.name()] = node
+
+    def unbind(self):
+        """
+         Disconnects the index from its images group and drops all entries.
+        """
+        if self.images_group is not None:
+            try:
+                self.images_group.willRemoveChildren.disconnect(self.children_removed)
+            except (RuntimeError, TypeError):
+                # group has been deleted already
+                pass
+
+        self.images_group = None
+        self._parcels = {}
+        self._placeholders = {}
+
+    def add_placeholder(self, parcel_id, product_id, data_sources):
+        """
+         Records the groups of the given parcel, product and data sources without creating them.
+
+        :param parcel_id: parcel's ID
+        :param product_id: product id: visible, vitality, variations, etc. (string)
+        :param data_sources: landsat8 and/or sentinel2 (list of strings)
+        """
+        parcel_id = str(parcel_id)
+
+        if parcel_id in self._parcels:
+            # groups exist already
+            for ds in data_sources:
+                self.data_source_group(parcel_id, product_id, ds, create=True)
+            return
+
+        products = self._placeholders.setdefault(parcel_id, {})
+        sources = products.setdefault(product_id.strip(), [])
+
+        for ds in data_sources:
+            if ds not in sources:
+                sources.append(ds)
+
+    def clear_placeholders(self):
+        """
+         Drops all placeholders (e.g. when the parcels are loaded again).
+        """
+        self._placeholders = {}
+
+    def is_placeholder(self, parcel_id):
+        """
+         Checks if the groups of the given parcel have not been created yet.
+
+        :return: boolean
+        """
+        return str(parcel_id) in self._placeholders
+
+    def placeholder_count(self):
+        """
+         Returns the number of parcels whose groups have not been created yet.
+        """
+        return len(self._placeholders)
+
+    def materialize(self, parcel_id):
+        """
+         Creates the recorded groups of the given placeholder parcel.
+
+        :param parcel_id: parcel's ID
+
+        :return: parcel group (QgsLayerTreeGroup) or None if the parcel is neither placeholder nor in the TOC
+        """
+        if not self.is_placeholder(parcel_id):
+            return self.parcel_group(parcel_id)
+
+        return self.parcel_group(parcel_id, create=True)
+
+    def parcel_group(self, parcel_id, create=False):
+        """
+         Returns the group of the given parcel.
+
+        :param parcel_id: parcel's ID
+        :param create: create the group if it does not exist (boolean)
+
+        :return: QgsLayerTreeGroup or None
+        """
+        parcel_id = str(parcel_id)
+        parcel = self._parcels.get(parcel_id)
+
+        if parcel is None:
+            if not create or self.images_group is None:
+                return None
+
+            group = self.images_group.addGroup(PARCEL_GROUP_PREFIX + parcel_id)
+            parcel = self._add_parcel(parcel_id, group)
+
+            # create the groups of the placeholder
+            for product_id, data_sources in self._placeholders.pop(parcel_id, {}).items():
+                for ds in data_sources:
+                    self.data_source_group(parcel_id, product_id, ds, create=True)
+
+        return parcel["group"]
+
+    def product_group(self, parcel_id, product_id, create=False):
+        """
+         Returns the group of the given parcel and product.
+
+        :param parcel_id: parcel's ID
+        :param product_id: product id: visible, vitality, variations, etc. (string); surrounding whitespace is ignored
+        :param create: create the group (and its parcel group) if it does not exist (boolean)
+
+        :return: QgsLayerTreeGroup or None
+        """
+        parcel_id = str(parcel_id)
+        product_id = product_id.strip()
+
+        product = self._product(parcel_id, product_id)
+
+        if product is None:
+            if not create or self.parcel_group(parcel_id, create=True) is None:
+                return None
+
+            # may have been created with the groups of the placeholder
+            product = self._product(parcel_id, product_id)
+
+        if product is None:
+            parcel = self._parcels[parcel_id]
+            group = parcel["group"].addGroup(product_id + PRODUCT_GROUP_SUFFIX)
+            product = self._add_product(parcel, parcel_id, product_id, group)
+
+        return product["group"]
+
+    def data_source_group(self, parcel_id, product_id, data_source, create=False):
+        """
+         Returns the group of the given parcel, product and data source.
+
+        :param parcel_id: parcel's ID
+        :param product_id: product id: visible, vitality, variations, etc. (string); surrounding whitespace is ignored
+        :param data_source: landsat8 or sentinel2 (string)
+        :param create: create the group (and its parent groups) if it does not exist (boolean)
+
+        :return: QgsLayerTreeGroup or None
+        """
+        source = self._source(str(parcel_id), product_id.strip(), data_source)
+
+        if source is None:
+            if not create or self.product_group(parcel_id, product_id, create=True) is None:
+                return None
+
+            # may have been created with the groups of the placeholder
+            source = self._source(str(parcel_id), product_id.strip(), data_source)
+
+        if source is None:
+            product = self._product(str(parcel_id), product_id.strip())
+            group = product["group"].addGroup(data_source)
+            source = self._add_source(product, str(parcel_id), product_id.strip(), data_source, group)
+
+        return source["group"]
+
+    def parcel_groups(self):
+        """
+         Returns the groups of all parcels.
+
+        :return: dict {parcel_id (string): QgsLayerTreeGroup}
+        """
+        return dict((parcel_id, parcel["group"]) for parcel_id, parcel in self._parcels.items())
+
+    def data_source_groups(self, parcel_id):
+        """
+         Returns the data source groups of all products of the given parcel.
+
+        :param parcel_id: parcel's ID
+
+        :return: list of tuples (product_id, data_source, QgsLayerTreeGroup)
+        """
+        parcel = self._parcels.get(str(parcel_id))
+
+        if parcel is None:
+            return []
+
+        return [(product_id, data_source, source["group"])
+                for product_id, product in parcel["products"].items()
+                for data_source, source in product["sources"].items()]
+
+    def add_layer(self, parcel_id, product_id, data_source, map_layer):
+        """
+         Adds the given map layer to the data source group (which is created if necessary).
+
+        :param parcel_id: parcel's ID
+        :param product_id: product id: visible, vitality, variations, etc. (string)
+        :param data_source: landsat8 or sentinel2 (string)
+        :param map_layer: layer which has been added to the project (QgsMapLayer)
+
+        :return: QgsLayerTreeLayer
+        """
+        group = self.data_source_group(parcel_id, product_id, data_source, create=True)
+
+        node = group.addLayer(map_layer)
+
+        self._source(str(parcel_id), product_id.strip(), data_source)["layers"][node.name()] = node
+
+        return node
+
+    def find_layer(self, parcel_id, product_id, data_source, name):
+        """
+         Returns the layer with the given name of the data source group.
+
+        :param parcel_id: parcel's ID
+        :param product_id: product id: visible, vitality, variations, etc. (string)
+        :param data_source: landsat8 or sentinel2 (string)
+        :param name: name of the layer (string)
+
+        :return: QgsLayerTreeLayer or None
+        """
+        source = self._source(str(parcel_id), product_id.strip(), data_source)
+
+        if source is None:
+            return None
+
+        return source["layers"].get(name)
+
+    def children_removed(self, node, index_from, index_to):
+        """
+         Drops the removed groups and layers from the index; slot for willRemoveChildren of the images group
+         (which also carries the removals of all nested groups).
+
+        :param node: parent of the removed nodes (QgsLayerTreeNode)
+        :param index_from: index of the first removed child (integer)
+        :param index_to: index of the last removed child (integer)
+        """
+        children = node.children()
+
+        for child in children[index_from:index_to + 1]:
+
+            if QgsLayerTree.isLayer(child):
+                source = self._source(node.customProperty(PROP_PARCEL_ID), node.customProperty(PROP_PRODUCT),
+                                      node.customProperty(PROP_DATA_SOURCE))
+
+                if source is not None and source["layers"].get(child.name()) is not None:
+                    if source["layers"][child.name()].layerId() == child.layerId():
+                        del source["layers"][child.name()]
+
+                continue
+
+            parcel_id = child.customProperty(PROP_PARCEL_ID)
+            product_id = child.customProperty(PROP_PRODUCT)
+            data_source = child.customProperty(PROP_DATA_SOURCE)
+
+            if parcel_id is None:
+                continue
+
+            if product_id is None:
+                self._parcels.pop(parcel_id, None)
+
+            elif data_source is None:
+                parcel = self._parcels.get(parcel_id)
+
+                if parcel is not None:
+                    parcel["products"].pop(product_id, None)
+
+            else:
+                product = self._product(parcel_id, product_id)
+
+                if product is not None:
+                    product["sources"].pop(data_source, None)
+
+    def _product(self, parcel_id, product_id):
+        parcel = self._parcels.get(parcel_id)
+
+        if parcel is None:
+            return None
+
+        return parcel["products"].get(product_id)
+
+    def _source(self, parcel_id, product_id, data_source):
+        if parcel_id is None or product_id is None:
+            return None
+
+        product = self._product(parcel_id, product_id)
+
+        if product is None:
+            return None
+
+        return product["sources"].get(data_source)
+
+    def _add_parcel(self, parcel_id, group):
+        group.setCustomProperty(PROP_PARCEL_ID, parcel_id)
+
+        parcel = {"group": group, "products": {}}
+        self._parcels[parcel_id] = parcel
+
+        return parcel
+
+    def _add_product(self, parcel, parcel_id, product_id, group):
+        group.setCustomProperty(PROP_PARCEL_ID, parcel_id)
+        group.setCustomProperty(PROP_PRODUCT, product_id)
+
+        product = {"group": group, "sources": {}}
+        parcel["products"][product_id] = product
+
+        return product
+
+    def _add_source(self, product, parcel_id, product_id, data_source, group):
+        group.setCustomProperty(PROP_PARCEL_ID, parcel_id)
+        group.setCustomProperty(PROP_PRODUCT, product_id)
+        group.setCustomProperty(PROP_DATA_SOURCE, data_source)
+
+        source = {"group": group, "layers": {}}
+        product["sources"][data_source] = source
+
+        return source
+
+    def _child_groups(self, group):
+        return [node for node in group.children() if QgsLayerTree.isGroup(node)]
+
+
+_index = None
+
+
+def get_index():
+    """
+     Returns the TOC index shared by the dockwidgets of the plugin.
+
+    :return: TocIndex
+    """
+    global _index
+
+    if _index is None:
+        _index = TocIndex()
+
+    return _index
@@ -23,24 +23,205 @@
 from __future__ import print_function
 
 from builtins import object
-from qgis.core import QgsGeometry, QgsFeature, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from qgis.core import QgsGeometry, QgsFeature, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, \
+    QgsFields, QgsField
+from qgis.PyQt.QtCore import QVariant
 import requests, json
 
 from osgeo import gdal, osr
 from uuid import uuid4
 
+from . import agknow_http
+from . import agknow_vsimem
+
+# number of parcels per page of the parcel listing
+DEFAULT_PAGE_SIZE = 500
+
+# number of features which are added to the parcel layer at once
+DEFAULT_CHUNK_SIZE = 500
+
+# transfer of the raster images: "memory" reads the whole response into a bytes object first, "stream" writes it
+# chunk by chunk into /vsimem, "vsicurl" lets GDAL read GeoTIFFs remotely with range requests (if the server
+# supports them; otherwise "stream")
+TRANSFER_MEMORY = "memory"
+TRANSFER_STREAM = "stream"
+TRANSFER_VSICURL = "vsicurl"
+DEFAULT_RASTER_TRANSFER = TRANSFER_STREAM
+
+# {base_url: True|False} - does the raster endpoint of the host support range requests
+_range_support = {}
+_range_support_lock = threading.Lock()
+
+
+def parcel_fields():
+    """
+     Returns the fields of the data model of the parcel layer (see AgknowUtils.build_feature()).
+
+    :return: QgsFields
+    """
+    fields = QgsFields()
+    fields.append(QgsField("parcel_id", QVariant.Int))
+    fields.append(QgsField("name", QVariant.String))
+    fields.append(QgsField("entity", QVariant.String))
+    fields.append(QgsField("crop", QVariant.String))
+    fields.append(QgsField("startdate", QVariant.String))
+    fields.append(QgsField("enddate", QVariant.String))
+    fields.append(QgsField("planting", QVariant.String))
+    fields.append(QgsField("harvest", QVariant.String))
+    fields.append(QgsField("area", QVariant.Double))
+    fields.append(QgsField("apikey", QVariant.String))
+    fields.append(QgsField("host", QVariant.String))
+
+    return fields
+
+
+# {(src_epsg_code, dst_epsg_code): QgsCoordinateTransform}
+_transform_cache = {}
+_transform_cache_lock = threading.Lock()
+
+
+def get_coordinate_transform(src_epsg_code, dst_epsg_code):
+    """
+     Returns a QgsCoordinateTransform for the given src and dest EPSG codes. The CRS objects and the transform are
+     built only once per pair of EPSG codes; every caller gets an own copy of the cached transform, because a
+     QgsCoordinateTransform must not be used by several threads at the same time (copies are cheap, the data is
+     implicitly shared).
+
+    :param src_epsg_code: source EPSG Code (integer)
+    :param dst_epsg_code: destination EPSG Code (integer)
+
+    :return: QgsCoordinateTransform
+    """
+    key = (src_epsg_code, dst_epsg_code)
+
+    with _transform_cache_lock:
+        xform = _transform_cache.get(key)
+
+        if xform is None:
+            crsSrc = QgsCoordinateReferenceSystem.fromEpsgId(src_epsg_code)
+            crsDest = QgsCoordinateReferenceSystem.fromEpsgId(dst_epsg_code)
+            xform = QgsCoordinateTransform(crsSrc,
+                                           crsDest,
+                                           QgsProject.instance())
+
+            _transform_cache[key] = xform
+
+        return QgsCoordinateTransform(xform)
+
+
+def clear_transform_cache():
+    """
+     Clears the cache of get_coordinate_transform() (e.g. if the transform context of the project has changed).
+    """
+    with _transform_cache_lock:
+        _transform_cache.clear()
+
+
+class FeatureBatch(object):
+    """
+     Accumulates QgsFeatures and adds them to a QgsVectorLayer in chunks, so the provider bookkeeping,
+     the extent update and the spatial index update happen once per chunk instead of once per feature.
+     Call commit() after the last feature.
+    """
+    def __init__(self, utils, lyr, parcel_ids, parcel_ids_names, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+         Constructor
+
+        :param utils: AgknowUtils
+        :param lyr: QgsVectorLayer
+        :param parcel_ids: list of parcel_ids; parcel_id is appended to it after the adding of the feature to the layer
+        :param parcel_ids_names: list of parcel_ids and parcel names; parcel_id and parcel name
+               are appended to it after the adding of the feature to the layer
+        :param chunk_size: number of features which are added to the layer at once
+        """
+        self.utils = utils
+        self.lyr = lyr
+        self.parcel_ids = parcel_ids
+        self.parcel_ids_names = parcel_ids_names
+        self.chunk_size = max(int(chunk_size), 1)
+
+        self.features = []
+        self.attributes = []
+
+    def add(self, geom, attributes):
+        """
+         Adds a feature (geometry and attributes) to the batch; the chunk is committed if it is full.
+
+        :param geom: The geometry for the feature (should be in the correct SRS of the layer - no checking here!
+        :param attributes: dictionary of hard coded attributes for the layer - must fit the data model of the layer!
+        """
+        self.features.append(self.utils.build_feature(geom, attributes))
+        self.attributes.append(attributes)
+
+        if len(self.features) >= self.chunk_size:
+            self.commit()
+
+    def commit(self):
+        """
+         Adds all pending features to the layer with one call of the data provider.
+        """
+        if len(self.features) == 0:
+            return
+
+        pr = self.lyr.dataProvider()
+        pr.addFeatures(self.features)
+
+        # one extent and spatial index update per chunk
+        self.lyr.updateExtents()
+        pr.createSpatialIndex()
+
+        for attributes in self.attributes:
+            self.parcel_ids.append(attributes["parcel_id"])
+            self.parcel_ids_names.append(u"{0} - {1}".format(attributes["parcel_id"], attributes["name"]))
+
+        self.features = []
+        self.attributes = []
+
 class AgknowUtils(object):
     """
      Utils class for the agknow plugin.
     """
-    def __init__(self, api_version):
+    def __init__(self, api_version, session=None):
+        """
+         Constructor
+
+        :param api_version: API version path (e.g. /agknow/api/v4)
+        :param session: AgknowHttpSession for all HTTP requests; defaults to the shared session of agknow_http
+        """
         self.api_version = api_version
+        self._session = session
+
+        # agknow_http.CancelToken of the job using this instance; aborts its GET requests (optional)
+        self.cancel_token = None
+
+        # agknow_metadata_cache.MetadataCache for the JSON responses (optional)
+        self.metadata_cache = None
+
+        # {(base_url, parcel_id, product_id): bounds} - all rasters of a parcel and product have the same bbox
+        self._bbox_cache = {}
+        self._bbox_cache_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+         The AgknowHttpSession of this instance. Without an own session the shared session of agknow_http is
+         resolved on every access, so a reconfigured shared session is picked up immediately.
+        """
+        if self._session is not None:
+            return self._session
+
+        return agknow_http.get_session()
 
     def add_feature(self, geom, attributes, lyr, parcel_ids, parcel_ids_names=[]):
         """
          Adds a QgsFeature (geometry and attributes) to the given QgsVectorLayer.
          parcel_ids and parcel_ids_names are manipulated inside this method.
 
+         For many features use a FeatureBatch (see feature_batch()) instead.
+
         :param geom: The geometry for the feature (should be in the correct SRS of the layer - no checking here!
         :param attributes: dictionary of hard coded attributes for the layer - must fit the data model of the layer!
         :param lyr: QgsVectorLayer
@@ -50,6 +231,22 @@ class AgknowUtils(object):
 
         parcel_ids and parcel_ids_names are both used for the internal checking of already added parcels
 
+        """
+        feat = self.build_feature(geom, attributes)
+
+        lyr.dataProvider().addFeatures([feat])
+
+        parcel_ids.append(attributes["parcel_id"])
+        parcel_ids_names.append(u"{0} - {1}".format(attributes["parcel_id"], attributes["name"]))
+
+    def build_feature(self, geom, attributes):
+        """
+         Builds a QgsFeature (geometry and attributes) for the parcel layer.
+
+        :param geom: The geometry for the feature (should be in the correct SRS of the layer - no checking here!
+        :param attributes: dictionary of hard coded attributes for the layer - must fit the data model of the layer!
+
+        :return: QgsFeature
         """
         feat = QgsFeature()
         feat.setId(attributes["parcel_id"])
@@ -64,10 +261,20 @@ class AgknowUtils(object):
 
         feat.setAttributes(row)
 
-        lyr.dataProvider().addFeatures([feat])
+        return feat
 
-        parcel_ids.append(attributes["parcel_id"])
-        parcel_ids_names.append(u"{0} - {1}".format(attributes["parcel_id"], attributes["name"]))
+    def feature_batch(self, lyr, parcel_ids, parcel_ids_names, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+         Returns a FeatureBatch for adding many features to the given QgsVectorLayer in chunks.
+
+        :param lyr: QgsVectorLayer
+        :param parcel_ids: list of parcel_ids; see add_feature()
+        :param parcel_ids_names: list of parcel_ids and parcel names; see add_feature()
+        :param chunk_size: number of features which are added to the layer at once
+
+        :return: FeatureBatch
+        """
+        return FeatureBatch(self, lyr, parcel_ids, parcel_ids_names, chunk_size)
 
     def transform_geom(self, geom, src_epsg_code, dst_epsg_code):
         """
@@ -82,11 +289,11 @@ class AgknowUtils(object):
 
         if isinstance(src_epsg_code, type(1)) and isinstance(dst_epsg_code, type(1)):
 
-            crsSrc = QgsCoordinateReferenceSystem.fromEpsgId(src_epsg_code)
-            crsDest = QgsCoordinateReferenceSystem.fromEpsgId(dst_epsg_code)
-            xform = QgsCoordinateTransform(crsSrc,
-                                           crsDest,
-                                           QgsProject.instance())
+            # nothing to do
+            if src_epsg_code == dst_epsg_code:
+                return geom
+
+            xform = get_coordinate_transform(src_epsg_code, dst_epsg_code)
 
             geom.transform(xform)
 
@@ -95,6 +302,30 @@ class AgknowUtils(object):
         else:
             return None
 
+    def transform_geoms(self, geoms, src_epsg_code, dst_epsg_code):
+        """
+         Transforms all given QgsGeometry objects with a single QgsCoordinateTransform for the given src and dest
+         EPSG code parameters.
+
+        :param geoms: list of QgsGeometry objects
+        :param src_epsg_code: source EPSG Code
+        :param dst_epsg_code: destination EPSG Code
+
+        :return: list of transformed QgsGeometry objects or None if the EPSG codes are not valid
+        """
+        if isinstance(src_epsg_code, type(1)) and isinstance(dst_epsg_code, type(1)):
+
+            if src_epsg_code != dst_epsg_code:
+                xform = get_coordinate_transform(src_epsg_code, dst_epsg_code)
+
+                for geom in geoms:
+                    geom.transform(xform)
+
+            return geoms
+
+        else:
+            return None
+
     def sync_http_get(self, base_url, params="", ssl_verify=True, return_raw=False):
         """
          Performs a HTTP GET request with the given base_url and optional URL parameters. Honors also a global boolean
@@ -111,24 +342,70 @@ class AgknowUtils(object):
         #print(url)
 
         try:
-            # timeout 5 seconds
-            resp = requests.get(url, verify=ssl_verify, timeout=5.0)
+            # timeouts, retries and rate limit are handled by the session
+            resp = self.session.get(url, verify=ssl_verify, cancel_token=self.cancel_token)
+
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # never put the URL parameters into the message: they contain the API key
+            raise agknow_http.HttpError("GET {0} failed: {1}".format(base_url, type(e).__name__))
 
-            if resp.status_code == 200:
+        if resp.status_code == 200:
 
-                if not return_raw:
-                    return resp.text
-                else:
-                    return resp.content
+            if not return_raw:
+                return resp.text
             else:
-                print(resp.status_code)
-                print(resp.text)
-                # API v4 won't return HTTP 200 on error
-                if self.api_version.endswith("4"):
-                    return resp.text
+                return resp.content
+
+        return self.handle_error_response("GET", base_url, resp)
+
+    def cached_http_get(self, base_url, params="", ssl_verify=True, use_ttl=False):
+        """
+         Performs a HTTP GET request for a JSON response of the API through the metadata cache: a cached response
+         is revalidated with a conditional request (If-None-Match/If-Modified-Since), so an unchanged response
+         costs a 304 only. A cached response without validators is requested again unless use_ttl is set.
+         Without metadata cache this is the same as sync_http_get().
+
+        :param base_url: URL for the HTTP GET request
+        :param params: URL parameters (e.g. ?key=kkk&entity=eee), optional
+        :param ssl_verify: shall the host be verified according to its TLS certificate or not; default is True
+        :param use_ttl: use cached responses without validators until their TTL has expired (boolean); see
+                        MetadataCache.lookup(); default is False
+
+        :return: response text
+        """
+        cache = self.metadata_cache
+
+        if cache is None:
+            return self.sync_http_get(base_url, params, ssl_verify)
+
+        url = base_url + params
+
+        body, headers = cache.lookup(url, use_ttl=use_ttl)
 
-        except requests.ConnectionError as e:
-            print(e)
+        if body is not None:
+            return body
+
+        try:
+            resp = self.session.get(url, verify=ssl_verify, headers=headers, cancel_token=self.cancel_token)
+
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise agknow_http.HttpError("GET {0} failed: {1}".format(base_url, type(e).__name__))
+
+        if resp.status_code == 304:
+            body = cache.not_modified(url, resp.headers)
+
+            if body is not None:
+                return body
+
+            # evicted in the meantime
+            return self.sync_http_get(base_url, params, ssl_verify)
+
+        if resp.status_code == 200:
+            cache.put(url, resp.text, resp.headers)
+
+            return resp.text
+
+        return self.handle_error_response("GET", base_url, resp)
 
     def sync_http_post(self, base_url, params="", postdata="", ssl_verify=True):
         """
@@ -150,20 +427,125 @@ class AgknowUtils(object):
         headers = {'Content-type': 'application/json'}
         try:
             print(json.dumps(postdata))
-            # timeout 10 seconds
-            resp = requests.post(url, data=postdata, headers=headers, verify=ssl_verify, timeout=10.0)
+            # POST is only retried if the server throttles (HTTP 429)
+            resp = self.session.post(url, data=postdata, headers=headers, verify=ssl_verify,
+                                     cancel_token=self.cancel_token)
 
-            if resp.status_code == 200:
-                return resp.text
-            else:
-                print(resp.status_code)
-                print(resp.text)
-                # API v4 won't return HTTP 200 on error
-                if self.api_version.endswith("4"):
-                    return resp.text
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise agknow_http.HttpError("POST {0} failed: {1}".format(base_url, type(e).__name__))
+
+        if resp.status_code == 200:
+            return resp.text
+
+        return self.handle_error_response("POST", base_url, resp)
+
+    def handle_error_response(self, method, base_url, resp):
+        """
+         Handles a response other than HTTP 200: API v4 returns its error messages as JSON with other status codes,
+        so the response text is returned; otherwise an agknow_http.HttpError is raised.
+        """
+        print(resp.status_code)
+        print(resp.text)
+        # API v4 won't return HTTP 200 on error
+        if self.api_version.endswith("4"):
+            return resp.text
+
+        raise agknow_http.HttpError("{0} {1} failed: HTTP {2}".format(method, base_url, resp.status_code))
+
+    def get_parcel_page(self, base_url, api_key, limit, offset):
+        """
+         Gets one page of the parcel list (parcel ids and names) from the agknow API.
+
+        :param base_url: URL for the HTTP GET request
+        :param api_key: API key for agknow
+        :param limit: maximum number of parcels of the page
+        :param offset: index of the first parcel of the page
+
+        :return: result dictionary of the API; "content" is the list of parcels of the page
+        """
+        params = "/parcels/?key={0}&limit={1}&offset={2}".format(api_key, limit, offset)
+
+        return json.loads(self.cached_http_get(base_url, params))
+
+    def iter_parcel_pages(self, base_url, api_key, page_size=DEFAULT_PAGE_SIZE, max_workers=4, submit=None):
+        """
+         Iterates over the pages of the parcel list of the given API key. The first page is requested alone, so the
+         caller gets the first parcels (or an error of the API like an unauthorized key) after one round trip;
+         the following pages are requested concurrently but yielded in order.
+
+         If the API reports the number of parcels ("count") all remaining pages are requested at once, otherwise
+         max_workers pages are kept in flight until a page is not full.
+
+        :param base_url: URL for the HTTP GET request
+        :param api_key: API key for agknow
+        :param page_size: number of parcels per page
+        :param max_workers: maximum number of concurrent page requests
+        :param submit: callable (offset) which starts the request of a page and returns its
+                       concurrent.futures.Future (e.g. on the event loop of agknow_async); optional, the pages
+                       are requested in a thread pool by default
+
+        :return: generator of result dictionaries of the API (one per page)
+        """
+        if submit is not None:
+            for page in self._iter_parcel_pages(submit, page_size, max_workers):
+                yield page
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            def submit_page(offset):
+                return executor.submit(self.get_parcel_page, base_url, api_key, page_size, offset)
+
+            for page in self._iter_parcel_pages(submit_page, page_size, max_workers):
+                yield page
+
+    def _iter_parcel_pages(self, submit, page_size, max_workers):
+        first_page = submit(0).result()
+
+        yield first_page
+
+        content = first_page.get("content")
+
+        # error message of the API or last page
+        if not isinstance(content, list) or len(content) < page_size:
+            return
+
+        count = first_page.get("count")
+
+        if isinstance(count, int):
+            futures = [submit(offset) for offset in range(page_size, count, page_size)]
+
+            try:
+                for future in futures:
+                    yield future.result()
+
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        else:
+            offsets = iter(range(page_size, 2**31, page_size))
+            futures = [submit(next(offsets)) for _ in range(max_workers)]
+
+            try:
+                while len(futures) > 0:
+                    page = futures.pop(0).result()
+
+                    content = page.get("content")
+
+                    if not isinstance(content, list) or len(content) == 0:
+                        break
+
+                    yield page
+
+                    if len(content) < page_size:
+                        break
 
-        except ConnectionError as e:
-            print(e)
+                    futures.append(submit(next(offsets)))
+
+            finally:
+                for future in futures:
+                    future.cancel()
 
     def get_parcel_detail_data(self, base_url, api_key, parcel_id):
         """
@@ -179,8 +561,20 @@ class AgknowUtils(object):
         """
         params = "/parcels/{0}/?key={1}&geoformat=WKT".format(parcel_id, api_key)
 
-        result = json.loads(self.sync_http_get(base_url, params))
+        result = json.loads(self.cached_http_get(base_url, params))
+
+        return self.parse_parcel_detail_data(result, base_url, api_key)
+
+    def parse_parcel_detail_data(self, result, base_url, api_key):
+        """
+         Extracts the attributes and the geometry from the detail data response of a parcel.
 
+        :param result: result dictionary of the API
+        :param base_url: URL of the agknow API
+        :param api_key: API key for agknow
+
+        :return: tuple of attribute dictionary and the geometry as WKT
+        """
         data = {}
         attributes = {}
 
@@ -203,7 +597,7 @@ class AgknowUtils(object):
 
         return attributes, geom_wkt
 
-    def get_raster_list(self, base_url, api_key, parcel_id, product_id, data_source):
+    def get_raster_list(self, base_url, api_key, parcel_id, product_id, data_source, revalidate=False):
         """
          Gets the list of rasters from the given URL, API key, parcel id, product (e.g. vitality) and
          data source (e.g. sentinel2) from the agknow API.
@@ -213,15 +607,26 @@ class AgknowUtils(object):
         :param parcel_id: parcel id
         :param product_id: choose a product (e.g. "vitality"|"visible"|"variations")
         :param data_source: set data source ( e.g. ""|"landsat8"|"sentinel2")
+        :param revalidate: always ask the server for the current list (boolean); default is False
 
         :return: list of raster information dicts
         """
         params = "/parcels/{0}/{1}/?key={2}&source={3}".format(parcel_id, product_id, api_key, data_source)
 
-        result = json.loads(self.sync_http_get(base_url, params))
+        # the raster list only grows with new scenes, which a refresh (revalidate) asks for; the parcel list and
+        # the detail data change with every registration, so they are never used without a request
+        result = json.loads(self.cached_http_get(base_url, params, use_ttl=not revalidate))
 
         data = result["content"]
 
+        # API v4 answers errors (e.g. an unknown parcel) with {"content": "<message>"}
+        if not isinstance(data, list):
+            raise agknow_http.HttpError("Raster list of parcel {0} failed: {1}".format(parcel_id, data))
+
+        # remember the bbox for download_image()
+        if len(data) > 0 and "bounds" in data[0]:
+            self.cache_raster_bbox(base_url, parcel_id, product_id, data[0]["bounds"])
+
         return data
 
     def get_raster(self, base_url, api_key, parcel_id, product_id, data_source, raster_id, img_format="png"):
@@ -239,21 +644,146 @@ class AgknowUtils(object):
 
         :return: the binary representation of the raster image
         """
-        if product_id == "reflectances": # always tif
-            params = "/parcels/{0}/{1}/{2}/{3}.{4}?key={5}".format(parcel_id, product_id, data_source, raster_id, "tif",
-                                                                   api_key)
-        else:
-            params = "/parcels/{0}/{1}/{2}/{3}.{4}?key={5}".format(parcel_id, product_id, data_source, raster_id, img_format,
-                                                                   api_key)
+        params = self.raster_params(api_key, parcel_id, product_id, data_source, raster_id, img_format)
 
         result = self.sync_http_get(base_url, params, return_raw=True)
 
         return result
 
+    def stream_raster(self, base_url, api_key, parcel_id, product_id, data_source, raster_id, img_format="png",
+                      on_chunk=None):
+        """
+         Downloads a raster like get_raster(), but writes the response chunk by chunk into a new /vsimem file,
+         so the image never exists as a whole in Python memory.
+
+        :param base_url: URL for the HTTP GET request
+        :param api_key: API key for agknow
+        :param parcel_id: parcel id
+        :param product_id: choose a product (e.g. "vitality"|"visible"|"variations")
+        :param data_source: set data source (""|"landsat8"|"sentinel2")
+        :param raster_id: raster_id of the image
+        :param img_format: choose a image format ("png"|"tif")
+        :param on_chunk: callable which is called with every received chunk (bytes) before the next one is read,
+                         e.g. to limit the bandwidth (optional)
+
+        :return: memory map string of the raster image; registered in the /vsimem registry with one reference
+                 owned by the caller
+        """
+        url = base_url + self.raster_params(api_key, parcel_id, product_id, data_source, raster_id, img_format)
+
+        try:
+            resp = self.session.stream(url, cancel_token=self.cancel_token)
+
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise agknow_http.HttpError("GET {0} failed: {1}".format(base_url, type(e).__name__))
+
+        try:
+            if resp.status_code != 200:
+                print(resp.status_code)
+                print(resp.text)
+                raise agknow_http.HttpError("GET {0} failed: HTTP {1}".format(base_url, resp.status_code))
+
+            if self.cancel_token is not None:
+                chunks = self.cancel_token.iter_content(resp)
+            else:
+                chunks = resp.iter_content(agknow_http.STREAM_CHUNK_SIZE)
+
+            writer = agknow_vsimem.VsimemWriter()
+
+            try:
+                for chunk in chunks:
+                    writer.write(chunk)
+
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                writer.abort()
+                raise agknow_http.HttpError("GET {0} failed: {1}".format(base_url, type(e).__name__))
+
+            except BaseException:
+                writer.abort()
+                raise
+
+            return writer.close()
+
+        finally:
+            resp.close()
+
+    def remote_raster_path(self, base_url, api_key, parcel_id, product_id, data_source, raster_id, img_format="tif"):
+        """
+         Returns the GDAL path to read a GeoTIFF raster remotely through /vsicurl/ (GDAL fetches only the byte ranges
+         it needs) if the agknow host supports range requests.
+
+         Note that the URL contains the API key; it is stored in a QGIS project which references the layer.
+
+        :return: GDAL path (string) or None if the raster is no GeoTIFF or the host does not support range requests
+        """
+        if img_format != "tif" and product_id != "reflectances":
+            return None
+
+        url = base_url + self.raster_params(api_key, parcel_id, product_id, data_source, raster_id, img_format)
+
+        if not self.supports_range_requests(base_url, url):
+            return None
+
+        # no directory listing and no probing of sidecar files on the API
+        return "/vsicurl?list_dir=no&empty_dir=yes&url={0}".format(urllib.parse.quote(url, safe=""))
+
+    def supports_range_requests(self, base_url, url):
+        """
+         Checks (once per host) if the raster endpoint supports range requests: HEAD with "Accept-Ranges: bytes"
+         or a 206 response to a request of the first byte.
+
+        :param base_url: URL of the agknow API (key of the check)
+        :param url: URL of a raster image
+
+        :return: boolean
+        """
+        with _range_support_lock:
+            supported = _range_support.get(base_url)
+
+        if supported is not None:
+            return supported
+
+        supported = False
+        try:
+            resp = self.session.head(url, cancel_token=self.cancel_token)
+
+            if resp.status_code == 200 and resp.headers.get("Accept-Ranges", "").lower() == "bytes":
+                supported = True
+            else:
+                # a server which ignores the range would send the whole image: don't read the body
+                resp = self.session.stream(url, cancel_token=self.cancel_token, headers={"Range": "bytes=0-0"})
+                try:
+                    supported = resp.status_code == 206
+                finally:
+                    resp.close()
+
+        except (requests.ConnectionError, requests.Timeout):
+            # no decision: check again next time
+            return False
+
+        with _range_support_lock:
+            _range_support[base_url] = supported
+
+        return supported
+
+    def raster_params(self, api_key, parcel_id, product_id, data_source, raster_id, img_format="png"):
+        """
+         Returns the URL path and parameters of a raster image; see get_raster().
+        """
+        if product_id == "reflectances": # always tif
+            img_format = "tif"
+
+        return "/parcels/{0}/{1}/{2}/{3}.{4}?key={5}".format(parcel_id, product_id, data_source, raster_id, img_format,
+                                                             api_key)
+
     def get_raster_bbox(self, base_url, api_key, parcel_id, product_id):
         """
         Get the bounding box of the image from the API for the given URL, API key, parcel id and product (e.g. vitality).
         Because all rasters of a parcel have the same bbox we simply take the bbox data from the first object.
+        The bbox is cached per parcel and product, so the API is only requested once.
 
         :param base_url: URL for the HTTP GET request
         :param api_key: API key for agknow
@@ -262,14 +792,40 @@ class AgknowUtils(object):
 
         :return: BoundingBox object as nested list (e.g. [[45.3434434, 10.64546464],[45.364434, 10.614546464]]
         """
+        bbox = self.cached_raster_bbox(base_url, parcel_id, product_id)
+
+        if bbox is not None:
+            return bbox
+
         params = "/parcels/{0}/{1}/?key={2}".format(parcel_id, product_id, api_key)
 
         result = json.loads(self.sync_http_get(base_url, params))
 
         bbox = result["content"][0]["bounds"] # take the bbox from the first raster
 
+        self.cache_raster_bbox(base_url, parcel_id, product_id, bbox)
+
         return bbox
 
+    def cached_raster_bbox(self, base_url, parcel_id, product_id):
+        """
+         Returns the cached bounding box of the rasters of the given parcel and product or None.
+        """
+        with self._bbox_cache_lock:
+            return self._bbox_cache.get((base_url, parcel_id, product_id))
+
+    def cache_raster_bbox(self, base_url, parcel_id, product_id, bbox):
+        """
+         Stores the bounding box of the rasters of the given parcel and product for later calls of get_raster_bbox().
+
+        :param base_url: URL of the agknow API
+        :param parcel_id: parcel id
+        :param product_id: product (e.g. "vitality"|"visible"|"variations")
+        :param bbox: BoundingBox object as nested list (e.g. [[45.3434434, 10.64546464],[45.364434, 10.614546464]]
+        """
+        with self._bbox_cache_lock:
+            self._bbox_cache[(base_url, parcel_id, product_id)] = bbox
+
     def get_gdal_metadata(self, gdal_dataset):
         """
          Gets GDAL metadata from the given GDAL dataset.
@@ -333,24 +889,37 @@ class AgknowUtils(object):
         # important! otherwise the projection is not set!
         gdal_dataset.FlushCache()
 
-    def transform_raster(self, gdal_dataset, dst_epsg_code):
+    def transform_raster(self, gdal_dataset, dst_epsg_code, vrt=False):
         """
          Transforms the given GDAL dataset in memory to the SRS of the given EPSG code.
 
         :param gdal_dataset: GDAL dataset
         :param dst_epsg_code: destination EPSG Code
+        :param vrt: if True, the result is a warped VRT which references the pixels of the given dataset instead of
+                    a copy of them; the source must stay available as long as the VRT is used. Default is False.
 
         :return: The memory map string of the transformed GDAL dataset.
         """
+        if vrt:
+            mmap_name = "/vsimem/{0}.vrt".format(uuid4().hex)
 
-        mmap_name = "/vsimem/{0}".format(uuid4().hex)
+            out_dataset = gdal.Warp(mmap_name, gdal_dataset, format="VRT", dstSRS='EPSG:{0}'.format(dst_epsg_code))
+        else:
+            mmap_name = "/vsimem/{0}".format(uuid4().hex)
+
+            out_dataset = gdal.Warp(mmap_name, gdal_dataset, dstSRS='EPSG:{0}'.format(dst_epsg_code))
 
-        gdal.Warp(mmap_name, gdal_dataset, dstSRS='EPSG:{0}'.format(dst_epsg_code))
+        # close the dataset to flush it to the memory map
+        out_dataset = None
+
+        # the VRT takes over the reference of its source buffer
+        agknow_vsimem.get_registry().register(mmap_name, sources=[gdal_dataset.GetDescription()] if vrt else None)
 
         return mmap_name
 
 
-    def download_image(self, api_key, base_url, parcel_id, product_id, raster_id, source, img_format, epsg):
+    def download_image(self, api_key, base_url, parcel_id, product_id, raster_id, source, img_format, epsg,
+                       bounds=None):
         """
          Downloads, georeferences and transforms (if necessary) the raster image from the API with the given parameters.
 
@@ -362,34 +931,104 @@ class AgknowUtils(object):
         :param source:
         :param img_format:
         :param epsg:
+        :param bounds: bbox of the raster as nested list (the "bounds" of the raster list); optional, if not given
+                       the bbox is taken from the cache or requested from the API
 
         :return: The memory map string of the transformed GDAL dataset.
         """
-        img = self.get_raster(base_url, api_key, parcel_id, product_id, source, raster_id, img_format=img_format)
+        img = self.stream_raster(base_url, api_key, parcel_id, product_id, source, raster_id, img_format=img_format)
 
-        mmap_name = "/vsimem/{0}".format(uuid4().hex)
+        # PNG has to be referenced, Geotiff has the projection info already
+        if img_format == 'png' and bounds is None:
+            bounds = self.get_raster_bbox(base_url, api_key, parcel_id, product_id)
 
-        gdal.FileFromMemBuffer(mmap_name, img)
-        dataset = gdal.Open(mmap_name)
+        mmap_name = self.decode_image(img, img_format, bbox=bounds)
 
-        #print("original raster: {0}".format(mmap_name))
+        return self.warp_image(mmap_name, img_format, epsg)
 
-        NDV, xsize, ysize, GeoT, Projection, DataType = self.get_gdal_metadata(dataset)
+    def decode_image(self, img, img_format, bbox=None):
+        """
+         Writes the downloaded raster image to a GDAL memory map and georeferences it if it is a PNG.
+         First processing stage after get_raster().
+
+        :param img: binary representation of the raster image (bytes) or the GDAL path of the raster image
+                    (string); a /vsimem file of stream_raster() (its reference is taken over) or a /vsicurl/ path
+                    of remote_raster_path()
+        :param img_format: image format ("png"|"tif")
+        :param bbox: Bounding Box in the format [[45.3434434, 10.64546464],[45.364434, 10.614546464]];
+                     required for PNG
+
+        :return: The memory map string of the (georeferenced) GDAL dataset; registered in the /vsimem registry
+                 with one reference owned by the caller.
+        """
+        vsimem = agknow_vsimem.get_registry()
 
-        #print(NDV, xsize, ysize, GeoT, Projection, DataType)
+        if isinstance(img, str):
+            # streamed already (no copy) or remote
+            mmap_name = img
+        else:
+            mmap_name = "/vsimem/{0}".format(uuid4().hex)
 
-        # PNG has to be referenced, Geotiff has the projection info already
-        if img_format == 'png':
+            gdal.FileFromMemBuffer(mmap_name, img)
 
-            bbox = self.get_raster_bbox(base_url, api_key, parcel_id, product_id)
+            vsimem.register(mmap_name)
 
-            # original is WGS84 (because of bbox)
-            self.georeference_raster(dataset, bbox, xsize, ysize, epsg_code=4326)
+        try:
+            dataset = gdal.Open(mmap_name)
+
+            if dataset is None:
+                raise IOError("GDAL cannot open the raster image")
+
+            #print("original raster: {0}".format(mmap_name))
+
+            NDV, xsize, ysize, GeoT, Projection, DataType = self.get_gdal_metadata(dataset)
+
+            #print(NDV, xsize, ysize, GeoT, Projection, DataType)
+
+            # PNG has to be referenced, Geotiff has the projection info already
+            if img_format == 'png':
+                # original is WGS84 (because of bbox)
+                self.georeference_raster(dataset, bbox, xsize, ysize, epsg_code=4326)
+
+            # close the dataset
+            dataset = None
+
+        except Exception:
+            dataset = None
+            # don't leak the buffer of an image which could not be decoded
+            vsimem.release(mmap_name)
+            raise
+
+        # the georeferencing of a PNG has been written to its .aux.xml
+        vsimem.refresh(mmap_name)
 
-            #reproject raster
-            # TODO only if EPSG codes differ!
-            mmap_name = self.transform_raster(dataset, dst_epsg_code=epsg)
-            #print("transformed raster: {0}".format(mmap_name))
+        return mmap_name
+
+    def warp_image(self, mmap_name, img_format, epsg):
+        """
+         Transforms the decoded raster image to the SRS of the given EPSG code if necessary.
+         Second processing stage after decode_image().
+
+         PNGs are georeferenced in EPSG 4326, so they are returned as they are for a project in EPSG 4326.
+         Otherwise a warped VRT on top of the decoded raster is returned, so no second in-memory copy of the
+         pixels is made. The VRT takes over the reference of the decoded buffer in the /vsimem registry.
+
+        :param mmap_name: memory map string of the decoded GDAL dataset
+        :param img_format: image format ("png"|"tif")
+        :param epsg: destination EPSG Code
+
+        :return: The memory map string of the transformed GDAL dataset.
+        """
+        # original is WGS84 (because of bbox)
+        if img_format == 'png' and int(epsg) != 4326:
+            try:
+                #reproject raster
+                mmap_name = self.transform_raster(gdal.Open(mmap_name), dst_epsg_code=epsg, vrt=True)
+                #print("transformed raster: {0}".format(mmap_name))
+
+            except Exception:
+                agknow_vsimem.get_registry().release(mmap_name)
+                raise
 
         return mmap_name
 
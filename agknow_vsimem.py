@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AgknowVsimem
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from __future__ import print_function
+
+from builtins import object
+import threading
+import time
+from uuid import uuid4
+
+from osgeo import gdal
+
+# default budget of the in-memory rasters; above it layers are spilled to disk
+DEFAULT_BUDGET_BYTES = 1024 * 1024 * 1024
+
+# sidecar files GDAL may write next to an in-memory raster (e.g. the georeferencing of a PNG)
+SIDECAR_SUFFIXES = [".aux.xml"]
+
+# size of the chunks in which files are streamed into and out of /vsimem
+CHUNK_SIZE = 1024 * 1024
+
+
+class VsimemRegistry(object):
+    """
+     Keeps track of the GDAL /vsimem buffers of the plugin and unlinks them when they are not used anymore.
+
+     Every buffer has a reference count. The creator of a buffer owns the first reference; a buffer which is built
+     on top of other buffers (e.g. a warped VRT on top of the decoded raster) takes over the references of its
+     sources, so releasing the VRT releases the decoded raster as well. A raster layer of the TOC owns the
+     reference of its buffer once it is bound with bind_layer() and releases it when the layer is removed; an
+     image without layer (single layer mode of the timeslider) is bound under an id of its own.
+    """
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        """
+         Constructor
+
+        :param budget_bytes: budget of the in-memory rasters in bytes (integer)
+        """
+        self.budget_bytes = budget_bytes
+
+        self.spilled = 0
+
+        self._lock = threading.RLock()
+
+        # {mmap_name: {"refs": 1, "sources": [..], "size": 123, "ctime": 1234.5}}
+        self._buffers = {}
+        # {layer id: mmap_name}
+        self._layers = {}
+
+    def register(self, mmap_name, sources=None):
+        """
+         Registers a new buffer with one reference owned by the caller.
+
+        :param mmap_name: memory map string (e.g. "/vsimem/...")
+        :param sources: memory map strings the buffer is built on; their references are taken over (list)
+        """
+        if not mmap_name.startswith("/vsimem/"):
+            return
+
+        with self._lock:
+            if mmap_name in self._buffers:
+                self._buffers[mmap_name]["refs"] += 1
+                return
+
+            self._buffers[mmap_name] = {"refs": 1,
+                                        "sources": [s for s in (sources or []) if s in self._buffers],
+                                        "size": self._file_size(mmap_name),
+                                        "ctime": time.time()}
+
+    def refresh(self, mmap_name):
+        """
+         Updates the size of the given buffer after it has been written (e.g. after georeferencing).
+
+        :param mmap_name: memory map string
+        """
+        with self._lock:
+            buf = self._buffers.get(mmap_name)
+
+            if buf is not None:
+                buf["size"] = self._file_size(mmap_name)
+
+    def acquire(self, mmap_name):
+        """
+         Adds a reference to the given buffer.
+
+        :param mmap_name: memory map string
+
+        :return: True if the buffer is registered
+        """
+        with self._lock:
+            buf = self._buffers.get(mmap_name)
+
+            if buf is None:
+                return False
+
+            buf["refs"] += 1
+
+            return True
+
+    def release(self, mmap_name):
+        """
+         Removes a reference from the given buffer and unlinks it (and its sources) if it was the last one.
+
+        :param mmap_name: memory map string; unknown names (e.g. paths on disk) are ignored
+        """
+        with self._lock:
+            buf = self._buffers.get(mmap_name)
+
+            if buf is None:
+                return
+
+            buf["refs"] -= 1
+
+            if buf["refs"] > 0:
+                return
+
+            del self._buffers[mmap_name]
+
+            self._unlink(mmap_name)
+
+            for source in buf["sources"]:
+                self.release(source)
+
+    def bind_layer(self, layer_id, mmap_name):
+        """
+         Hands the caller's reference of the given buffer over to the given layer.
+
+        :param layer_id: id of the QgsMapLayer or of an image without layer (string)
+        :param mmap_name: memory map string of the layer's data source
+        """
+        with self._lock:
+            if mmap_name not in self._buffers:
+                return
+
+            old_name = self._layers.get(layer_id)
+            self._layers[layer_id] = mmap_name
+
+            if old_name is not None:
+                self.release(old_name)
+
+    def release_layer(self, layer_id, spilled=False):
+        """
+         Releases the buffer of the given layer (on removal or if its data source has been moved to disk).
+
+        :param layer_id: id of the QgsMapLayer (string)
+        :param spilled: True if the data source of the layer has been moved to disk because of the budget
+        """
+        with self._lock:
+            mmap_name = self._layers.pop(layer_id, None)
+
+            if mmap_name is not None:
+                self.release(mmap_name)
+
+                if spilled:
+                    self.spilled += 1
+
+    def release_layers(self, layer_ids):
+        """
+         Releases the buffers of the given layers; slot for QgsProject.layersRemoved.
+
+        :param layer_ids: ids of the QgsMapLayers (list of strings)
+        """
+        for layer_id in layer_ids:
+            self.release_layer(layer_id)
+
+    def layer_buffer(self, layer_id):
+        """
+         Returns the memory map string of the given layer or None if the layer has no buffer.
+        """
+        with self._lock:
+            return self._layers.get(layer_id)
+
+    def set_budget(self, budget_bytes):
+        """
+         Sets the budget of the in-memory rasters in bytes (integer).
+        """
+        with self._lock:
+            self.budget_bytes = budget_bytes
+
+    def size(self):
+        """
+         Returns the size of all registered buffers in bytes.
+        """
+        with self._lock:
+            return self._size()
+
+    def over_budget(self):
+        """
+         Checks if the registered buffers exceed the budget.
+
+        :return: boolean
+        """
+        with self._lock:
+            return self._size() > self.budget_bytes
+
+    def spill_candidates(self):
+        """
+         Returns the layers whose buffers should be moved to disk to get below the budget, oldest first.
+
+        :return: list of tuples (layer id, memory map string)
+        """
+        with self._lock:
+            size = self._size()
+
+            if size <= self.budget_bytes:
+                return []
+
+            candidates = []
+            for layer_id, mmap_name in sorted(self._layers.items(), key=lambda item: self._buffers[item[1]]["ctime"]):
+                if size <= self.budget_bytes:
+                    break
+
+                candidates.append((layer_id, mmap_name))
+                size -= self._total_size(mmap_name)
+
+            return candidates
+
+    def report(self):
+        """
+         Returns the memory report of the in-memory rasters.
+
+        :return: dict with the keys buffers, layers, bytes, budget and spilled
+        """
+        with self._lock:
+            return {"buffers": len(self._buffers),
+                    "layers": len(self._layers),
+                    "bytes": self._size(),
+                    "budget": self.budget_bytes,
+                    "spilled": self.spilled}
+
+    def clear(self):
+        """
+         Unlinks all registered buffers regardless of their references.
+        """
+        with self._lock:
+            for mmap_name in list(self._buffers.keys()):
+                self._unlink(mmap_name)
+
+            self._buffers = {}
+            self._layers = {}
+
+    def _size(self):
+        return sum(buf["size"] for buf in self._buffers.values())
+
+    def _total_size(self, mmap_name):
+        """
+         Returns the size of the given buffer including its sources.
+        """
+        buf = self._buffers.get(mmap_name)
+
+        if buf is None:
+            return 0
+
+        return buf["size"] + sum(self._total_size(s) for s in buf["sources"])
+
+    def _file_size(self, mmap_name):
+        size = 0
+
+        for path in [mmap_name] + [mmap_name + suffix for suffix in SIDECAR_SUFFIXES]:
+            stat = gdal.VSIStatL(path)
+
+            if stat is not None:
+                size += stat.size
+
+        return size
+
+    def _unlink(self, mmap_name):
+        for path in [mmap_name] + [mmap_name + suffix for suffix in SIDECAR_SUFFIXES]:
+            if gdal.VSIStatL(path) is not None:
+                gdal.Unlink(path)
+
+
+class VsimemWriter(object):
+    """
+     Writes a new /vsimem file chunk by chunk (e.g. a streamed download), so the complete file never exists as
+     Python object. The file is registered in the registry when it is closed.
+    """
+    def __init__(self, mmap_name=None):
+        """
+         Constructor
+
+        :param mmap_name: memory map string of the new file; a unique name by default
+        """
+        self.mmap_name = mmap_name if mmap_name is not None else "/vsimem/{0}".format(uuid4().hex)
+        self.size = 0
+
+        self._fp = gdal.VSIFOpenL(self.mmap_name, "wb")
+
+        if self._fp is None:
+            raise IOError("Cannot create {0}".format(self.mmap_name))
+
+    def write(self, chunk):
+        """
+         Appends the given chunk (bytes) to the file.
+        """
+        if len(chunk) == 0:
+            return
+
+        if gdal.VSIFWriteL(chunk, 1, len(chunk), self._fp) != len(chunk):
+            raise IOError("Cannot write to {0}".format(self.mmap_name))
+
+        self.size += len(chunk)
+
+    def reset(self):
+        """
+         Discards the data written so far (e.g. before a download is retried).
+        """
+        gdal.VSIFCloseL(self._fp)
+
+        self._fp = gdal.VSIFOpenL(self.mmap_name, "wb")
+        self.size = 0
+
+    def close(self):
+        """
+         Closes the file and registers it with one reference owned by the caller.
+
+        :return: memory map string
+        """
+        gdal.VSIFCloseL(self._fp)
+        self._fp = None
+
+        get_registry().register(self.mmap_name)
+
+        return self.mmap_name
+
+    def abort(self):
+        """
+         Closes and removes the unfinished file.
+        """
+        if self._fp is not None:
+            gdal.VSIFCloseL(self._fp)
+            self._fp = None
+
+        gdal.Unlink(self.mmap_name)
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    """
+     Reads a GDAL (virtual) file chunk by chunk.
+
+    :param path: path of the file (e.g. "/vsimem/...")
+    :param chunk_size: size of the chunks in bytes (integer)
+
+    :return: generator of bytes
+    """
+    fp = gdal.VSIFOpenL(path, "rb")
+
+    if fp is None:
+        raise IOError("Cannot open {0}".format(path))
+
+    try:
+        while True:
+            chunk = gdal.VSIFReadL(1, chunk_size, fp)
+
+            if not chunk:
+                break
+
+            yield chunk
+
+    finally:
+        gdal.VSIFCloseL(fp)
+
+
+def load_file(f, chunk_size=CHUNK_SIZE):
+    """
+     Copies the given open (binary) file into a new /vsimem file chunk by chunk.
+
+    :param f: file object
+    :param chunk_size: size of the chunks in bytes (integer)
+
+    :return: memory map string; registered with one reference owned by the caller
+    """
+    writer = VsimemWriter()
+
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+
+            if not chunk:
+                break
+
+            writer.write(chunk)
+
+    except BaseException:
+        writer.abort()
+        raise
+
+    return writer.close()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+     Returns the /vsimem registry shared by all components of the plugin.
+
+    :return: VsimemRegistry
+    """
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = VsimemRegistry()
+
+        return _registry
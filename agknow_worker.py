@@ -28,8 +28,67 @@ from qgis.PyQt.QtCore import pyqtSlot, pyqtSignal
 from qgis.core import QgsGeometry, QgsMessageLog, Qgis
 
 import requests, json
+import asyncio
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from . import agknow_utils
+from . import agknow_async
+from . import agknow_http
+from . import agknow_vsimem
+from . import agknow_prefetch
+from .agknow_http import Cancelled
+from .agknow_raster_cache import RasterCache
+
+# number of concurrent HTTP requests of a worker job
+DEFAULT_MAX_WORKERS = 8
+# number of threads for decoding and warping of images
+DEFAULT_PROCESS_WORKERS = os.cpu_count() or 2
+
+
+def chain_future(future, executor, fn, discard=None):
+    """
+     Runs fn with the result of the given future in the given executor as soon as the future is done.
+     Exceptions are passed through to the returned future; a cancelled future fails it with Cancelled.
+
+    :param future: concurrent.futures.Future
+    :param executor: concurrent.futures.Executor for fn
+    :param fn: callable with one argument (the result of future)
+    :param discard: callable with one argument which cleans up the result of future if fn cannot be run anymore
+                    (optional)
+
+    :return: future with the result of fn (concurrent.futures.Future)
+    """
+    chained = Future()
+
+    def copy_result(f):
+        if f.cancelled():
+            chained.set_exception(Cancelled())
+        elif f.exception() is not None:
+            chained.set_exception(f.exception())
+        else:
+            chained.set_result(f.result())
+
+    def submit(f):
+        # e.g. a coroutine of the event loop which has been stopped: f.exception() would raise CancelledError here
+        if f.cancelled():
+            chained.set_exception(Cancelled())
+            return
+
+        if f.exception() is not None:
+            chained.set_exception(f.exception())
+            return
+
+        try:
+            executor.submit(fn, f.result()).add_done_callback(copy_result)
+        except RuntimeError as e: # executor is already shut down
+            if discard is not None:
+                discard(f.result())
+            chained.set_exception(e)
+
+    future.add_done_callback(submit)
+
+    return chained
 
 # Multithreading for GUI responsiveness
 # Adopted from
@@ -43,6 +102,10 @@ class Worker(QtCore.QObject):
     error = QtCore.pyqtSignal(str)
     # return type is any Python Object
     finished = QtCore.pyqtSignal(object)
+    # intermediate results of long running jobs (any Python Object)
+    partial = QtCore.pyqtSignal(object)
+    # the job has been cancelled; neither finished nor error are emitted then
+    cancelled = QtCore.pyqtSignal()
 
     def __init__(self, **kwargs):
         """
@@ -58,6 +121,10 @@ class Worker(QtCore.QObject):
 
         self.utils = agknow_utils.AgknowUtils(self.api_version)
 
+        # checked between the requests and the pipeline stages of the job; aborts the in-flight requests
+        self.cancel_token = agknow_http.CancelToken()
+        self.utils.cancel_token = self.cancel_token
+
         self.processed = 0
         self.percentage = 0
         self.abort = False
@@ -67,6 +134,16 @@ class Worker(QtCore.QObject):
 
         self.initial_project_epsg = 4326
 
+        self.max_workers = DEFAULT_MAX_WORKERS
+        self.process_workers = DEFAULT_PROCESS_WORKERS
+
+        # persistent raster cache (RasterCache) - optional
+        self.raster_cache = None
+
+        self.parcelLyr = None
+        self.page_size = agknow_utils.DEFAULT_PAGE_SIZE
+        self.chunk_size = agknow_utils.DEFAULT_CHUNK_SIZE
+
         # input data to be filled
         if "base_url" in kwargs:
             self.base_url = kwargs["base_url"]
@@ -82,6 +159,14 @@ class Worker(QtCore.QObject):
             self.api_key = kwargs["api_key"]
         if "project_epsg" in kwargs:
             self.initial_project_epsg = int(kwargs["project_epsg"])
+        if "page_size" in kwargs:
+            self.page_size = int(kwargs["page_size"])
+        if "chunk_size" in kwargs:
+            self.chunk_size = int(kwargs["chunk_size"])
+        if "max_workers" in kwargs:
+            self.max_workers = max(int(kwargs["max_workers"]), 1)
+        if "process_workers" in kwargs:
+            self.process_workers = max(int(kwargs["process_workers"]), 1)
 
         # for image download
         if "parcel_id" in kwargs:
@@ -92,6 +177,12 @@ class Worker(QtCore.QObject):
             self.data_source = kwargs["data_source"]
         if "img_format" in kwargs:
             self.img_format = kwargs["img_format"]
+        if "raster_cache" in kwargs:
+            self.raster_cache = kwargs["raster_cache"]
+
+        # persistent cache of the JSON responses (MetadataCache) - optional
+        if "metadata_cache" in kwargs:
+            self.utils.metadata_cache = kwargs["metadata_cache"]
 
         # for register feature
         if "feature_to_register" in kwargs:
@@ -99,6 +190,80 @@ class Worker(QtCore.QObject):
         if "geometry_epsg" in kwargs:
             self.geometry_epsg = kwargs["geometry_epsg"]
 
+        # for image export: list of tuples (memory map string or path, output path)
+        if "exports" in kwargs:
+            self.exports = kwargs["exports"]
+
+        # for incremental refresh: {raster_group_id: ids of the rasters which are loaded already}
+        self.known_raster_ids = kwargs.get("known_raster_ids", {})
+
+        # for prefetching: bandwidth limit in KB/s and threading.Event which is set while no foreground job runs
+        self.prefetch_max_kbps = kwargs.get("prefetch_max_kbps", agknow_prefetch.DEFAULT_PREFETCH_MAX_KBPS)
+        self.foreground_idle = kwargs.get("foreground_idle")
+
+        # transfer of the raster images (see agknow_utils.TRANSFER_*)
+        self.raster_transfer = kwargs.get("raster_transfer", agknow_utils.DEFAULT_RASTER_TRANSFER)
+
+        # requests in thread pools (blocking) or as coroutines on the shared event loop; see agknow_async
+        self.engine = kwargs.get("engine", agknow_async.DEFAULT_ENGINE)
+        self._async_client = None
+
+    @property
+    def async_client(self):
+        """
+         Returns the asynchronous API client of the job (engine "asyncio").
+
+        :return: agknow_async.AgknowAsyncClient
+        """
+        if self._async_client is None:
+            self._async_client = agknow_async.AgknowAsyncClient(self.utils, ssl_verify=self.ssl_verify,
+                                                                cancel_token=self.cancel_token)
+        return self._async_client
+
+    def run_async(self, coro):
+        """
+         Runs the given coroutine on the shared event loop; it is cancelled with the job.
+
+        :return: concurrent.futures.Future with the result of the coroutine
+        """
+        return agknow_async.get_event_loop_thread().submit(coro, self.cancel_token)
+
+    def submit_request(self, executor, method_name, *args, **kwargs):
+        """
+         Starts a request of the agknow API with the engine of the job: the method of AgknowUtils in the given
+         thread pool or the coroutine of AgknowAsyncClient (same name and arguments) on the shared event loop.
+         The request pauses while the agknow host is unavailable; see call_when_healthy().
+
+        :param executor: concurrent.futures.Executor for the engine "threads"
+        :param method_name: name of the API method (e.g. "get_raster_list")
+
+        :return: concurrent.futures.Future with the result of the method
+        """
+        if self.engine == agknow_async.ENGINE_ASYNCIO:
+            client = self.async_client
+
+            return self.run_async(client.call_when_healthy(getattr(client, method_name), *args,
+                                                           on_pause=self.report_pause, **kwargs))
+
+        return executor.submit(self.call_when_healthy, getattr(self.utils, method_name), *args, **kwargs)
+
+    def cancel(self):
+        """
+         Cancels the job: no further requests are sent, in-flight requests are aborted and the pipeline stages
+         which have not been started yet are skipped. Thread safe.
+        """
+        self.abort = True
+        self.cancel_token.cancel()
+
+    def emit_cancelled(self):
+        """
+         Reports the cancellation of the job.
+        """
+        QgsMessageLog.logMessage("AgknowWorker - job cancelled.", "agknow", Qgis.Info)
+
+        self.status.emit("Cancelled!")
+        self.cancelled.emit()
+
     @pyqtSlot()
     def http_get(self):
         """Performs a HTTP GET request with the given base_url and optional URL parameters. Honors also a global boolean
@@ -110,7 +275,7 @@ class Worker(QtCore.QObject):
 
         try:
             # timeout 10 seconds
-            resp = requests.get(url, verify=self.ssl_verify, timeout=10.0)
+            resp = self.utils.session.get(url, verify=self.ssl_verify, timeout=10.0, cancel_token=self.cancel_token)
 
             if resp.status_code == 200:
 
@@ -123,6 +288,9 @@ class Worker(QtCore.QObject):
 
             self.status.emit('GET Request processed!')
 
+        except Cancelled:
+            self.emit_cancelled()
+
         except requests.ConnectionError as e:
             import traceback
             self.error.emit(traceback.format_exc())
@@ -138,45 +306,144 @@ class Worker(QtCore.QObject):
             self.finished.emit(None)
 
     @pyqtSlot()
-    def get_parcels_detail_data(self):
+    def get_parcel_pages(self):
         """
-         Gets parcel's base data like attributes and geometry, transform them to the desired SRS and add them to the
-         parcel layer. Also it emits the status and percentage of completion.
+         Gets the list of parcels page by page and emits every page (result dictionary of the API) with the
+         partial signal as soon as it is available, so the first parcels can be used after one round trip.
 
-         All data is fetched from the instance of the class.
+         If parcelLyr is given (all-at-once mode), the detail data of the parcels of every page is fetched and added
+         to the parcel layer as well; the lists of added parcel ids and names are emitted with the page
+         in the key "details".
 
+         The finished signal carries {"count": number of parcels} or None on error. The edit session of the parcel
+         layer is ended in any case; the parcels of the pages which have been delivered already are kept.
         """
-        self.status.emit("Getting all parcels base data..")
+        try:
+            self.status.emit("Getting parcels..")
+
+            if self.parcelLyr is not None:
+                self.parcelLyr.startEditing()
+
+            submit = None
+            if self.engine == agknow_async.ENGINE_ASYNCIO:
+                def submit(offset):
+                    return self.submit_request(None, "get_parcel_page", self.base_url, self.api_key, self.page_size,
+                                               offset)
+
+            count = 0
+            for page in self.utils.iter_parcel_pages(self.base_url, self.api_key, self.page_size, self.max_workers,
+                                                     submit=submit):
+
+                self.cancel_token.check()
+
+                content = page.get("content")
+
+                if isinstance(content, list):
+                    count += len(content)
+
+                    if self.parcelLyr is not None and len(content) > 0:
+                        page["details"] = self.add_parcels_detail_data([item["parcel_id"] for item in content],
+                                                                       progress=False)
+
+                self.status.emit("Getting parcels: {0} loaded..".format(count))
+
+                self.partial.emit(page)
 
-        self.feature_count = len(self.parcel_ids)
+            self.end_parcel_editing()
 
-        self.parcelLyr.startEditing()
+            self.log_connection_stats()
 
-        parcel_ids = []
+            self.finished.emit({"count": count})
+
+            self.status.emit("Done!")
+
+        except Cancelled:
+            self.end_parcel_editing()
+
+            self.emit_cancelled()
+
+        except Exception as e:
+            # e.g. a failed page or CircuitOpen: the layer must not stay in edit mode
+            self.end_parcel_editing()
+
+            import traceback
+            self.error.emit(traceback.format_exc())
+            # don't return exceptions? QGIS crashed
+            #self.error.emit(e)
+            self.finished.emit(None)
+
+    def end_parcel_editing(self):
+        """
+         Commits the features which have been added to the parcel layer so far and ends its edit session.
+        """
+        if self.parcelLyr is None or not self.parcelLyr.isEditable():
+            return
+
+        try:
+            self.parcelLyr.commitChanges()
+
+        except Exception as e:
+            QgsMessageLog.logMessage("AgknowWorker - Saving the parcels failed!\n{0}".format(e), "agknow",
+                                     Qgis.Warning)
+
+        if self.parcelLyr.isEditable():
+            # commit failed (e.g. layer errors): drop the edit buffer instead of leaving the layer in edit mode
+            self.parcelLyr.rollBack()
+
+    def add_parcels_detail_data(self, parcel_ids, progress=True):
+        """
+         Fetches the detail data of the given parcels concurrently with at most max_workers requests in flight,
+         transforms the geometries to the desired SRS and adds them to the parcel layer in the order of parcel_ids.
+
+         Raises Cancelled if the job is cancelled; the features of the pending chunk are dropped then.
+
+        :param parcel_ids: list of parcel ids
+        :param progress: emit the percentage of completion (boolean); default is True
+
+        :return: tuple of the list of added parcel ids and the list of added parcel ids and names
+        """
+        added_parcel_ids = []
         parcel_ids_names = []
-        for parcel_id in self.parcel_ids:
 
-            try:
-                attributes, geom_wkt = self.utils.get_parcel_detail_data(self.base_url, self.api_key, parcel_id)
+        batch = self.utils.feature_batch(self.parcelLyr, added_parcel_ids, parcel_ids_names, self.chunk_size)
 
-                geom = QgsGeometry.fromWkt(geom_wkt)
+        # fetch the detail data concurrently with at most max_workers requests in flight,
+        # but add the features and emit the progress in the order of parcel_ids
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [self.submit_request(executor, "get_parcel_detail_data", self.base_url, self.api_key, parcel_id)
+                       for parcel_id in parcel_ids]
 
-                tgeom = self.utils.transform_geom(geom, src_epsg_code=4326, dst_epsg_code=self.initial_project_epsg)
+            for future in futures:
 
-                self.utils.add_feature(tgeom, attributes, self.parcelLyr, parcel_ids, parcel_ids_names)
+                try:
+                    self.cancel_token.check()
 
-                self.calculate_progress()
+                    attributes, geom_wkt = future.result()
 
-            except:
-                import traceback
-                self.error.emit(traceback.format_exc())
-                self.finished.emit(None)
+                    geom = QgsGeometry.fromWkt(geom_wkt)
+
+                    tgeom = self.utils.transform_geom(geom, src_epsg_code=4326, dst_epsg_code=self.initial_project_epsg)
 
-        self.parcelLyr.commitChanges()
+                    batch.add(tgeom, attributes)
+
+                    if progress:
+                        self.calculate_progress()
 
-        self.finished.emit([parcel_ids, parcel_ids_names])
+                except (Cancelled, agknow_http.CircuitOpen):
+                    # the requests which have not been sent yet fail right away
+                    for f in futures:
+                        f.cancel()
+                    raise
 
-        self.status.emit("Done!")
+                # a single failed parcel must not abort the whole job
+                except:
+                    import traceback
+                    QgsMessageLog.logMessage("AgknowWorker - Download of parcel detail data failed!\n{0}".format(
+                                             traceback.format_exc()), "agknow", Qgis.Warning)
+
+        batch.commit()
+
+        return added_parcel_ids, parcel_ids_names
 
     @pyqtSlot()
     def get_images(self):
@@ -184,71 +451,225 @@ class Worker(QtCore.QObject):
          Gets parcel's image data, transform them to the desired SRS add them to the
          TOC. Also it emits the status and percentage of completion.
 
+         The images are processed in a pipeline: the download stage runs with at most max_workers requests in flight,
+         the decode/georeference and the warp stage run in a pool of process_workers threads. The rasters of every
+         parcel are emitted with the partial signal as soon as they are ready (in the order of the parcel ids);
+         the finished signal carries an empty dict then.
+
+         For the raster groups in known_raster_ids (incremental refresh) only the rasters which are not loaded yet
+         are downloaded; the emitted raster list is the complete list of the server, in which the known rasters have
+         no "mmap_name". The rasters which have been removed on the server are dropped from the raster cache.
+
+         If the job is cancelled, the rasters which have not been emitted yet are released and the cancelled signal
+         is emitted instead of the finished signal.
+
          All data is fetched from the instance of the class.
         """
+        # [(raster_group_id, rasters, [future per raster])]
+        jobs = []
+        delivered = 0
 
         try:
             QgsMessageLog.logMessage("AgknowWorker - Downloading images..", "agknow", Qgis.Info)
 
-            self.feature_count = len(self.parcel_ids)
+            self.status.emit("Downloading raster lists of {0} parcels..".format(len(self.parcel_ids)))
 
-            result = {}
-            counter = 0
+            with ThreadPoolExecutor(max_workers=self.max_workers) as download_pool, \
+                    ThreadPoolExecutor(max_workers=self.process_workers) as process_pool:
+                try:
+                    # the lists of a refresh are always revalidated with the server
+                    list_futures = [self.submit_request(download_pool, "get_raster_list", self.base_url,
+                                                        self.api_key, parcel_id, self.product_id, self.data_source,
+                                                        revalidate=self.raster_group_id(parcel_id) in
+                                                        self.known_raster_ids)
+                                    for parcel_id in self.parcel_ids]
 
-            for parcel_id in self.parcel_ids:
+                    # submit all rasters to the pipeline; the downloads start while the other lists are still
+                    # loading
+                    for parcel_id, list_future in zip(self.parcel_ids, list_futures):
 
-                self.status.emit("Downloading images: {0}/{1} parcels ready".format(counter, len(self.parcel_ids)))
+                        raster_group_id = self.raster_group_id(parcel_id)
 
-                # unique ID for parcel, product, data_source and img_format
-                raster_group_id = "{0}_{1}_{2}_{3}".format(parcel_id, self.product_id, self.data_source, self.img_format)
+                        try:
+                            rasters = list_future.result()
 
-                rasters = self.utils.get_raster_list(self.base_url, self.api_key, parcel_id, self.product_id,
-                                                     self.data_source)
+                        except (Cancelled, agknow_http.CircuitOpen):
+                            raise
 
-                # show progress for all images for this parcel
-                self.feature_count = len(rasters)
+                        # a single failed raster list must not abort the whole job
+                        except Exception as e:
+                            QgsMessageLog.logMessage("AgknowWorker - Download of the raster list of parcel {0} "
+                                                     "failed!\n{1}".format(parcel_id, e), "agknow", Qgis.Warning)
+                            continue
 
-                failed_rasters = []
+                        self.cancel_token.check()
 
-                for r in rasters:
+                        known = set(self.known_raster_ids.get(raster_group_id, []))
 
-                    raster_id = r["raster_id"]
+                        if len(known) > 0:
+                            self.drop_cached_rasters(parcel_id, known - set(r["raster_id"] for r in rasters))
 
-                    #print("raster_id {0}".format(r["raster_id"]))
-                    date = r["date"]
+                        # no future for the rasters which are loaded already
+                        futures = [None if r["raster_id"] in known else
+                                   self.submit_image_pipeline(download_pool, process_pool, parcel_id, r)
+                                   for r in rasters]
 
-                    try:
-                        mmap_name = self.utils.download_image(self.api_key, self.base_url, parcel_id, self.product_id,
-                                                        raster_id, self.data_source, self.img_format, epsg=self.initial_project_epsg)
+                        jobs.append((raster_group_id, rasters, futures))
 
-                        # add a new key to the dict with the memory map name of the downloaded raster
-                        r["mmap_name"] = mmap_name
+                    # show progress for all images of all parcels
+                    self.feature_count = max(sum(len([f for f in futures if f is not None])
+                                                 for _, _, futures in jobs), 1)
 
-                        # show progress for all images for this parcel
-                        self.calculate_progress()
+                    for counter, (raster_group_id, rasters, futures) in enumerate(jobs):
+
+                        self.status.emit("Downloading images: {0}/{1} parcels ready".format(counter, len(jobs)))
+
+                        failed_rasters = []
+
+                        for r, future in zip(rasters, futures):
+
+                            if future is None:
+                                continue
+
+                            try:
+                                # add a new key to the dict with the memory map name of the downloaded raster
+                                r["mmap_name"] = future.result()
+
+                            # the host did not come back: stop the other downloads instead of failing them one by
+                            # one (see below)
+                            except (Cancelled, agknow_http.CircuitOpen):
+                                raise
+
+                            # maybe image is corrupt or the scene has not the required bands for the index
+                            except Exception as e:
+                                QgsMessageLog.logMessage("AgknowWorker - Download of image {0} failed!".format(
+                                                         r["raster_id"]), "agknow", Qgis.Warning)
+                                QgsMessageLog.logMessage("AgknowWorker\n - {0}".format(e), "agknow", Qgis.Warning)
+
+                                # remove failed from raster list!
+                                failed_rasters.append(r)
+
+                            self.calculate_progress()
+
+                        for fr in failed_rasters:
+                            rasters.remove(fr)
+
+                        self.cancel_token.check()
+
+                        # deliver the rasters of this parcel right away
+                        self.partial.emit({raster_group_id: rasters})
+                        delivered += 1
+
+                except Exception:
+                    # stop the queued requests of all parcels first; otherwise leaving the pools waits for them
+                    self.cancel_token.cancel()
+                    raise
+
+            self.log_connection_stats()
+
+            if self.raster_cache is not None:
+                self.raster_cache.flush()
+                self.log_raster_cache_stats()
 
-                    # maybe image is corrupt or the scene has not the required bands for the index
+            # all rasters have been delivered with the partial signal already
+            self.finished.emit({})
+
+        except Cancelled:
+            # the pools have been shut down, so every stage has finished or has been skipped
+            self.discard_images(jobs[delivered:])
+
+            if self.raster_cache is not None:
+                self.raster_cache.flush()
+
+            self.emit_cancelled()
+
+        except agknow_http.CircuitOpen as e:
+            self.discard_images(jobs[delivered:])
+
+            if self.raster_cache is not None:
+                self.raster_cache.flush()
+
+            self.error.emit(str(e))
+            self.finished.emit(None)
+
+        except Exception as e:
+            self.discard_images(jobs[delivered:])
+
+            if self.raster_cache is not None:
+                self.raster_cache.flush()
+
+            import traceback
+            self.error.emit(traceback.format_exc())
+            # don't return exceptions? QGIS crashed
+            #self.error.emit(e)
+            self.finished.emit(None)
+
+    @pyqtSlot()
+    def prefetch_parcels(self):
+        """
+         Warms the detail data cache and the raster cache for the given parcels in the background, so selecting
+         one of them later needs no detail request and no image download.
+
+         At most max_workers requests are in flight; every request waits until no foreground job runs and the
+         images are streamed at no more than prefetch_max_kbps. The finished signal carries the number of parcels
+         and of newly cached images or None on error.
+        """
+        detail_cache = agknow_prefetch.get_detail_cache()
+        limiter = agknow_prefetch.BandwidthLimiter(int(self.prefetch_max_kbps) * 1024)
+
+        self.feature_count = max(len(self.parcel_ids), 1)
+
+        images = 0
+        try:
+            self.status.emit("Prefetching {0} parcels..".format(len(self.parcel_ids)))
+
+            # nearest parcels first
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self.prefetch_parcel, parcel_id, detail_cache, limiter)
+                           for parcel_id in self.parcel_ids]
+
+                for parcel_id, future in zip(self.parcel_ids, futures):
+
+                    try:
+                        images += future.result()
+
+                    except Cancelled:
+                        for f in futures:
+                            f.cancel()
+                        raise
+
+                    except agknow_http.CircuitOpen as e:
+                        # prefetching does not wait for an unavailable host
+                        for f in futures:
+                            f.cancel()
+                        QgsMessageLog.logMessage("AgknowWorker - Prefetching stopped: {0}".format(e), "agknow",
+                                                 Qgis.Warning)
+                        break
+
+                    # prefetching is best effort
                     except Exception as e:
-                        QgsMessageLog.logMessage("AgknowWorker - Download of image {0} failed!".format(raster_id), "agknow", Qgis.Warning)
-                        QgsMessageLog.logMessage("AgknowWorker\n - {0}".format(e.message), "agknow", Qgis.Warning)
-                        #print("Download of image {0} failed!".format(raster_id))
-                        #print(e.message)
+                        QgsMessageLog.logMessage("AgknowWorker - Prefetching of parcel {0} failed: {1}".format(
+                                                 parcel_id, e), "agknow", Qgis.Warning)
+
+                    self.calculate_progress()
 
-                        # remove failed from raster list!
-                        failed_rasters.append(r)
+            QgsMessageLog.logMessage("AgknowWorker - prefetched {0} parcels, {1} images.".format(
+                                     len(self.parcel_ids), images), "agknow", Qgis.Info)
 
-                result[raster_group_id] = rasters
-                counter += 1
+            if self.raster_cache is not None:
+                self.raster_cache.flush()
 
-                #self.calculate_progress()
+            self.finished.emit({"parcels": len(self.parcel_ids), "images": images})
 
-                for fr in failed_rasters:
-                    rasters.remove(fr)
+        except Cancelled:
+            if self.raster_cache is not None:
+                self.raster_cache.flush()
 
-            # dict with all rasters per parcel_id
-            self.finished.emit(result) #rasters))
+            self.emit_cancelled()
 
         except Exception as e:
+            if self.raster_cache is not None:
+                self.raster_cache.flush()
 
             import traceback
             self.error.emit(traceback.format_exc())
@@ -256,6 +677,332 @@ class Worker(QtCore.QObject):
             #self.error.emit(e)
             self.finished.emit(None)
 
+    def prefetch_parcel(self, parcel_id, detail_cache, limiter):
+        """
+         Fetches the detail data and the images of the given parcel into the caches.
+
+        :param parcel_id: parcel id
+        :param detail_cache: agknow_prefetch.DetailCache
+        :param limiter: agknow_prefetch.BandwidthLimiter for the image downloads
+
+        :return: number of newly cached images
+        """
+        key = agknow_prefetch.DetailCache.make_key(self.base_url, self.api_key, parcel_id)
+
+        if not detail_cache.contains(key):
+            self.wait_for_foreground()
+            detail_cache.put(key, self.utils.get_parcel_detail_data(self.base_url, self.api_key, parcel_id))
+
+        if self.raster_cache is None:
+            return 0
+
+        self.wait_for_foreground()
+        rasters = self.utils.get_raster_list(self.base_url, self.api_key, parcel_id, self.product_id,
+                                             self.data_source)
+
+        images = 0
+        for r in rasters:
+            key = self.raster_cache_key(parcel_id, r["raster_id"])
+
+            if self.raster_cache.contains(key):
+                continue
+
+            self.wait_for_foreground()
+
+            # the bandwidth is limited while the image is received, not only after it has arrived as a whole
+            img = self.utils.stream_raster(self.base_url, self.api_key, parcel_id, self.product_id, self.data_source,
+                                           r["raster_id"], img_format=self.img_format,
+                                           on_chunk=lambda chunk: limiter.consume(len(chunk), self.cancel_token))
+
+            try:
+                bbox = r.get("bounds")
+                if self.img_format == "png" and bbox is None:
+                    bbox = self.utils.get_raster_bbox(self.base_url, self.api_key, parcel_id, self.product_id)
+            except BaseException:
+                self.release_raster(img)
+                raise
+
+            # only valid images (which could be decoded) go into the cache; takes over the reference of img
+            try:
+                mmap_name = self.utils.decode_image(img, self.img_format, bbox=bbox)
+
+            except Exception:
+                continue
+
+            try:
+                self.cache_raster(key, mmap_name)
+            finally:
+                agknow_vsimem.get_registry().release(mmap_name)
+
+            images += 1
+
+        return images
+
+    def call_when_healthy(self, fn, *args, **kwargs):
+        """
+         Calls fn with the given arguments. While the circuit breaker of the agknow host is open, the job pauses
+         without sending requests and calls fn again as soon as the host may be probed. Thread safe.
+
+         Raises Cancelled if the job is cancelled meanwhile and agknow_http.CircuitOpen if the host is still
+         unavailable after the maximum pause of the session.
+
+        :param fn: callable which requests the agknow API
+
+        :return: result of fn
+        """
+        while True:
+            try:
+                return fn(*args, **kwargs)
+
+            except agknow_http.CircuitOpen as e:
+                self.report_pause(e)
+
+                if not self.utils.session.wait_for_host(self.base_url, self.cancel_token):
+                    raise
+
+                self.status.emit("agknow host available again - resuming..")
+
+    def report_pause(self, error):
+        """
+         Reports that the job pauses because the agknow host is unavailable.
+
+        :param error: agknow_http.CircuitOpen
+        """
+        self.status.emit("agknow host unavailable - paused, next try in {0:.0f} s..".format(error.retry_in))
+
+        QgsMessageLog.logMessage("AgknowWorker - {0}; pausing.".format(error), "agknow", Qgis.Warning)
+
+    def wait_for_foreground(self):
+        """
+         Waits until no foreground job runs (background jobs yield to the jobs the user is waiting for).
+         Raises Cancelled if the job is cancelled meanwhile.
+        """
+        if self.foreground_idle is not None:
+            while not self.foreground_idle.wait(0.2):
+                self.cancel_token.check()
+
+        self.cancel_token.check()
+
+    def fetch_raster(self, parcel_id, raster_id):
+        """
+         Downloads the given raster with the transfer mode of the job (see agknow_utils.TRANSFER_*).
+
+        :return: image data (bytes) for "memory", otherwise the GDAL path of the raster image (a /vsimem file with
+                 one reference owned by the caller or a /vsicurl/ path)
+        """
+        if self.raster_transfer == agknow_utils.TRANSFER_MEMORY:
+            return self.utils.get_raster(self.base_url, self.api_key, parcel_id, self.product_id, self.data_source,
+                                         raster_id, img_format=self.img_format)
+
+        if self.raster_transfer == agknow_utils.TRANSFER_VSICURL:
+            path = self.remote_raster_path(parcel_id, raster_id)
+
+            if path is not None:
+                return path
+
+        return self.utils.stream_raster(self.base_url, self.api_key, parcel_id, self.product_id, self.data_source,
+                                        raster_id, img_format=self.img_format)
+
+    def remote_raster_path(self, parcel_id, raster_id):
+        """
+         Returns the /vsicurl/ path of the given raster or None; see AgknowUtils.remote_raster_path().
+        """
+        return self.utils.remote_raster_path(self.base_url, self.api_key, parcel_id, self.product_id,
+                                             self.data_source, raster_id, img_format=self.img_format)
+
+    def load_cached_raster(self, key):
+        """
+         Loads the given raster from the raster cache: as bytes for the transfer mode "memory", otherwise streamed
+         into a new /vsimem file.
+
+        :param key: cache key of RasterCache.make_key()
+
+        :return: image data (bytes), memory map string (with one reference owned by the caller) or None if the
+                 raster is not cached
+        """
+        if self.raster_cache is None:
+            return None
+
+        if self.raster_transfer == agknow_utils.TRANSFER_MEMORY:
+            return self.raster_cache.get(key)
+
+        f = self.raster_cache.open(key)
+
+        if f is None:
+            return None
+
+        with f:
+            return agknow_vsimem.load_file(f)
+
+    def cache_raster(self, key, img):
+        """
+         Stores the given downloaded raster in the raster cache; remote (/vsicurl/) rasters are not cached.
+         A failing cache does not fail the raster.
+
+        :param key: cache key of RasterCache.make_key()
+        :param img: image data (bytes) or memory map string
+        """
+        try:
+            if isinstance(img, str):
+                if img.startswith("/vsimem/"):
+                    self.raster_cache.put_stream(key, agknow_vsimem.iter_file(img))
+            else:
+                self.raster_cache.put(key, img)
+
+        except (IOError, OSError) as e:
+            QgsMessageLog.logMessage("AgknowWorker - Caching of raster failed: {0}".format(e), "agknow", Qgis.Warning)
+
+    def release_raster(self, img):
+        """
+         Releases the /vsimem file of a downloaded raster which is not decoded (bytes and remote paths are ignored).
+        """
+        if isinstance(img, str):
+            agknow_vsimem.get_registry().release(img)
+
+    def discard_images(self, jobs):
+        """
+         Releases the in-memory rasters of the given pipeline jobs which have not been delivered.
+
+        :param jobs: list of tuples (raster_group_id, rasters, [future per raster])
+        """
+        vsimem = agknow_vsimem.get_registry()
+
+        for _, _, futures in jobs:
+            for future in futures:
+                if future is None:
+                    continue
+
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    vsimem.release(future.result())
+
+    def raster_group_id(self, parcel_id):
+        """
+         Returns the unique ID for parcel, product, data_source and img_format of the given parcel.
+        """
+        return "{0}_{1}_{2}_{3}".format(parcel_id, self.product_id, self.data_source, self.img_format)
+
+    def drop_cached_rasters(self, parcel_id, raster_ids):
+        """
+         Removes the given rasters (which have been removed on the server) from the raster cache.
+
+        :param parcel_id: parcel id
+        :param raster_ids: raster ids (iterable)
+        """
+        if self.raster_cache is None:
+            return
+
+        for raster_id in raster_ids:
+            self.raster_cache.remove(self.raster_cache_key(parcel_id, raster_id))
+
+    def submit_image_pipeline(self, download_pool, process_pool, parcel_id, raster):
+        """
+         Submits the download, decode/georeference and warp stage for the given raster.
+         Every stage checks the cancel token first; the decoded raster of a cancelled job is released.
+         With the engine "asyncio" the download stage is a coroutine on the shared event loop.
+
+        :param download_pool: executor for the download stage (concurrent.futures.Executor)
+        :param process_pool: executor for the decode and warp stage (concurrent.futures.Executor)
+        :param parcel_id: parcel id
+        :param raster: raster information dict of the raster list
+
+        :return: future with the memory map string of the transformed GDAL dataset (concurrent.futures.Future)
+        """
+        key = self.raster_cache_key(parcel_id, raster["raster_id"])
+        vsimem = agknow_vsimem.get_registry()
+
+        def download(r):
+            self.cancel_token.check()
+
+            # consult the raster cache before any HTTP request
+            img = self.load_cached_raster(key)
+
+            cached = img is not None
+
+            if not cached:
+                img = self.call_when_healthy(self.fetch_raster, parcel_id, r["raster_id"])
+
+            try:
+                bbox = r.get("bounds")
+                # PNG has to be referenced, Geotiff has the projection info already
+                if self.img_format == "png" and bbox is None:
+                    bbox = self.call_when_healthy(self.utils.get_raster_bbox, self.base_url, self.api_key, parcel_id,
+                                                  self.product_id)
+            except BaseException:
+                self.release_raster(img)
+                raise
+
+            return img, bbox, cached
+
+        async def download_async(r):
+            self.cancel_token.check()
+
+            client = self.async_client
+            loop = asyncio.get_running_loop()
+
+            # the disk I/O of the raster cache stays off the event loop
+            img = await loop.run_in_executor(None, self.load_cached_raster, key)
+
+            cached = img is not None
+
+            if not cached and self.raster_transfer == agknow_utils.TRANSFER_VSICURL:
+                # the check for range requests is done once per host
+                img = await loop.run_in_executor(None, self.remote_raster_path, parcel_id, r["raster_id"])
+
+            if img is None:
+                if self.raster_transfer == agknow_utils.TRANSFER_MEMORY:
+                    fetch = client.get_raster
+                else:
+                    fetch = client.stream_raster
+
+                img = await client.call_when_healthy(fetch, self.base_url, self.api_key, parcel_id, self.product_id,
+                                                     self.data_source, r["raster_id"], img_format=self.img_format,
+                                                     on_pause=self.report_pause)
+
+            try:
+                bbox = r.get("bounds")
+                if self.img_format == "png" and bbox is None:
+                    bbox = await client.call_when_healthy(client.get_raster_bbox, self.base_url, self.api_key,
+                                                          parcel_id, self.product_id, on_pause=self.report_pause)
+            except BaseException:
+                self.release_raster(img)
+                raise
+
+            return img, bbox, cached
+
+        def decode(downloaded):
+            img, bbox, cached = downloaded
+
+            if self.cancel_token.is_cancelled():
+                self.release_raster(img)
+                raise Cancelled()
+
+            # takes over the reference of a streamed image
+            mmap_name = self.utils.decode_image(img, self.img_format, bbox=bbox)
+
+            # only valid images (which could be decoded) go into the cache
+            if self.raster_cache is not None and not cached:
+                self.cache_raster(key, img)
+
+            return mmap_name
+
+        def warp(mmap_name):
+            if self.cancel_token.is_cancelled():
+                vsimem.release(mmap_name)
+                raise Cancelled()
+
+            return self.utils.warp_image(mmap_name, self.img_format, self.initial_project_epsg)
+
+        if self.engine == agknow_async.ENGINE_ASYNCIO:
+            future = self.run_async(download_async(raster))
+        else:
+            future = download_pool.submit(download, raster)
+
+        future = chain_future(future, process_pool, decode,
+                              discard=lambda downloaded: self.release_raster(downloaded[0]))
+        future = chain_future(future, process_pool, warp, discard=vsimem.release)
+
+        return future
+
     @pyqtSlot()
     def register_feature(self):
         """
@@ -286,7 +1033,11 @@ class Worker(QtCore.QObject):
 
             self.status.emit(json.dumps(postdata))
 
-            result = self.utils.sync_http_post(self.base_url, self.params, json.dumps(postdata))
+            if self.engine == agknow_async.ENGINE_ASYNCIO:
+                result = self.run_async(self.async_client.register_parcel(self.base_url, self.params,
+                                                                          json.dumps(postdata))).result()
+            else:
+                result = self.utils.sync_http_post(self.base_url, self.params, json.dumps(postdata))
 
             self.finished.emit(result)
 
@@ -297,6 +1048,102 @@ class Worker(QtCore.QObject):
             # don't return exceptions? QGIS crashed
             #self.error.emit(e)
 
+    @pyqtSlot()
+    def export_images(self):
+        """
+         Exports the given rasters to disk and emits the list of tuples (source, output path, exported) with the
+         finished signal.
+        """
+        results = []
+
+        self.processed = 0
+        self.percentage = 0
+        self.feature_count = max(len(self.exports), 1)
+
+        for source, out_path in self.exports:
+            # the remaining rasters are reported as not exported, so their buffers are released
+            if self.cancel_token.is_cancelled():
+                results.append((source, out_path, False))
+                continue
+
+            try:
+                out_path_subdir = os.path.dirname(out_path)
+
+                if not os.path.exists(out_path_subdir):
+                    os.makedirs(out_path_subdir, exist_ok=True)
+
+                self.status.emit("Exporting to {0}..".format(out_path))
+                self.utils.exportGDALraster(source, out_path)
+
+                results.append((source, out_path, True))
+
+            except Exception as e:
+                import traceback
+                self.error.emit(traceback.format_exc())
+
+                results.append((source, out_path, False))
+
+            self.calculate_progress()
+
+        self.finished.emit(results)
+
+    def raster_cache_key(self, parcel_id, raster_id):
+        """
+         Returns the key of the given raster for the raster cache.
+
+        :param parcel_id: parcel id
+        :param raster_id: raster id
+
+        :return: cache key (tuple)
+        """
+        # reflectances are always tif - see AgknowUtils.get_raster()
+        if self.product_id == "reflectances":
+            img_format = "tif"
+        else:
+            img_format = self.img_format
+
+        host = self.base_url
+        if host.endswith(self.api_version):
+            host = host[:-len(self.api_version)]
+
+        return RasterCache.make_key(host, self.api_version, parcel_id, self.product_id, self.data_source, raster_id,
+                                    img_format)
+
+    def log_raster_cache_stats(self):
+        """
+         Logs the hits and misses of the raster cache.
+        """
+        stats = self.raster_cache.stats()
+
+        QgsMessageLog.logMessage("AgknowWorker - raster cache hits: {0}, misses: {1}, entries: {2}, "
+                                 "size: {3:.1f} MB".format(stats["hits"], stats["misses"], stats["entries"],
+                                                           stats["size"] / (1024.0 * 1024.0)),
+                                 "agknow", Qgis.Info)
+
+    def log_connection_stats(self):
+        """
+         Logs the number of reused and newly opened HTTP connections of the shared session.
+        """
+        stats = self.utils.session.connection_stats()
+
+        QgsMessageLog.logMessage("AgknowWorker - HTTP requests: {0}, connections reused: {1}, "
+                                 "newly opened: {2}, retries: {3}, throttled: {4}".format(
+                                     stats["requests"], stats["reused"], stats["opened"], stats["retries"],
+                                     stats["throttled"]),
+                                 "agknow", Qgis.Info)
+
+        for health in self.utils.session.host_health():
+            if health["opened"] > 0:
+                QgsMessageLog.logMessage("AgknowWorker - host {0}: circuit {1}, opened {2} times".format(
+                                         health["host"], health["state"], health["opened"]), "agknow", Qgis.Info)
+
+        if self.utils.metadata_cache is not None:
+            stats = self.utils.metadata_cache.stats()
+
+            QgsMessageLog.logMessage("AgknowWorker - metadata cache fresh: {0}, not modified: {1}, "
+                                     "downloaded: {2}".format(stats["fresh"], stats["revalidated"], stats["misses"]),
+                                     "agknow", Qgis.Info)
+
     @pyqtSlot()
     def calculate_progress(self):
         """
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Mock agknow API
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Local stand-in for the agknow REST API (v4) for benchmarks. Serves the parcel list, the parcel details,
+ the raster lists and synthetic PNG/GeoTIFF rasters with a configurable latency.
+
+ Run standalone with: python mock_api.py --port 8765
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import re
+import struct
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+API_VERSION = "/agknow/api/v4"
+
+PRODUCTS = ["visible", "vitality", "variations", "reflectances", "ndvi", "ndre1", "ndre2", "ndre3", "ndwi", "savi",
+            "evi2", "cire"]
+
+
+def make_png(width, height, seed=0):
+    """
+     Creates a synthetic RGBA PNG image (pure Python, no GDAL needed).
+
+    :param width: width in pixels
+    :param height: height in pixels
+    :param seed: varies the pixel values
+
+    :return: PNG image (bytes)
+    """
+    rows = []
+    for y in range(height):
+        row = bytearray([0]) # filter type none
+        for x in range(width):
+            row.extend(((x + seed) % 256, (y + seed) % 256, (x * y + seed) % 256, 255))
+        rows.append(bytes(row))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"".join(rows), 6)) +
+            chunk(b"IEND", b""))
+
+
+def make_geotiff(width, height, bbox, bands=1, seed=0):
+    """
+     Creates a synthetic Float32 GeoTIFF in EPSG 4326 with GDAL.
+
+    :param width: width in pixels
+    :param height: height in pixels
+    :param bbox: [[miny, minx], [maxy, maxx]]
+    :param bands: number of bands
+    :param seed: varies the pixel values
+
+    :return: GeoTIFF image (bytes)
+    """
+    from osgeo import gdal, osr
+    from uuid import uuid4
+
+    mmap_name = "/vsimem/{0}.tif".format(uuid4().hex)
+
+    dataset = gdal.GetDriverByName("GTiff").Create(mmap_name, width, height, bands, gdal.GDT_Float32,
+                                                   options=["COMPRESS=DEFLATE"])
+
+    (miny, minx), (maxy, maxx) = bbox
+    dataset.SetGeoTransform([minx, (maxx - minx) / width, 0, maxy, 0, -(maxy - miny) / height])
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    dataset.SetProjection(srs.ExportToWkt())
+
+    for b in range(bands):
+        band = dataset.GetRasterBand(b + 1)
+        band.Fill((seed % 100) / 100.0 + b)
+        band.SetNoDataValue(-9999)
+
+    dataset = None
+
+    f = gdal.VSIFOpenL(mmap_name, "rb")
+    gdal.VSIFSeekL(f, 0, 2)
+    size = gdal.VSIFTellL(f)
+    gdal.VSIFSeekL(f, 0, 0)
+    data = gdal.VSIFReadL(1, size, f)
+    gdal.VSIFCloseL(f)
+    gdal.Unlink(mmap_name)
+
+    return data
+
+
+class MockAgknowApi(object):
+    """
+     Data model and settings of the mock API.
+    """
+    def __init__(self, parcels=100, rasters_per_parcel=10, image_size=256, latency=0.0, report_count=True,
+                 api_key="benchmark"):
+        """
+         Constructor
+
+        :param parcels: number of parcels of the account
+        :param rasters_per_parcel: number of rasters per parcel, product and source
+        :param image_size: width and height of the rasters in pixels
+        :param latency: added latency per request in seconds
+        :param report_count: add the total number of parcels ("count") to the parcel list
+        :param api_key: valid API key
+        """
+        self.parcels = parcels
+        self.rasters_per_parcel = rasters_per_parcel
+        self.image_size = image_size
+        self.latency = latency
+        self.report_count = report_count
+        self.api_key = api_key
+
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._image_cache = {}
+
+    def parcel_id(self, index):
+        return 1000 + index
+
+    def bbox(self, parcel_id):
+        index = parcel_id - 1000
+        minx = 10.0 + (index % 100) * 0.01
+        miny = 50.0 + (index // 100) * 0.01
+
+        return [[miny, minx], [miny + 0.005, minx + 0.005]]
+
+    def parcel_list(self, limit, offset):
+        content = [{"parcel_id": self.parcel_id(i), "name": "parcel {0}".format(i)}
+                   for i in range(offset, min(offset + limit, self.parcels))]
+
+        result = {"content": content}
+        if self.report_count:
+            result["count"] = self.parcels
+
+        return result
+
+    def parcel_detail(self, parcel_id):
+        (miny, minx), (maxy, maxx) = self.bbox(parcel_id)
+        wkt = "POLYGON(({0} {1},{2} {1},{2} {3},{0} {3},{0} {1}))".format(minx, miny, maxx, maxy)
+
+        return {"content": {"parcel_id": parcel_id, "name": "parcel {0}".format(parcel_id - 1000),
+                            "entity": "benchmark", "crop": "wheat", "startdate": "2021-01-01",
+                            "enddate": "2021-12-31", "planting": "2021-03-01", "harvest": "2021-08-31",
+                            "area": 12345.6, "geometry": wkt, "centroid": ""}}
+
+    def raster_list(self, parcel_id, product, source):
+        content = []
+        for i in range(self.rasters_per_parcel):
+            raster_id = parcel_id * 1000 + i
+            date = "2021-{0:02d}-{1:02d}".format(1 + (i // 28) % 12, 1 + i % 28)
+
+            content.append({"product": product, "statistics": {}, "raster_id": raster_id, "parcel_id": parcel_id,
+                            "bounds": self.bbox(parcel_id), "source": source, "date": date,
+                            "png": "/parcels/{0}/{1}/{2}/{3}.png".format(parcel_id, product, source, raster_id)})
+
+        return {"content": content}
+
+    def raster(self, parcel_id, raster_id, img_format):
+        # all images of a format are the same size - build them once
+        with self._lock:
+            data = self._image_cache.get(img_format)
+
+            if data is None:
+                if img_format == "png":
+                    data = make_png(self.image_size, self.image_size)
+                else:
+                    data = make_geotiff(self.image_size, self.image_size, [[50.0, 10.0], [50.005, 10.005]])
+
+                self._image_cache[img_format] = data
+
+        return data
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+
+class MockAgknowHandler(BaseHTTPRequestHandler):
+    """
+     Request handler of the mock API; the MockAgknowApi instance is taken from the server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        api = self.server.api
+        api.count_request()
+
+        if api.latency > 0:
+            time.sleep(api.latency)
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path
+
+        if not path.startswith(API_VERSION):
+            return self.send_json(404, {"error": "not found"})
+
+        path = path[len(API_VERSION):]
+
+        if query.get("key", [""])[0] != api.api_key:
+            return self.send_json(200, {"content": "key is not authorized"})
+
+        m = re.match(r"^/parcels/?$", path)
+        if m:
+            limit = int(query.get("limit", ["1000"])[0])
+            offset = int(query.get("offset", ["0"])[0])
+            return self.send_json(200, api.parcel_list(limit, offset))
+
+        m = re.match(r"^/parcels/(\d+)/?$", path)
+        if m:
+            return self.send_json(200, api.parcel_detail(int(m.group(1))))
+
+        m = re.match(r"^/parcels/(\d+)/(\w+)/?$", path)
+        if m:
+            source = query.get("source", ["sentinel2"])[0] or "sentinel2"
+            return self.send_json(200, api.raster_list(int(m.group(1)), m.group(2), source))
+
+        m = re.match(r"^/parcels/(\d+)/(\w+)/(\w+)/(\d+)\.(png|tif)$", path)
+        if m:
+            img_format = m.group(5)
+            data = api.raster(int(m.group(1)), int(m.group(4)), img_format)
+            content_type = "image/png" if img_format == "png" else "image/tiff"
+            return self.send_bytes(200, data, content_type)
+
+        return self.send_json(404, {"error": "not found"})
+
+    def send_json(self, status, result):
+        self.send_bytes(status, json.dumps(result).encode("utf-8"), "application/json")
+
+    def send_bytes(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # quiet
+        pass
+
+
+def start_server(api, host="127.0.0.1", port=0):
+    """
+     Starts the mock API in a background thread.
+
+    :param api: MockAgknowApi
+    :param host: host to bind to
+    :param port: port to bind to; 0 takes a free port
+
+    :return: tuple of the server (call shutdown() to stop it) and the base URL including the API version
+    """
+    server = ThreadingHTTPServer((host, port), MockAgknowHandler)
+    server.daemon_threads = True
+    server.api = api
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = "http://{0}:{1}{2}".format(host, server.server_port, API_VERSION)
+
+    return server, base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the agknow REST API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--parcels", type=int, default=100)
+    parser.add_argument("--rasters", type=int, default=10, help="rasters per parcel, product and source")
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.0, help="latency per request in seconds")
+    parser.add_argument("--no-count", action="store_true", help="don't report the number of parcels")
+    args = parser.parse_args()
+
+    api = MockAgknowApi(parcels=args.parcels, rasters_per_parcel=args.rasters, image_size=args.image_size,
+                        latency=args.latency, report_count=not args.no_count)
+    server, base_url = start_server(api, port=args.port)
+
+    print("Mock agknow API running on {0} (API key: {1})".format(base_url, api.api_key))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
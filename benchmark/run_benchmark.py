@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ agknow benchmark
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Throughput benchmark of AgknowUtils and Worker against the local mock agknow API (mock_api.py).
+ Runs without the QGIS GUI (but needs the QGIS Python bindings and GDAL).
+
+ Usage: python benchmark/run_benchmark.py --parcels 200 --rasters 20 --latency 0.02 --format png
+"""
+from __future__ import print_function
+
+import argparse
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCHMARK_DIR)
+
+sys.path.insert(0, BENCHMARK_DIR)
+
+from mock_api import MockAgknowApi, start_server
+
+MODES = ["one-by-one", "all-at-once"]
+
+
+def load_plugin_module(name):
+    """
+     Imports a module of the plugin package (the plugin uses relative imports, so it is imported as package).
+
+    :param name: module name (e.g. "agknow_utils")
+
+    :return: module
+    """
+    sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+
+    return importlib.import_module("{0}.{1}".format(os.path.basename(PLUGIN_DIR), name))
+
+
+class LatencyRecorder(object):
+    """
+     Records the latency (time until the response headers arrived) of every HTTP request of a requests.Session.
+    """
+    def __init__(self, session):
+        self._lock = threading.Lock()
+        self.latencies = []
+
+        session.hooks["response"].append(self.record)
+
+    def record(self, resp, *args, **kwargs):
+        with self._lock:
+            self.latencies.append(resp.elapsed.total_seconds())
+
+    def percentile(self, p):
+        with self._lock:
+            values = sorted(self.latencies)
+
+        if len(values) == 0:
+            return 0.0
+
+        index = min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)
+
+        return values[index]
+
+
+def peak_memory_mb():
+    """
+     Returns the peak resident set size of this process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024.0)
+
+    return peak / 1024.0
+
+
+def create_parcel_layer(agknow_utils, epsg):
+    """
+     Creates the in-memory parcel layer like AgknowDockWidget.init_parcel_lyr() does (without the TOC).
+    """
+    from qgis.core import QgsVectorLayer
+
+    lyr = QgsVectorLayer("Polygon?crs=epsg:{0}".format(epsg), "parcels", "memory")
+    lyr.dataProvider().addAttributes(agknow_utils.parcel_fields())
+    lyr.updateFields()
+
+    return lyr
+
+
+def run_worker(worker, method):
+    """
+     Runs the given method of the worker synchronously and returns the finished result and the partial results.
+    """
+    results = {"finished": None, "partial": [], "errors": []}
+
+    def on_finished(ret):
+        results["finished"] = ret
+
+    worker.finished.connect(on_finished)
+    worker.partial.connect(results["partial"].append)
+    worker.error.connect(results["errors"].append)
+
+    getattr(worker, method)()
+
+    return results
+
+
+def run_mode(args, mode):
+    """
+     Runs the benchmark for the given parcel download mode against a fresh mock API.
+
+    :return: dict with the metrics
+    """
+    from qgis.core import QgsApplication, QgsGeometry
+
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+
+    agknow_utils = load_plugin_module("agknow_utils")
+    agknow_worker = load_plugin_module("agknow_worker")
+    agknow_http = load_plugin_module("agknow_http")
+
+    api = MockAgknowApi(parcels=args.parcels, rasters_per_parcel=args.rasters, image_size=args.image_size,
+                        latency=args.latency, report_count=not args.no_count)
+    server, base_url = start_server(api)
+
+    api_version = "/agknow/api/v4"
+    session = agknow_http.configure_session(pool_maxsize=args.max_workers)
+    latencies = LatencyRecorder(session.session)
+
+    utils = agknow_utils.AgknowUtils(api_version)
+    lyr = create_parcel_layer(agknow_utils, args.epsg)
+
+    kwargs = {"base_url": base_url, "api_key": api.api_key, "api_version": api_version,
+              "project_epsg": args.epsg, "max_workers": args.max_workers, "product_id": args.product,
+              "data_source": "sentinel2", "img_format": args.format}
+
+    images = 0
+    parcel_ids = []
+
+    start = time.time()
+
+    if mode == "one-by-one":
+        page = utils.get_parcel_page(base_url, api.api_key, args.parcels, 0)
+        parcels_time = 0.0
+        images_time = 0.0
+
+        for item in page["content"]:
+            # like AgknowDockWidget.update_parcel_data()
+            t = time.time()
+            attributes, geom_wkt = utils.get_parcel_detail_data(base_url, api.api_key, item["parcel_id"])
+            tgeom = utils.transform_geom(QgsGeometry.fromWkt(geom_wkt), src_epsg_code=4326, dst_epsg_code=args.epsg)
+            utils.add_feature(tgeom, attributes, lyr, parcel_ids)
+            parcels_time += time.time() - t
+
+            # like AgknowDockWidget.update_parcel_images() for the selected parcel
+            t = time.time()
+            results = run_worker(agknow_worker.Worker(parcel_ids=[item["parcel_id"]], **kwargs), "get_images")
+            images += sum(len(rasters) for p in results["partial"] for rasters in p.values())
+            images_time += time.time() - t
+
+    else:
+        t = time.time()
+        results = run_worker(agknow_worker.Worker(parcelLyr=lyr, **kwargs), "get_parcel_pages")
+        for page in results["partial"]:
+            parcel_ids.extend(page.get("details", ([], []))[0])
+        parcels_time = time.time() - t
+
+        t = time.time()
+        results = run_worker(agknow_worker.Worker(parcel_ids=list(parcel_ids), **kwargs), "get_images")
+        images = sum(len(rasters) for p in results["partial"] for rasters in p.values())
+        images_time = time.time() - t
+
+    total_time = time.time() - start
+
+    server.shutdown()
+
+    stats = session.connection_stats()
+
+    return {"mode": mode,
+            "parcels": len(parcel_ids),
+            "images": images,
+            "parcels_per_sec": len(parcel_ids) / parcels_time if parcels_time > 0 else 0.0,
+            "images_per_sec": images / images_time if images_time > 0 else 0.0,
+            "total_sec": total_time,
+            "requests": stats["requests"],
+            "connections_opened": stats["opened"],
+            "latency_p50_ms": latencies.percentile(50) * 1000.0,
+            "latency_p99_ms": latencies.percentile(99) * 1000.0,
+            "peak_memory_mb": peak_memory_mb()}
+
+
+def print_report(results):
+    """
+     Prints the metrics of all modes as table.
+    """
+    columns = [("mode", "{0:<12}"), ("parcels", "{0:>8}"), ("images", "{0:>8}"), ("parcels_per_sec", "{0:>10.1f}"),
+               ("images_per_sec", "{0:>10.1f}"), ("latency_p50_ms", "{0:>9.1f}"), ("latency_p99_ms", "{0:>9.1f}"),
+               ("peak_memory_mb", "{0:>9.1f}"), ("total_sec", "{0:>8.2f}")]
+    headers = ["mode", "parcels", "images", "parcels/s", "images/s", "p50 ms", "p99 ms", "peak MB", "total s"]
+
+    print(" ".join("{0:>{1}}".format(h, len(fmt.format(results[0][c]))) if i > 0 else "{0:<12}".format(h)
+                   for i, (h, (c, fmt)) in enumerate(zip(headers, columns))))
+
+    for r in results:
+        print(" ".join(fmt.format(r[c]) for c, fmt in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the agknow plugin against a mock API")
+    parser.add_argument("--mode", choices=MODES + ["all"], default="all")
+    parser.add_argument("--parcels", type=int, default=100)
+    parser.add_argument("--rasters", type=int, default=10, help="rasters per parcel")
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--format", choices=["png", "tif"], default="png")
+    parser.add_argument("--product", default="vitality")
+    parser.add_argument("--epsg", type=int, default=4326, help="EPSG code of the (simulated) project")
+    parser.add_argument("--latency", type=float, default=0.01, help="latency of the mock API per request in seconds")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--no-count", action="store_true", help="mock API does not report the number of parcels")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    if args.mode != "all":
+        results = [run_mode(args, args.mode)]
+
+    else:
+        # every mode in its own process, so the peak memory is measured per mode
+        results = []
+        for mode in MODES:
+            cmd = [sys.executable, os.path.abspath(__file__), "--json", "--mode", mode] + \
+                  [a for a in sys.argv[1:] if a not in ("--json", "--mode", "all")]
+            output = subprocess.check_output(cmd)
+            results.extend(json.loads(output.decode("utf-8").strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+ Unit tests of the modules of the agknow plugin which run without QGIS.
+
+ Run from the directory which contains the plugin directory, e.g.: python -m pytest agknow_qgis/test
+"""
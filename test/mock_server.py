@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ agknow test helpers
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Local HTTP server for the tests which answers with scripted responses.
+"""
+from __future__ import print_function
+
+from builtins import object
+import select
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import BaseRequestHandler, ThreadingMixIn, TCPServer
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _read_head(sock):
+    """
+     Reads a request head (up to the empty line) and its Content-Length body from the given socket.
+
+    :return: tuple of the request line and the header lines; None if the client closed the connection
+    """
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return None
+        data += chunk
+
+    head, _, body = data.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+
+    while len(body) < length:
+        body += sock.recv(4096)
+
+    return lines[0], lines[1:]
+
+
+class MockServer(object):
+    """
+     HTTP server on localhost which answers every request with the next scripted response; the last response is
+     repeated. Records the method and path of every request.
+    """
+    def __init__(self, responses):
+        """
+         Constructor
+
+        :param responses: list of tuples (status code, headers dict, body bytes)
+        """
+        self.responses = list(responses)
+        self.requests = []
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _answer(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > 0:
+                    self.rfile.read(length)
+
+                status, headers, body = server.next_response(self.command, self.path, dict(self.headers))
+
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            do_GET = do_POST = do_HEAD = _answer
+
+        self.httpd = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{0}".format(self.httpd.server_address[1])
+
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def next_response(self, method, path, headers):
+        with self._lock:
+            self.requests.append((method, path, headers))
+
+            if len(self.responses) > 1:
+                return self.responses.pop(0)
+
+            return self.responses[0]
+
+    def count(self, method=None):
+        """
+         Returns the number of received requests (of the given method).
+        """
+        with self._lock:
+            return len([r for r in self.requests if method is None or r[0] == method])
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class RawServer(object):
+    """
+     TCP server on localhost which answers every HTTP request with the next scripted raw response (e.g. chunked or
+     without Content-Length); the last response is repeated. Records the request lines and counts the connections.
+    """
+    def __init__(self, responses):
+        """
+         Constructor
+
+        :param responses: list of tuples (raw response bytes, close the connection afterwards (boolean))
+        """
+        self.responses = list(responses)
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseRequestHandler):
+
+            def handle(self):
+                with server._lock:
+                    server.connections += 1
+
+                while True:
+                    request = _read_head(self.request)
+                    if request is None:
+                        return
+
+                    with server._lock:
+                        server.requests.append(request[0])
+
+                        if len(server.responses) > 1:
+                            response, close = server.responses.pop(0)
+                        else:
+                            response, close = server.responses[0]
+
+                    self.request.sendall(response)
+
+                    if close:
+                        return
+
+        self.server = _ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{0}".format(self.server.server_address[1])
+
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TunnelProxy(object):
+    """
+     HTTP proxy on localhost which only supports CONNECT: it answers with the given status and pipes the bytes of an
+     accepted tunnel to the target. Records the CONNECT request lines and headers.
+    """
+    def __init__(self, status="200 Connection established"):
+        """
+         Constructor
+
+        :param status: status code and reason of the answer to CONNECT (string)
+        """
+        self.requests = []
+
+        proxy = self
+
+        class Handler(BaseRequestHandler):
+
+            def handle(self):
+                request = _read_head(self.request)
+                if request is None:
+                    return
+
+                proxy.requests.append(request)
+
+                self.request.sendall("HTTP/1.1 {0}\r\n\r\n".format(status).encode("latin-1"))
+
+                if not status.startswith("200"):
+                    return
+
+                host, _, port = request[0].split(" ")[1].rpartition(":")
+                target = socket.create_connection((host, int(port)))
+
+                try:
+                    sockets = [self.request, target]
+                    while True:
+                        readable, _, _ = select.select(sockets, [], [], 5)
+                        if not readable:
+                            return
+
+                        for sock in readable:
+                            data = sock.recv(65536)
+                            if not data:
+                                return
+                            (target if sock is self.request else self.request).sendall(data)
+                finally:
+                    target.close()
+
+        self.server = _ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{0}".format(self.server.server_address[1])
+
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ agknow tests
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Tests of the HTTP/1.1 protocol and the proxy support of the asynchronous HTTP client of agknow_async.
+"""
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+from .. import agknow_async
+from .. import agknow_http
+from .mock_server import MockServer, RawServer, TunnelProxy
+
+
+def make_client(**kwargs):
+    session = agknow_http.AgknowHttpSession(backoff=0.001, max_retries=4)
+    # no proxies of the environment of the test run
+    session.session.trust_env = kwargs.pop("trust_env", False)
+
+    return agknow_async.AsyncHttpClient(session=session, **kwargs)
+
+
+def response(body, headers=None, status="200 OK"):
+    lines = ["HTTP/1.1 {0}".format(status)] + ["{0}: {1}".format(k, v) for k, v in (headers or {}).items()]
+
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class _Sink(object):
+
+    def __init__(self):
+        self.chunks = []
+        self.resets = 0
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+
+    def reset(self):
+        self.resets += 1
+        self.chunks = []
+
+
+class ProtocolTest(unittest.TestCase):
+
+    def test_content_length_and_keep_alive(self):
+        server = MockServer([(200, {"Content-Type": "application/json; charset=utf-8"}, b'{"content": []}')])
+        client = make_client()
+
+        async def requests():
+            results = [await client.get(server.url + "/parcels/?key=k") for _ in range(3)]
+            await client.close()
+            return results
+
+        try:
+            results = run(requests())
+        finally:
+            server.close()
+
+        for resp in results:
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json(), {"content": []})
+
+        # one keep-alive connection for all requests
+        self.assertEqual(client.session.stats.as_dict()["opened"], 1)
+        self.assertEqual(server.requests[0][1], "/parcels/?key=k")
+
+    def test_chunked_body(self):
+        body = b"5\r\nhello\r\n1;ext=1\r\n \r\n5\r\nworld\r\n0\r\nX-Trailer: 1\r\n\r\n"
+        server = RawServer([(response(body, {"Transfer-Encoding": "chunked"}), False)])
+        client = make_client()
+
+        try:
+            resp = run(client.get(server.url + "/"))
+        finally:
+            server.close()
+
+        self.assertEqual(resp.content, b"hello world")
+
+    def test_body_until_close(self):
+        server = RawServer([(response(b"until the end", {"Connection": "close"}), True)])
+        client = make_client()
+
+        async def requests():
+            return [(await client.get(server.url + "/")).content for _ in range(2)]
+
+        try:
+            contents = run(requests())
+        finally:
+            server.close()
+
+        self.assertEqual(contents, [b"until the end"] * 2)
+        # the connection is not reused
+        self.assertEqual(server.connections, 2)
+
+    def test_stale_keep_alive_connection_is_replaced(self):
+        # the server closes the connection after the response although it announced keep-alive
+        server = RawServer([(response(b"ok", {"Content-Length": "2"}), True)])
+        client = make_client()
+
+        async def requests():
+            return [(await client.get(server.url + "/")).content for _ in range(3)]
+
+        try:
+            contents = run(requests())
+        finally:
+            server.close()
+
+        self.assertEqual(contents, [b"ok"] * 3)
+        self.assertEqual(server.connections, 3)
+        # no retries: the request is sent again on a new connection
+        self.assertEqual(client.session.stats.as_dict()["retries"], 0)
+
+    def test_invalid_status_line(self):
+        server = RawServer([(b"garbage\r\n\r\n", True)])
+        client = make_client()
+        client.session.retry_policy.max_retries = 0
+
+        try:
+            with self.assertRaises(agknow_async.HttpProtocolError):
+                run(client.get(server.url + "/"))
+        finally:
+            server.close()
+
+    def test_sink_receives_the_body_of_the_successful_attempt(self):
+        server = MockServer([(503, {}, b"down"), (200, {}, b"image")])
+        client = make_client()
+        sink = _Sink()
+
+        try:
+            resp = run(client.get(server.url + "/", sink=sink))
+        finally:
+            server.close()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b"")
+        self.assertEqual(b"".join(sink.chunks), b"image")
+        self.assertEqual(server.count("GET"), 2)
+
+    def test_post_body_and_no_retry(self):
+        server = MockServer([(503, {}, b"down"), (200, {}, b"ok")])
+        client = make_client()
+
+        try:
+            resp = run(client.post(server.url + "/parcels", '{"name": "a"}',
+                                   headers={"Content-type": "application/json"}))
+        finally:
+            server.close()
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(server.count("POST"), 1)
+        self.assertEqual(server.requests[0][2]["Content-Length"], "13")
+
+
+class ProxyTest(unittest.TestCase):
+
+    def test_http_through_the_proxy_of_the_session(self):
+        proxy = MockServer([(200, {}, b"via proxy")])
+        client = make_client()
+        client.session.session.proxies = {"http": proxy.url.replace("http://", "http://user:secret@")}
+
+        try:
+            resp = run(client.get("http://agknow.invalid/agknow/api/v4/parcels/?key=k"))
+        finally:
+            proxy.close()
+
+        self.assertEqual(resp.content, b"via proxy")
+
+        method, path, headers = proxy.requests[0]
+        self.assertEqual(path, "http://agknow.invalid/agknow/api/v4/parcels/?key=k")
+        self.assertEqual(headers["Host"], "agknow.invalid")
+        self.assertEqual(headers["Proxy-Authorization"], "Basic dXNlcjpzZWNyZXQ=")
+
+    def test_proxy_of_the_environment(self):
+        with mock.patch.dict(os.environ, {"http_proxy": "proxy.example:3128", "https_proxy": "",
+                                          "no_proxy": "internal.example"}):
+            client = make_client(trust_env=True)
+
+            self.assertEqual(client.proxy_for("http", "agknow.example"), "http://proxy.example:3128")
+            self.assertIsNone(client.proxy_for("http", "internal.example"))
+            self.assertIsNone(client.proxy_for("https", "agknow.example"))
+
+    def test_environment_is_ignored_without_trust_env(self):
+        with mock.patch.dict(os.environ, {"http_proxy": "http://proxy.example:3128"}):
+            self.assertIsNone(make_client().proxy_for("http", "agknow.example"))
+
+    def test_unsupported_proxy_scheme(self):
+        client = make_client()
+        client.session.session.proxies = {"https": "socks5://proxy.example:1080"}
+
+        with self.assertRaises(ValueError):
+            client.proxy_for("https", "agknow.example")
+
+    def test_connect_tunnel(self):
+        server = MockServer([(200, {}, b"through the tunnel")])
+        proxy = TunnelProxy()
+        client = make_client()
+
+        port = int(server.url.rsplit(":", 1)[1])
+
+        async def request():
+            # TLS is started on the tunnel for https; the tunnel itself is tested with plain HTTP here
+            reader, writer = await client._open_tunnel(proxy.url, "127.0.0.1", port, None)
+
+            writer.write(b"GET /x HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+            data = await reader.read()
+            writer.close()
+            return data
+
+        try:
+            data = run(request())
+        finally:
+            proxy.close()
+            server.close()
+
+        self.assertTrue(data.startswith(b"HTTP/1.1 200"))
+        self.assertTrue(data.endswith(b"through the tunnel"))
+        self.assertEqual(proxy.requests[0][0], "CONNECT 127.0.0.1:{0} HTTP/1.1".format(port))
+
+    def test_refused_tunnel(self):
+        proxy = TunnelProxy(status="407 Proxy Authentication Required")
+        client = make_client()
+
+        try:
+            with self.assertRaises(agknow_async.ProxyError):
+                run(client._open_tunnel(proxy.url, "agknow.invalid", 443, None))
+        finally:
+            proxy.close()
+
+
+class EventLoopThreadTest(unittest.TestCase):
+
+    def test_result(self):
+        loop_thread = agknow_async.EventLoopThread()
+
+        async def answer():
+            await asyncio.sleep(0)
+            return 42
+
+        try:
+            self.assertEqual(loop_thread.submit(answer()).result(timeout=5), 42)
+        finally:
+            loop_thread.stop()
+
+    def test_cancel_token_fails_the_future_with_cancelled(self):
+        loop_thread = agknow_async.EventLoopThread()
+        token = agknow_http.CancelToken()
+
+        try:
+            future = loop_thread.submit(asyncio.sleep(60), token)
+            token.cancel()
+
+            with self.assertRaises(agknow_http.Cancelled):
+                future.result(timeout=5)
+        finally:
+            loop_thread.stop()
+
+    def test_stop_fails_pending_futures_with_cancelled(self):
+        loop_thread = agknow_async.EventLoopThread()
+
+        futures = [loop_thread.submit(asyncio.sleep(60)),
+                   loop_thread.submit(agknow_async.sleep(60, agknow_http.CancelToken()))]
+
+        loop_thread.stop()
+
+        for future in futures:
+            # not cancelled: done callbacks (e.g. of chain_future) see the exception
+            self.assertFalse(future.cancelled())
+            self.assertIsInstance(future.exception(timeout=5), agknow_http.Cancelled)
+
+        self.assertFalse(loop_thread.is_running())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ agknow tests
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Tests of the retries, the rate limiting and the circuit breaker of agknow_http.
+"""
+import time
+import unittest
+from email.utils import formatdate
+
+from .. import agknow_http
+from .mock_server import MockServer
+
+
+def make_session(**kwargs):
+    kwargs.setdefault("backoff", 0.001)
+    kwargs.setdefault("max_retries", 4)
+
+    return agknow_http.AgknowHttpSession(**kwargs)
+
+
+class _Response(object):
+
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_backoff_is_bounded(self):
+        policy = agknow_http.RetryPolicy(backoff=1.0, max_backoff=3.0)
+
+        for attempt in range(6):
+            delay = policy.delay(attempt)
+            self.assertGreaterEqual(delay, 0.0)
+            self.assertLessEqual(delay, min(3.0, 2 ** attempt))
+
+    def test_retry_after_seconds(self):
+        policy = agknow_http.RetryPolicy(backoff=100.0, max_backoff=30.0)
+
+        self.assertEqual(policy.delay(0, _Response({"Retry-After": "2"})), 2.0)
+        # capped at max_backoff
+        self.assertEqual(policy.delay(0, _Response({"Retry-After": "120"})), 30.0)
+
+    def test_retry_after_date(self):
+        policy = agknow_http.RetryPolicy()
+
+        delay = policy.delay(0, _Response({"Retry-After": formatdate(time.time() + 10, usegmt=True)}))
+        self.assertGreater(delay, 8.0)
+        self.assertLessEqual(delay, 10.0)
+
+    def test_parse_retry_after(self):
+        self.assertIsNone(agknow_http.parse_retry_after(None))
+        self.assertIsNone(agknow_http.parse_retry_after("soon"))
+        self.assertEqual(agknow_http.parse_retry_after("-5"), 0.0)
+        self.assertEqual(agknow_http.parse_retry_after(formatdate(time.time() - 60, usegmt=True)), 0.0)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_unlimited(self):
+        limiter = agknow_http.RateLimiter(rate=0)
+
+        self.assertTrue(all(limiter.reserve() == 0 for _ in range(100)))
+
+    def test_burst_then_rate(self):
+        limiter = agknow_http.RateLimiter(rate=10, burst=2)
+
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertEqual(limiter.reserve(), 0)
+
+        wait = limiter.reserve()
+        self.assertGreater(wait, 0.05)
+        self.assertLessEqual(wait, 0.1)
+
+    def test_pause(self):
+        limiter = agknow_http.RateLimiter(rate=0)
+        limiter.pause(5.0)
+
+        self.assertGreater(limiter.reserve(), 4.0)
+
+    def test_acquire_cancelled(self):
+        limiter = agknow_http.RateLimiter(rate=0)
+        limiter.pause(5.0)
+
+        token = agknow_http.CancelToken()
+        token.cancel()
+
+        with self.assertRaises(agknow_http.Cancelled):
+            limiter.acquire(token)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = agknow_http.CircuitBreaker("host", threshold=2, reset_timeout=0.05, max_reset_timeout=0.1)
+
+    def open_breaker(self):
+        for _ in range(2):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.failure()
+
+    def test_opens_after_threshold(self):
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, agknow_http.CircuitBreaker.CLOSED)
+
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, agknow_http.CircuitBreaker.OPEN)
+
+        self.assertFalse(self.breaker.allow())
+        self.assertGreater(self.breaker.retry_in(), 0.0)
+
+    def test_success_resets_the_failures(self):
+        self.breaker.allow()
+        self.breaker.failure()
+        self.breaker.allow()
+        self.breaker.success()
+        self.breaker.allow()
+        self.breaker.failure()
+
+        self.assertEqual(self.breaker.state, agknow_http.CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_one_probe(self):
+        self.open_breaker()
+        time.sleep(0.06)
+
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, agknow_http.CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        # a released probe (e.g. cancelled) lets the next one through
+        self.breaker.release()
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, agknow_http.CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        time.sleep(0.06)
+
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+
+        self.assertEqual(self.breaker.state, agknow_http.CircuitBreaker.OPEN)
+        # the reset timeout has been doubled
+        self.assertGreater(self.breaker.retry_in(), 0.06)
+
+    def test_wait(self):
+        self.open_breaker()
+
+        self.assertFalse(self.breaker.wait(0.01))
+        self.assertTrue(self.breaker.wait(1.0))
+
+    def test_disabled(self):
+        breaker = agknow_http.CircuitBreaker("host", threshold=0)
+
+        for _ in range(10):
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+
+        self.assertEqual(breaker.state, agknow_http.CircuitBreaker.CLOSED)
+
+
+class SessionRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer([(200, {}, b"ok")])
+        self.session = make_session(breaker_threshold=0)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.close()
+
+    def test_get_retries_until_max_retries(self):
+        self.server.responses = [(503, {}, b"")]
+
+        resp = self.session.get(self.server.url + "/a")
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.server.count(), 5)
+        self.assertEqual(self.session.connection_stats()["retries"], 4)
+
+    def test_no_retries(self):
+        self.session.retry_policy.max_retries = 0
+        self.server.responses = [(503, {}, b"")]
+
+        self.session.get(self.server.url + "/a")
+
+        self.assertEqual(self.server.count(), 1)
+
+    def test_get_succeeds_after_retry(self):
+        self.server.responses = [(502, {}, b""), (200, {}, b"ok")]
+
+        resp = self.session.get(self.server.url + "/a")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.text, "ok")
+        self.assertEqual(self.server.count(), 2)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.responses = [(404, {}, b"")]
+
+        self.assertEqual(self.session.get(self.server.url + "/a").status_code, 404)
+        self.assertEqual(self.server.count(), 1)
+
+    def test_throttled_with_retry_after(self):
+        self.server.responses = [(429, {"Retry-After": "0"}, b""), (200, {}, b"ok")]
+
+        resp = self.session.get(self.server.url + "/a")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.session.connection_stats()["throttled"], 1)
+
+    def test_post_is_not_retried_on_server_errors(self):
+        self.server.responses = [(503, {}, b""), (200, {}, b"ok")]
+
+        resp = self.session.post(self.server.url + "/a", data="{}")
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.server.count("POST"), 1)
+
+    def test_post_is_retried_when_throttled(self):
+        self.server.responses = [(429, {"Retry-After": "0"}, b""), (200, {}, b"ok")]
+
+        resp = self.session.post(self.server.url + "/a", data="{}")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.server.count("POST"), 2)
+
+    def test_cancelled_request_is_not_sent(self):
+        token = agknow_http.CancelToken()
+        token.cancel()
+
+        with self.assertRaises(agknow_http.Cancelled):
+            self.session.get(self.server.url + "/a", cancel_token=token)
+
+        self.assertEqual(self.server.count(), 0)
+
+
+class SessionBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer([(503, {}, b"unavailable")])
+        self.session = make_session(breaker_threshold=2, breaker_reset=60.0)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.close()
+
+    def test_retried_request_counts_as_one_failure(self):
+        resp = self.session.get(self.server.url + "/a")
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.server.count(), 5)
+
+        breaker = self.session.breaker(self.server.url)
+        self.assertEqual(breaker.failures, 1)
+        self.assertEqual(breaker.state, agknow_http.CircuitBreaker.CLOSED)
+
+        # the next request is sent (and fails as well)
+        self.session.get(self.server.url + "/b")
+        self.assertEqual(self.server.count(), 10)
+        self.assertEqual(breaker.state, agknow_http.CircuitBreaker.OPEN)
+
+        with self.assertRaises(agknow_http.CircuitOpen):
+            self.session.get(self.server.url + "/c")
+
+        self.assertEqual(self.server.count(), 10)
+
+    def test_success_after_retry_closes(self):
+        self.server.responses = [(503, {}, b""), (503, {}, b""), (200, {}, b"ok")]
+
+        resp = self.session.get(self.server.url + "/a")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.session.breaker(self.server.url).failures, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
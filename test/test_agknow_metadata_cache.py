@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ agknow tests
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Tests of the on-disk cache of the JSON responses.
+"""
+import shutil
+import tempfile
+import time
+import unittest
+
+from ..agknow_metadata_cache import MetadataCache
+
+URL = "https://example.com/agknow/api/v4/parcels/1/?key=secret"
+
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = MetadataCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_miss(self):
+        self.assertEqual(self.cache.lookup(URL), (None, {}))
+
+    def test_response_without_validators_is_requested_again(self):
+        self.cache.put(URL, "{}", {})
+
+        self.assertEqual(self.cache.lookup(URL), (None, {}))
+
+    def test_ttl(self):
+        self.cache.put(URL, "{}", {})
+
+        self.assertEqual(self.cache.lookup(URL, use_ttl=True), ("{}", {}))
+        self.assertEqual(self.cache.stats()["fresh"], 1)
+
+        self.cache.ttl = 0
+        self.assertEqual(self.cache.lookup(URL, use_ttl=True), (None, {}))
+
+    def test_ttl_does_not_skip_validation(self):
+        self.cache.put(URL, "{}", {"ETag": '"v1"'})
+
+        self.assertEqual(self.cache.lookup(URL, use_ttl=True), (None, {"If-None-Match": '"v1"'}))
+
+    def test_validators_are_sent(self):
+        self.cache.put(URL, "{}", {"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2018 00:00:00 GMT"})
+
+        body, headers = self.cache.lookup(URL)
+
+        self.assertIsNone(body)
+        self.assertEqual(headers, {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2018 00:00:00 GMT"})
+
+    def test_not_modified(self):
+        self.cache.put(URL, '{"a": 1}', {"ETag": '"v1"'})
+
+        self.assertEqual(self.cache.not_modified(URL, {"ETag": '"v2"'}), '{"a": 1}')
+        self.assertEqual(self.cache.lookup(URL)[1], {"If-None-Match": '"v2"'})
+        self.assertEqual(self.cache.stats()["revalidated"], 1)
+
+    def test_not_modified_after_eviction(self):
+        self.assertIsNone(self.cache.not_modified(URL))
+
+    def test_key_is_not_stored(self):
+        self.cache.put(URL, "{}", {"ETag": '"v1"'})
+        self.cache.flush()
+
+        with open(self.cache.index_path) as f:
+            self.assertNotIn("secret", f.read())
+
+    def test_lru_eviction(self):
+        self.cache.set_max_bytes(10)
+
+        self.cache.put(URL + "1", "1" * 4, {"ETag": "1"})
+        time.sleep(0.01)
+        self.cache.put(URL + "2", "2" * 4, {"ETag": "2"})
+        time.sleep(0.01)
+        self.cache.put(URL + "3", "3" * 4, {"ETag": "3"})
+
+        self.assertEqual(self.cache.stats()["entries"], 2)
+        self.assertEqual(self.cache.lookup(URL + "1"), (None, {}))
+
+    def test_index_is_persistent(self):
+        self.cache.put(URL, "{}", {"ETag": '"v1"'})
+        self.cache.flush()
+
+        cache = MetadataCache(self.cache_dir)
+
+        self.assertEqual(cache.lookup(URL)[1], {"If-None-Match": '"v1"'})
+        self.assertEqual(cache.not_modified(URL), "{}")
+
+    def test_remove_and_clear(self):
+        self.cache.put(URL, "{}", {"ETag": "1"})
+        self.cache.put(URL + "2", "{}", {"ETag": "2"})
+
+        self.cache.remove(URL)
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
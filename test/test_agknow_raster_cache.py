@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ agknow tests
+                                 A QGIS plugin
+ Plugin for using the agknow API from geo|cledian
+                             -------------------
+        begin                : 2018-07-18
+        git sha              : $Format:%H$
+        copyright            : (C) 2018 by geo|cledian.com
+        email                : jsommer@geocledian.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Tests of the on-disk raster cache.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..agknow_raster_cache import RasterCache
+
+
+def key(raster_id):
+    return RasterCache.make_key("https://example.com", "/agknow/api/v4", 1, "vitality", "sentinel2", raster_id,
+                                "tif")
+
+
+class RasterCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = RasterCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def objects(self):
+        return [f for _, _, files in os.walk(self.cache.objects_dir) for f in files]
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get(key(1)))
+
+        self.cache.put(key(1), b"image")
+
+        self.assertTrue(self.cache.contains(key(1)))
+        self.assertEqual(self.cache.get(key(1)), b"image")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_put_stream_and_open(self):
+        self.cache.put_stream(key(1), [b"ab", b"cd", b"ef"])
+
+        f = self.cache.open(key(1))
+        try:
+            self.assertEqual(f.read(), b"abcdef")
+        finally:
+            f.close()
+
+        self.assertEqual(self.cache.size(), 6)
+        # no temporary files are left
+        self.assertEqual(len(self.objects()), 1)
+
+    def test_failed_stream_leaves_nothing(self):
+        def chunks():
+            yield b"ab"
+            raise IOError("connection lost")
+
+        with self.assertRaises(IOError):
+            self.cache.put_stream(key(1), chunks())
+
+        self.assertFalse(self.cache.contains(key(1)))
+        self.assertEqual(self.objects(), [])
+
+    def test_identical_images_are_stored_once(self):
+        self.cache.put(key(1), b"same")
+        self.cache.put(key(2), b"same")
+
+        self.assertEqual(len(self.objects()), 1)
+
+        self.cache.remove(key(1))
+        self.assertEqual(self.cache.get(key(2)), b"same")
+
+        self.cache.remove(key(2))
+        self.assertEqual(self.objects(), [])
+
+    def test_replaced_entry_releases_its_object(self):
+        self.cache.put(key(1), b"old")
+        self.cache.put(key(1), b"new")
+
+        self.assertEqual(self.cache.get(key(1)), b"new")
+        self.assertEqual(len(self.objects()), 1)
+
+    def test_lru_eviction(self):
+        self.cache.set_max_bytes(10)
+
+        self.cache.put(key(1), b"1" * 4)
+        self.cache.put(key(2), b"2" * 4)
+        # key 1 is used more recently than key 2
+        self.cache._entries[self.cache._entry_id(key(1))]["atime"] += 10
+        self.cache.put(key(3), b"3" * 4)
+
+        self.assertTrue(self.cache.contains(key(1)))
+        self.assertFalse(self.cache.contains(key(2)))
+        self.assertTrue(self.cache.contains(key(3)))
+        self.assertLessEqual(self.cache.size(), 10)
+
+    def test_missing_object_is_a_miss(self):
+        self.cache.put(key(1), b"image")
+
+        for root, _, files in os.walk(self.cache.objects_dir):
+            for f in files:
+                os.remove(os.path.join(root, f))
+
+        self.assertIsNone(self.cache.get(key(1)))
+        self.assertFalse(self.cache.contains(key(1)))
+
+    def test_index_is_persistent(self):
+        self.cache.put(key(1), b"image")
+        self.cache.flush()
+
+        cache = RasterCache(self.cache_dir)
+
+        self.assertEqual(cache.get(key(1)), b"image")
+        self.assertEqual(cache.size(), 5)
+
+    def test_clear(self):
+        self.cache.put(key(1), b"image")
+        self.cache.clear()
+
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        self.assertEqual(self.objects(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()